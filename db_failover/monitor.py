@@ -3,22 +3,31 @@
 
    Installed by config/db_failover.
    Assumes db_failover_flag has been initialized by config/provision_db_later.
+   The failover is prepared (see promotion.py) before monitoring starts, so
+   that the connection to the local database is already open when needed.
+   Exits with status 1 if any Step of the failover failed.
    """
 
-import subprocess
+import sys
 import time
 
 from psycopg2 import sql
 import psycopg2
 
 from hfshared import Credentials, Database
+from promotion import Promotion
 
 # The following connection parameters are set by config/db_failover.
 cred = Credentials('DB_USER', 'DB_PWD')
 partner_db = Database('PARTNER_IP', 'DB_NAME')
 local_db = Database('localhost', 'DB_NAME')
 
+# The following role (standby or master) is set by config/db_failover.
+promotion = Promotion('ROLE', local_db, cred,
+                      log=lambda line: print(line, flush=True))
+
 running = True
+failed = False
 
 while running:
     try:
@@ -28,11 +37,9 @@ while running:
         running = not partner_db.cur.fetchone()[0]
         partner_db.disconnect()
     except psycopg2.OperationalError:
-        subprocess.run(['/bin/bash', '/home/ubuntu/db_failover/failover'])
-        local_db.connect(cred)
-        update = ("UPDATE db_failover_flag SET flag = TRUE")
-        local_db.cur.execute(sql.SQL(update))
-        local_db.conn.commit()
+        failed = any(timing.error for timing in promotion.run())
         local_db.disconnect()
         running = False
     time.sleep(15)
+
+sys.exit(1 if failed else 0)
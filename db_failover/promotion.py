@@ -0,0 +1,397 @@
+# promotion.py
+"""Pipeline taking over from a failed database partner, timed step by step.
+
+   Installed by config/db_failover, and used by monitor.py once the partner
+   is found dead. A failover is a Pipeline of Steps, each of which starts as
+   soon as the Steps it follows have finished, on a pool of threads, so that
+   Steps independent of one another run concurrently. On the standby:
+
+       promote     pg_ctl promote
+       unassign    unassign the floating IP from the master's interface
+       assign      assign it to the standby's (after unassign)
+       accept      apply the netplan config accepting it (after assign, since
+                   applying it may briefly interrupt the network)
+       flag        set db_failover_flag (after promote)
+
+   so the floating IP is moved while Postgres is promoted. On the master,
+   whose commits hang until synchronization to the dead standby is disabled:
+
+       desync      clear synchronous_standby_names
+       reload      reload postgresql (after desync)
+       flag        set db_failover_flag (after reload)
+
+   Whatever can be known before the failover is found out when a Promotion
+   is prepared, at startup: the paths of pg_ctl, the data directory, and the
+   config file (pg_ctl was formerly found by searching the whole disk), and
+   the connection to the local database, which is opened then and reopened
+   only if lost. Each Step is timed and logged as it finishes, as is the
+   whole Pipeline.
+
+   Run as a script, a dry run benchmarks the Pipeline of either role against
+   a local stand-in: each command is replaced by a sleep of given latency,
+   and the flag by a query (which changes nothing) on a given database, if
+   any, e.g.
+
+       python3 promotion.py standby --dry-run --repeat 5 \\
+           --latency promote=2 unassign=1 assign=1 accept=2
+
+   reports the time of each Step and of the Pipeline, against that of the
+   same Steps run one after another.
+   """
+
+import argparse
+from concurrent.futures import Future, ThreadPoolExecutor
+import glob
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from psycopg2 import sql
+import psycopg2
+
+from hfshared import Credentials, Database
+
+# The following are set on the standby by config/db_failover.
+NETPLAN_YAML = ''
+FLOATING_IP = ''
+STANDBY_ENI = ''
+MASTER_ENI = ''
+STANDBY_REGION = ''
+MASTER_REGION = ''
+
+RECOVERY_POLL = .1
+"""Seconds between checks whether promoted Postgres has left recovery"""
+
+RECOVERY_TIMEOUT = 60.
+"""Seconds allowed promoted Postgres to leave recovery before the flag Step
+   fails"""
+
+FLAG_ATTEMPTS = 3
+"""Number of connections to the local database tried by the flag Step"""
+
+
+class Step(NamedTuple):
+    """Step of a Pipeline.
+
+    Attributes:
+        name: A string naming the Step.
+        action: A callable performing the Step, raising an exception if it
+                fails.
+        after: A tuple of the names of the Steps that must finish (without
+               failing) before this Step starts.
+    """
+
+    name: str
+    action: Callable[[], None]
+    after: Tuple[str, ...] = ()
+
+
+class Timing(NamedTuple):
+    """Timing of a Step run by a Pipeline.
+
+    Attributes:
+        name: A string naming the Step.
+        start: A float, the seconds from the start of the Pipeline to the
+               start of the Step.
+        end: A float, the seconds from the start of the Pipeline to the end
+             of the Step.
+        error: A string describing why the Step failed (or was skipped), or
+               None if it succeeded.
+    """
+
+    name: str
+    start: float
+    end: float
+    error: str = None
+
+    @property
+    def seconds(self) -> float:
+        """Returns duration of Step in seconds."""
+        return self.end - self.start
+
+
+class Pipeline:
+    """Steps run concurrently, each once those it follows have finished.
+
+    Attributes:
+        steps: A list of Steps, each listed after those it follows.
+        log: A callable logging a line of text.
+    """
+
+    def __init__(self,
+                 steps: Sequence[Step],
+                 log: Callable[[str], None] = print) -> None:
+        """Initializes Pipeline of given Steps, logging to given callable."""
+        names = set()
+        for step in steps:
+            assert names.issuperset(step.after), step.name
+            names.add(step.name)
+        self.steps = list(steps)
+        self.log = log
+
+    def run(self) -> List[Timing]:
+        """Runs Steps, skipping any following a Step that failed, and returns
+           their Timings, in order listed."""
+        origin = time.perf_counter()
+        futures: Dict[str, Future] = {}
+
+        def perform(step: Step) -> Timing:
+            failed = [name for name in step.after
+                      if futures[name].result().error]
+            start = time.perf_counter() - origin
+            error = None
+            if failed:
+                error = f"skipped after {', '.join(failed)} failed"
+            else:
+                try:
+                    step.action()
+                except Exception as exception:
+                    error = f"{type(exception).__name__}: {exception}"
+            timing = Timing(step.name,
+                            start,
+                            time.perf_counter() - origin,
+                            error)
+            self.log(f"...{step.name} {error or 'done'} in "
+                     f"{timing.seconds:.3f}s (at {timing.end:.3f}s)...")
+            return timing
+
+        with ThreadPoolExecutor(max_workers=len(self.steps) or 1) as pool:
+            for step in self.steps:
+                futures[step.name] = pool.submit(perform, step)
+            timings = [futures[step.name].result() for step in self.steps]
+        elapsed = time.perf_counter() - origin
+        failed = sum(1 for timing in timings if timing.error)
+        self.log(f"...{len(timings)} step(s) finished in {elapsed:.3f}s "
+                 f"({sum(timing.seconds for timing in timings):.3f}s one "
+                 f"after another), {failed} failed or skipped...")
+        return timings
+
+
+def run(*command: str) -> str:
+    """Runs given command, raising subprocess.CalledProcessError if it
+       fails, and returns its standard output, stripped."""
+    return subprocess.run(command,
+                          check=True,
+                          stdout=subprocess.PIPE,
+                          universal_newlines=True).stdout.strip()
+
+
+def postgres_setting(name: str) -> str:
+    """Returns value of given setting of local Postgres."""
+    return run('sudo', '-u', 'postgres', 'psql', '-A', '-t', '-c',
+               f"show {name};")
+
+
+def find_pg_ctl() -> str:
+    """Returns path of pg_ctl, looked for where Ubuntu installs it before
+       searching the whole disk."""
+    found = sorted(glob.glob('/usr/lib/postgresql/*/bin/pg_ctl'))
+    if found:
+        return found[-1]
+    return run('find', '/', '-name', 'pg_ctl', '-type', 'f').split('\n')[0]
+
+
+class Promotion:
+    """Failover of this database server, prepared in advance.
+
+    Attributes:
+        role: A string, 'standby' or 'master', the role of this server.
+        database: A Database, the local database, kept connected if
+                  possible.
+        credentials: Credentials for the local database, or None if there is
+                     none (in a dry run).
+        dry_run: A bool, whether commands are replaced by stand-ins.
+        latencies: A dict with keys names of Steps and values the seconds
+                   their stand-ins sleep in a dry run.
+        log: A callable logging a line of text.
+        paths: A dict with keys 'pg_ctl', 'data_directory', and
+               'config_file' and values the corresponding paths (as needed
+               by role, and not in a dry run).
+    """
+
+    def __init__(self,
+                 role: str,
+                 database: Optional[Database],
+                 credentials: Optional[Credentials],
+                 dry_run: bool = False,
+                 latencies: Dict[str, float] = None,
+                 log: Callable[[str], None] = print) -> None:
+        """Initializes Promotion, finding out paths and connecting to local
+           database (which, unless in a dry run, must be given)."""
+        assert role in ('standby', 'master')
+        assert dry_run or database is not None
+        self.role = role
+        self.database = database
+        self.credentials = credentials
+        self.dry_run = dry_run
+        self.latencies = latencies or {}
+        self.log = log
+        self.paths: Dict[str, str] = {}
+        if not dry_run:
+            if role == 'standby':
+                self.paths['pg_ctl'] = find_pg_ctl()
+                self.paths['data_directory'] = postgres_setting(
+                    'data_directory')
+            else:
+                self.paths['config_file'] = postgres_setting('config_file')
+        self.connect()
+
+    def connect(self) -> bool:
+        """Connects to local database, if any and not connected already,
+           and returns whether it is connected."""
+        if self.database is None:
+            return False
+        if self.database.conn and not self.database.conn.closed:
+            return True
+        self.database.disconnect()
+        try:
+            self.database.connect(self.credentials)
+            self.database.conn.autocommit = True
+            return True
+        except psycopg2.OperationalError as error:
+            self.log(f"...local database unreachable: {error}...")
+            self.database.disconnect()
+            return False
+
+    def commands(self) -> Dict[str, List[Sequence[str]]]:
+        """Returns dict with keys names of Steps (but flag) and values the
+           commands they run, in order."""
+        if self.role == 'master':
+            return {'desync': [('sudo', '-u', 'postgres', 'sed', '-i',
+                                r"s|\(synchronous_standby_names\).*|\1 = ''|",
+                                self.paths.get('config_file', 'PGCONF'))],
+                    'reload': [('sudo', 'systemctl', 'reload',
+                                'postgresql')]}
+        return {'promote': [('sudo', '-u', 'postgres',
+                             self.paths.get('pg_ctl', 'pg_ctl'), 'promote',
+                             '-D', self.paths.get('data_directory', 'DATA'))],
+                'unassign': [('aws', 'ec2', '--region', MASTER_REGION,
+                              'unassign-private-ip-addresses',
+                              '--network-interface-id', MASTER_ENI,
+                              '--private-ip-addresses', FLOATING_IP)],
+                'assign': [('aws', 'ec2', '--region', STANDBY_REGION,
+                            'assign-private-ip-addresses',
+                            '--network-interface-id', STANDBY_ENI,
+                            '--private-ip-addresses', FLOATING_IP)],
+                'accept': [('sudo', 'mv', f"/home/ubuntu/{NETPLAN_YAML}",
+                            '/etc/netplan/'),
+                           ('sudo', 'netplan', 'apply')]}
+
+    def steps(self) -> List[Step]:
+        """Returns Steps of failover (or of its stand-in), in order."""
+        after = ({'reload': ('desync',), 'flag': ('reload',)}
+                 if self.role == 'master'
+                 else {'assign': ('unassign',),
+                       'accept': ('assign',),
+                       'flag': ('promote',)})
+        steps = [Step(name, self.action(name, commands), after.get(name, ()))
+                 for name, commands in self.commands().items()]
+        steps.append(Step('flag', self.flag, after['flag']))
+        return steps
+
+    def action(self,
+               name: str,
+               commands: List[Sequence[str]]) -> Callable[[], None]:
+        """Returns callable running given commands of Step of given name, or
+           in a dry run sleeping instead."""
+        def act() -> None:
+            if self.dry_run:
+                time.sleep(self.latencies.get(name, 0))
+                return
+            for command in commands:
+                run(*command)
+        return act
+
+    def flag(self) -> None:
+        """Sets db_failover_flag, once the local database accepts writes, on
+           the connection opened in advance (reopened if lost), raising
+           TimeoutError if it is still in recovery after RECOVERY_TIMEOUT
+           seconds; in a dry run, only checks whether the local database is
+           in recovery."""
+        if self.dry_run and self.database is None:
+            time.sleep(self.latencies.get('flag', 0))
+            return
+        deadline = time.monotonic() + RECOVERY_TIMEOUT
+        for attempt in range(FLAG_ATTEMPTS):
+            if not self.connect():
+                continue
+            try:
+                cur = self.database.cur
+                cur.execute(sql.SQL("SELECT pg_is_in_recovery()"))
+                while cur.fetchone()[0] and not self.dry_run:
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"still in recovery after "
+                                           f"{RECOVERY_TIMEOUT:g}s")
+                    time.sleep(RECOVERY_POLL)
+                    cur.execute(sql.SQL("SELECT pg_is_in_recovery()"))
+                if not self.dry_run:
+                    cur.execute(sql.SQL(
+                        "UPDATE db_failover_flag SET flag = TRUE"))
+                return
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                if attempt == FLAG_ATTEMPTS - 1:
+                    raise
+                self.database.disconnect()
+        raise psycopg2.OperationalError("local database unreachable")
+
+    def run(self) -> List[Timing]:
+        """Runs failover (or its stand-in) and returns Timings of Steps."""
+        self.log(f"...{'dry run of ' if self.dry_run else ''}"
+                 f"{self.role} failover started...")
+        return Pipeline(self.steps(), self.log).run()
+
+
+def main() -> None:
+    """Runs failover (or benchmarks its dry run) as given on command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('role', choices=['standby', 'master'])
+    parser.add_argument('--dry-run', action='store_true',
+                        help='replace commands by sleeps and the flag by a '
+                             'query')
+    parser.add_argument('--latency', nargs='*', default=[],
+                        metavar='STEP=SECONDS',
+                        help='seconds the stand-in of a step sleeps')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--db-host', default='localhost')
+    parser.add_argument('--db-name', help='local database (required unless '
+                                          'a dry run)')
+    parser.add_argument('--db-user')
+    parser.add_argument('--db-password')
+    args = parser.parse_args()
+    if not args.dry_run and not args.db_name:
+        parser.error('--db-name is required unless --dry-run')
+    latencies = {}
+    for latency in args.latency:
+        name, _, seconds = latency.partition('=')
+        latencies[name] = float(seconds)
+
+    database = credentials = None
+    if args.db_name:
+        database = Database(args.db_host, args.db_name)
+        credentials = Credentials(args.db_user, args.db_password)
+    promotion = Promotion(args.role, database, credentials,
+                          dry_run=args.dry_run,
+                          latencies=latencies,
+                          log=lambda line: print(line, flush=True))
+    runs = [promotion.run() for _ in range(args.repeat)]
+    if database:
+        database.disconnect()
+
+    print(f"{'step':<10} {'min (s)':>9} {'mean (s)':>9} {'max (s)':>9}")
+    for index, step in enumerate(runs[0]):
+        seconds = [timings[index].seconds for timings in runs]
+        print(f"{step.name:<10} {min(seconds):>9.3f} "
+              f"{sum(seconds) / len(seconds):>9.3f} {max(seconds):>9.3f}")
+    elapsed = [max(timing.end for timing in timings) for timings in runs]
+    serial = [sum(timing.seconds for timing in timings) for timings in runs]
+    print(f"{'pipeline':<10} {min(elapsed):>9.3f} "
+          f"{sum(elapsed) / len(elapsed):>9.3f} {max(elapsed):>9.3f}")
+    print(f"{'serial':<10} {min(serial):>9.3f} "
+          f"{sum(serial) / len(serial):>9.3f} {max(serial):>9.3f}")
+    sys.exit(1 if any(timing.error for timings in runs
+                      for timing in timings) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+# benchmark.py
+"""Benchmarks for the ml library and the model selection workflow.
+
+Times each stage below, and measures the memory it allocates, on datasets
+simulated by ml.simulate from a fixed seed (in a given dtype, with a given
+number of targets), for every combination of given feature dimensions,
+cardinalities, and numbers of folds K:
+
+    Mask.get_array
+        binary representation of a fold Mask (whose full_dim is cardinality)
+
+    LabeledData.k_split
+        random partition of the data into K fold Masks
+
+    LinearPredictor.fit
+        least-squares fit on the data off one fold, using all features
+
+    LinearPredictor.error
+        error of the fitted predictor on that fold
+
+    model_select
+        the entire task graph of selection.py, run in process in topological
+        order against LocalPythonObjectBucket, so without Airflow or Riak
+
+For each stage the report gives the least time over all repeats, the memory
+allocated by (and still held after) a single run, and the peak memory in use
+during that run above the level at its start, as traced by tracemalloc.
+
+Results can be saved as JSON and compared against a previous save, in which
+case any stage whose time or peak memory exceeds that saved by more than a
+given tolerance is flagged as a regression and the exit status is 1.
+
+Example:
+    python3 benchmark.py --feature-dims 4 8 --cardinalities 100 1000 \\
+        --save before.json
+    python3 benchmark.py --feature-dims 4 8 --cardinalities 100 1000 \\
+        --compare before.json
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, NamedTuple
+
+import numpy as np
+
+import ml
+from local_python_object_bucket import LocalPythonObjectBucket
+import local_runner
+import selection
+
+
+class Measurement(NamedTuple):
+    """Cost of a benchmarked stage.
+
+    Attributes:
+        seconds: A float, the least time taken by the stage over all repeats.
+        allocated: An int, the bytes allocated and still held after one run.
+        peak: An int, the peak bytes in use during one run above the level at
+              its start.
+    """
+
+    seconds: float
+    allocated: int
+    peak: int
+
+
+def measure(stage: Callable[[], Any], repeat: int) -> Measurement:
+    """Runs given stage repeat times for timing, then once more under
+       tracemalloc, and returns the resulting Measurement."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stage()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = stage()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return Measurement(min(times), after - before, peak - before)
+
+
+def run_model_select(feature_dim: int,
+                     cardinality: int,
+                     k: int,
+                     seed: int,
+                     dtype: str = 'float64',
+                     targets: int = 1) -> None:
+    """Runs the model selection task graph in process for given parameters,
+       with fresh LocalPythonObjectBuckets, restoring the constants and
+       bucket_type of selection afterwards."""
+    constants = {'DTYPE': dtype,
+                 'TARGETS': targets,
+                 'FEATURE_DIM': feature_dim,
+                 'CARDINALITY': cardinality,
+                 'K': k}
+    saved = {name: getattr(selection, name)
+             for name in [*constants, 'bucket_type']}
+    try:
+        local_runner.configure(constants, store=None, seed=seed)
+        LocalPythonObjectBucket.clear()
+        graph = selection.task_graph()
+        for task_id in selection.topological_order(graph):
+            graph[task_id].callable(*graph[task_id].args)
+    finally:
+        for name, value in saved.items():
+            setattr(selection, name, value)
+
+
+def benchmark(feature_dim: int,
+              cardinality: int,
+              k: int,
+              seed: int,
+              repeat: int,
+              dtype: str = 'float64',
+              targets: int = 1) -> Dict[str, Measurement]:
+    """Returns dict with keys stage names and values Measurements of those
+       stages for given parameters."""
+    np.random.seed(seed)
+    data = ml.simulate(feature_dim=feature_dim,
+                       cardinality=cardinality,
+                       target_scale=selection.TARGET_SCALE,
+                       X_scale=selection.X_SCALE,
+                       error_scale=selection.ERROR_SCALE,
+                       dtype=dtype,
+                       targets=targets).data
+    fold = data.k_split(k)[0]
+    train = data.get_subset(fold.complement())
+    test = data.get_subset(fold)
+    predictor = ml.LinearPredictor()
+    predictor.fit(train)
+    stages = {'Mask.get_array': fold.get_array,
+              'LabeledData.k_split': lambda: data.k_split(k),
+              'LinearPredictor.fit': lambda: ml.LinearPredictor().fit(train),
+              'LinearPredictor.error': lambda: predictor.error(test),
+              'model_select': lambda: run_model_select(feature_dim,
+                                                       cardinality,
+                                                       k,
+                                                       seed,
+                                                       dtype,
+                                                       targets)}
+    return {name: measure(stage, repeat) for name, stage in stages.items()}
+
+
+def main() -> None:
+    """Runs benchmarks specified on the command line and reports results."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--feature-dims', type=int, nargs='+', default=[4, 8])
+    parser.add_argument('--cardinalities', type=int, nargs='+',
+                        default=[100, 1000])
+    parser.add_argument('--ks', type=int, nargs='+', default=[5])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dtype', choices=['float32', 'float64'],
+                        default='float64')
+    parser.add_argument('--targets', type=int, default=1)
+    parser.add_argument('--save', help='path of JSON file to save results to')
+    parser.add_argument('--compare',
+                        help='path of JSON file of saved results to compare')
+    parser.add_argument('--tolerance', type=float, default=.25,
+                        help='fractional increase flagged as a regression')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as saved:
+            baseline = json.load(saved)
+    results = {}
+    regressed = False
+    print(f"{'stage':<22} {'d':>3} {'N':>7} {'K':>3} "
+          f"{'time (ms)':>12} {'alloc (KiB)':>12} {'peak (KiB)':>12}")
+    for feature_dim in args.feature_dims:
+        for cardinality in args.cardinalities:
+            for k in args.ks:
+                measurements = benchmark(feature_dim, cardinality, k,
+                                         args.seed, args.repeat,
+                                         args.dtype,
+                                         args.targets)
+                for stage, measurement in measurements.items():
+                    key = (f"{stage} d={feature_dim} N={cardinality} K={k} "
+                           f"dtype={args.dtype} T={args.targets}")
+                    results[key] = measurement._asdict()
+                    line = (f"{stage:<22} {feature_dim:>3} {cardinality:>7} "
+                            f"{k:>3} {measurement.seconds * 1e3:>12.3f} "
+                            f"{measurement.allocated / 1024:>12.1f} "
+                            f"{measurement.peak / 1024:>12.1f}")
+                    if key in baseline:
+                        old = Measurement(**baseline[key])
+                        ratio = measurement.seconds / old.seconds
+                        line += f"  x{ratio:.2f}"
+                        limit = 1 + args.tolerance
+                        if (ratio > limit
+                                or measurement.peak > old.peak * limit):
+                            line += "  REGRESSION"
+                            regressed = True
+                    print(line)
+    if args.save:
+        with open(args.save, 'w') as save:
+            json.dump(results, save, indent=1)
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == '__main__':
+    main()
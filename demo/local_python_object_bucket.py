@@ -0,0 +1,100 @@
+# local_python_object_bucket.py
+"""Provides in-memory and on-disk stand-ins for RiakPythonObjectBucket."""
+
+from typing import Any, Dict
+import os
+import pickle
+import shutil
+import threading
+import urllib.parse
+
+
+class LocalPythonObjectBucket:
+    """In-memory stand-in for RiakPythonObjectBucket.
+
+    Buckets of the same name share their contents, as do Riak buckets, within
+    a process. Objects are stored pickled, so that (as with Riak) every put and
+    get pays for serialization and every get returns a fresh copy.
+
+    Attributes:
+        bucket: A string naming the bucket.
+    """
+
+    store: Dict[str, Dict[str, bytes]] = {}
+    """Pickled contents of every bucket, keyed by bucket name then key."""
+
+    lock = threading.Lock()
+    """Lock guarding store."""
+
+    def __init__(self, bucket: str) -> None:
+        """Initializes LocalPythonObjectBucket with given bucket name."""
+        self.bucket = bucket
+        with self.lock:
+            self.store.setdefault(bucket, {})
+
+    def put(self, key: str, pyobj: Any) -> None:
+        """Sets given pyobject as value of given key."""
+        pickled = pickle.dumps(pyobj)
+        with self.lock:
+            self.store[self.bucket][key] = pickled
+
+    def get(self, key: str) -> Any:
+        """Retrieves value of given key (None, as in Riak, if key unset)."""
+        with self.lock:
+            pickled = self.store[self.bucket].get(key)
+        return None if pickled is None else pickle.loads(pickled)
+
+    @classmethod
+    def clear(cls) -> None:
+        """Empties all buckets."""
+        with cls.lock:
+            cls.store.clear()
+
+
+class FilePythonObjectBucket:
+    """On-disk stand-in for RiakPythonObjectBucket.
+
+    Each object is pickled to its own file, named for its key, in a directory
+    named for its bucket under the directory root. Unlike
+    LocalPythonObjectBucket, buckets are thereby shared between processes.
+
+    Attributes:
+        bucket: A string naming the bucket.
+        path: A string, the path of the directory holding the bucket.
+    """
+
+    root = 'buckets'
+    """Path of the directory holding all buckets."""
+
+    def __init__(self, bucket: str) -> None:
+        """Initializes FilePythonObjectBucket with given bucket name, creating
+           its directory if necessary."""
+        self.bucket = bucket
+        self.path = os.path.join(self.root,
+                                 urllib.parse.quote(bucket, safe=''))
+        os.makedirs(self.path, exist_ok=True)
+
+    def put(self, key: str, pyobj: Any) -> None:
+        """Sets given pyobject as value of given key."""
+        path = self.key_path(key)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(temporary, 'wb') as file:
+            pickle.dump(pyobj, file)
+        os.replace(temporary, path)  # so that readers never see partial files
+
+    def get(self, key: str) -> Any:
+        """Retrieves value of given key (None, as in Riak, if key unset)."""
+        try:
+            with open(self.key_path(key), 'rb') as file:
+                return pickle.load(file)
+        except FileNotFoundError:
+            return None
+
+    def key_path(self, key: str) -> str:
+        """Returns path of the file storing the value of given key."""
+        return os.path.join(self.path, urllib.parse.quote(key, safe=''))
+
+    @classmethod
+    def clear(cls) -> None:
+        """Deletes all buckets."""
+        shutil.rmtree(cls.root, ignore_errors=True)
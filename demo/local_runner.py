@@ -0,0 +1,220 @@
+# local_runner.py
+"""In-process executor for the model selection task graph.
+
+Runs the task graph of selection.py on a single machine, without Airflow or
+Riak: tasks store their results in LocalPythonObjectBuckets (in memory) or,
+given a store directory, FilePythonObjectBuckets (on disk), and each task is
+submitted to a pool of threads or processes as soon as every task it awaits
+has finished. Processes share buckets only on disk, so require a store.
+
+After the run the executor reports the wall-clock time, the total time
+spent in tasks, the time spent in each kind of task, the slowest tasks, and
+the critical path: the chain of dependent tasks of greatest total duration,
+which bounds the wall-clock time however many workers are available.
+
+With --memoize tasks are memoized (see selection.py) under given
+--data-version, and the store is kept between runs, so that a run repeating
+the inputs of an earlier run finds every task already completed.
+
+With --workers 0 tasks instead run one after another in the main thread,
+which permits profiling, for example by
+    python3 -m cProfile -s cumtime local_runner.py --workers 0
+
+Example:
+    python3 local_runner.py --feature-dim 6 --cardinality 1000 --workers 8
+"""
+
+import argparse
+from collections import defaultdict
+from concurrent.futures import (Executor,
+                                FIRST_COMPLETED,
+                                ProcessPoolExecutor,
+                                ThreadPoolExecutor,
+                                wait)
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+from local_python_object_bucket import (FilePythonObjectBucket,
+                                        LocalPythonObjectBucket)
+import selection
+
+
+class Timing(NamedTuple):
+    """Start and finish times of a task, in seconds since the epoch."""
+    start: float
+    finish: float
+
+    def duration(self) -> float:
+        """Returns the time taken by the task, in seconds."""
+        return self.finish - self.start
+
+
+def execute(task_callable: Callable[..., None], args: Tuple) -> Timing:
+    """Calls given task callable on given args and returns its Timing."""
+    start = time.time()
+    task_callable(*args)
+    return Timing(start, time.time())
+
+
+def configure(constants: Dict[str, Any], store: str, seed: int) -> None:
+    """Sets given constants of selection module and its bucket_type (on-disk
+       under given store directory if any, otherwise in-memory), and seeds
+       NumPy's random number generator; run in each worker process."""
+    for name, value in constants.items():
+        setattr(selection, name, value)
+    if store:
+        FilePythonObjectBucket.root = store
+        selection.bucket_type = FilePythonObjectBucket
+    else:
+        selection.bucket_type = LocalPythonObjectBucket
+    np.random.seed(seed)
+
+
+def run(graph: Dict[str, selection.Task],
+        executor: Executor = None) -> Dict[str, Timing]:
+    """Runs given task graph, submitting each task to given Executor once
+       all tasks it awaits have finished (or, if no Executor is given,
+       running all tasks in topological order in the calling thread), and
+       returns dict with keys task ids and values their Timings."""
+    if executor is None:
+        return {task_id: execute(graph[task_id].callable, graph[task_id].args)
+                for task_id in selection.topological_order(graph)}
+    awaiting = {task_id: len(task.upstream) for task_id, task in graph.items()}
+    downstream = defaultdict(list)
+    for task_id, task in graph.items():
+        for upstream in task.upstream:
+            downstream[upstream].append(task_id)
+    ready = [task_id for task_id, count in awaiting.items() if count == 0]
+    running = {}
+    timings = {}
+    while ready or running:
+        for task_id in ready:
+            future = executor.submit(execute,
+                                     graph[task_id].callable,
+                                     graph[task_id].args)
+            running[future] = task_id
+        ready = []
+        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in finished:
+            task_id = running.pop(future)
+            timings[task_id] = future.result()
+            for successor in downstream[task_id]:
+                awaiting[successor] -= 1
+                if awaiting[successor] == 0:
+                    ready.append(successor)
+    return timings
+
+
+def critical_path(graph: Dict[str, selection.Task],
+                  timings: Dict[str, Timing]) -> List[str]:
+    """Returns list of ids of the chain of dependent tasks in given graph of
+       greatest total duration, according to given Timings."""
+    total = {}
+    via = {}
+    for task_id in selection.topological_order(graph):
+        upstream = max(graph[task_id].upstream,
+                       key=total.get,
+                       default=None)
+        via[task_id] = upstream
+        total[task_id] = (timings[task_id].duration()
+                          + (total[upstream] if upstream else 0))
+    path = [max(total, key=total.get)]
+    while via[path[-1]]:
+        path.append(via[path[-1]])
+    return path[::-1]
+
+
+def report(graph: Dict[str, selection.Task],
+           timings: Dict[str, Timing],
+           top: int) -> None:
+    """Prints summary of given Timings of given graph, listing given number
+       of slowest tasks."""
+    wall = (max(timing.finish for timing in timings.values())
+            - min(timing.start for timing in timings.values()))
+    busy = sum(timing.duration() for timing in timings.values())
+    print(f"{len(timings)} tasks in {wall:.3f} s wall-clock, "
+          f"{busy:.3f} s in tasks (mean parallelism {busy / wall:.2f})")
+
+    print("\nTime by task callable:")
+    by_callable = defaultdict(list)
+    for task_id, timing in timings.items():
+        by_callable[graph[task_id].callable.__name__].append(timing.duration())
+    for name, durations in sorted(by_callable.items(),
+                                  key=lambda item: -sum(item[1])):
+        print(f"  {name:<16} {len(durations):>6} tasks "
+              f"{sum(durations):>10.3f} s total "
+              f"{np.mean(durations) * 1e3:>10.3f} ms mean")
+
+    print(f"\nSlowest {top} tasks:")
+    slowest = sorted(timings, key=lambda task_id: -timings[task_id].duration())
+    for task_id in slowest[:top]:
+        print(f"  {task_id:<40} {timings[task_id].duration() * 1e3:>10.3f} ms")
+
+    path = critical_path(graph, timings)
+    length = sum(timings[task_id].duration() for task_id in path)
+    print(f"\nCritical path ({length:.3f} s, "
+          f"{100 * length / wall:.1f}% of wall-clock):")
+    for task_id in path:
+        print(f"  {task_id:<40} {timings[task_id].duration() * 1e3:>10.3f} ms")
+
+
+def main() -> None:
+    """Runs the task graph as specified on the command line and reports."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--feature-dim', type=int,
+                        default=selection.FEATURE_DIM)
+    parser.add_argument('--cardinality', type=int,
+                        default=selection.CARDINALITY)
+    parser.add_argument('--k', type=int, default=selection.K)
+    parser.add_argument('--adaptive', action='store_true',
+                        default=selection.ADAPTIVE)
+    parser.add_argument('--workers', type=int, default=4,
+                        help='size of pool (0 to run serially in process)')
+    parser.add_argument('--processes', action='store_true',
+                        help='use a process pool (requires --store)')
+    parser.add_argument('--store',
+                        help='directory for on-disk buckets (else in-memory)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--memoize', action='store_true',
+                        help='memoize tasks across runs (requires --store)')
+    parser.add_argument('--data-version', default='0',
+                        help='version of the data, if memoizing')
+    args = parser.parse_args()
+    if args.processes and not args.store:
+        parser.error('--processes requires --store')
+    if args.memoize and not args.store:
+        parser.error('--memoize requires --store')
+
+    constants = {'FEATURE_DIM': args.feature_dim,
+                 'CARDINALITY': args.cardinality,
+                 'K': args.k,
+                 'ADAPTIVE': args.adaptive}
+    if args.memoize:
+        constants.update(MEMOIZE=True, DATA_VERSION=args.data_version)
+    configure(constants, args.store, args.seed)
+    if args.store and not args.memoize:
+        FilePythonObjectBucket.clear()
+    graph = selection.task_graph()
+
+    if args.workers == 0:
+        timings = run(graph)
+    elif args.processes:
+        with ProcessPoolExecutor(args.workers,
+                                 initializer=configure,
+                                 initargs=(constants,
+                                           args.store,
+                                           args.seed)) as executor:
+            timings = run(graph, executor)
+    else:
+        with ThreadPoolExecutor(args.workers) as executor:
+            timings = run(graph, executor)
+    report(graph, timings, args.top)
+    print(f"\nSelected model {selection.bucket('report').get('model')}, "
+          f"test error {selection.bucket('report').get('test_error'):.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,31 @@
 # ml.py
-"""Library for data splitting and linear regression with feature selection."""
-
-from typing import List, NamedTuple, Tuple
+"""Library for data splitting and linear regression with feature selection.
+
+The feature vectors of a LabeledData may be a dense np.array or a sparse
+scipy.sparse matrix, kept in CSR form. scipy is needed only for sparse data:
+features are then selected by slicing columns, predictions and errors are
+computed without densifying, and fits are found iteratively by LSMR, in time
+and memory proportional to the number of nonzeros.
+
+The labels of a LabeledData may be several (T) targets per feature vector,
+as a (N, T) np.array. Every target is fit on the same features at once: a
+single triangular factorization of the design matrix serves all T targets,
+whose coefficients are the T columns of a LinearPredictor's column_rep, and
+the predictions and errors for all targets are computed by one matrix
+product, so a family of related targets costs little more than one.
+
+cross_validate evaluates many Masks of features by k-fold cross validation on
+a single machine, fanning the work out over a pool of processes that share
+the data through shared memory.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import copy
+from multiprocessing import shared_memory
+import os
+import sys
+import threading
+from typing import Any, Dict, Iterable, List, NamedTuple, Sequence, Tuple
 import numpy as np
 
 
@@ -38,8 +62,10 @@ class Mask:
 
     def get_array(self) -> np.array:
         """Returns the binary rep of Mask as a boolean (full_dim, ) np.array."""
-        return np.array([(self.code & 2**bit) == 2**bit
-                         for bit in range(self.full_dim)])
+        code_bytes = self.code.to_bytes((self.full_dim + 7) // 8, 'little')
+        return np.unpackbits(np.frombuffer(code_bytes, dtype=np.uint8),
+                             count=self.full_dim,
+                             bitorder='little').astype(bool)
 
     def save_array(self) -> None:
         """Stores the binary representation of code as the array attribute."""
@@ -50,70 +76,425 @@ class LinearPredictor:
     """A linear regression model.
 
     Attributes:
-        column_rep: When initialized, a float (d+1, 1) np.array representing
-                    a scalar-valued linear predictor on d features,
-                    with bias entry [0, 0].
+        column_rep: When initialized, a float (d+1, T) np.array representing
+                    a linear predictor of T targets on d features, with
+                    bias entries in row 0 (T is 1 for a scalar-valued
+                    predictor).
+        dtype: The float np.dtype in which fit computes, or None for that of
+               the LabeledData fitted.
+        statistics: A DesignFactorization of all LabeledData passed to
+                    partial_fit, or None if there have been none.
     """
 
-    def __init__(self, column_rep: np.array = None) -> None:
-        """Initializes LinearPredictor with column_rep, if given."""
+    def __init__(self,
+                 column_rep: np.array = None,
+                 dtype: np.dtype = None) -> None:
+        """Initializes LinearPredictor with column_rep and dtype, if given."""
         self.column_rep = column_rep
+        self.dtype = dtype
+        self.statistics: DesignFactorization = None
 
     def __str__(self) -> str:
         """Returns a string representation of LinearPredictor."""
         return str(self.column_rep)
 
     def predict(self, feature_rows: np.array) -> np.array:
-        """Assuming column_rep has been set to a (d+1, 1) np.array,
-           returns a float (N, 1) np.array whose entries are the predictions
+        """Assuming column_rep has been set to a (d+1, T) np.array,
+           returns a float (N, T) np.array whose rows are the predictions
            corresponding to the given (N, d) data np.array."""
         if self.column_rep is not None:
             return feature_rows@self.column_rep[1:] + self.column_rep[0]
         return None
 
-    def fit(self, data: 'LabeledData', mask: Mask = None) -> None:
-        """Sets column_rep to (1, d+1) least-squares predictor for given
-           LabeledData (whose inputs have d features)
-           and using only those features specified by given Mask."""
+    def fit(self,
+            data: 'LabeledData',
+            mask: Mask = None,
+            workspace: 'Workspace' = None) -> None:
+        """Sets column_rep to (d+1, T) least-squares predictor for given
+           LabeledData (whose inputs have d features, and labels T targets)
+           and using only those features specified by given Mask,
+           triangularizing the design matrix in given Workspace (by default
+           the calling thread's)."""
         if mask is None:
             mask = Mask(code=2**data.feature_dim - 1,
                         full_dim=data.feature_dim)
         else:
             assert mask.full_dim == data.feature_dim
-        Xemb = np.concatenate((np.ones((data.size, 1)),
-                               mask.get_array() * data.X),
-                              axis=1)
-        self.column_rep = np.linalg.lstsq(Xemb, data.y, rcond=-1)[0]
-        marray = mask.get_array().reshape((data.feature_dim, 1))
-        self.column_rep *= np.concatenate(([[1]], marray))
+        features = np.flatnonzero(mask.get_array())
+        dtype = self.dtype or data.dtype
+        if is_sparse(data.X):
+            self.set_columns(data.feature_dim,
+                             features,
+                             sparse_least_squares(data.X,
+                                                  data.y,
+                                                  features,
+                                                  dtype))
+            return
+        R = (workspace or thread_workspace()).triangularize(
+            data.X, data.y, features, dtype)
+        self.set_columns(data.feature_dim,
+                         features,
+                         least_squares(R[:, :features.size + 1],
+                                       R[:, features.size + 1:]))
+
+    def partial_fit(self,
+                    data: 'LabeledData',
+                    mask: Mask = None,
+                    workspace: 'Workspace' = None) -> None:
+        """Updates statistics with given batch of LabeledData and sets
+           column_rep exactly as fit would for all LabeledData passed to
+           partial_fit so far, and given Mask, in time proportional to the
+           size of the batch."""
+        if self.statistics is None:
+            self.statistics = DesignFactorization(data, workspace)
+        else:
+            self.statistics.update(data, workspace)
+        self.fit_factorization(self.statistics, mask)
+
+    def fit_factorization(self,
+                          factorization: 'DesignFactorization',
+                          mask: Mask = None) -> None:
+        """Sets column_rep exactly as fit would for the LabeledData of which
+           given DesignFactorization is a factorization, and given Mask."""
+        if mask is None:
+            mask = Mask(code=2**factorization.feature_dim - 1,
+                        full_dim=factorization.feature_dim)
+        else:
+            assert mask.full_dim == factorization.feature_dim
+        features = np.flatnonzero(mask.get_array())
+        self.set_columns(factorization.feature_dim,
+                         features,
+                         factorization.solve(features))
+
+    def set_columns(self,
+                    feature_dim: int,
+                    features: np.array,
+                    coefficients: np.array) -> None:
+        """Sets column_rep to (feature_dim+1, T) np.array with biases and
+           coefficients of given features taken from given (|features|+1, T)
+           np.array, in order, and all other coefficients zero."""
+        self.column_rep = np.zeros((feature_dim + 1, coefficients.shape[1]),
+                                   dtype=coefficients.dtype)
+        self.column_rep[0] = coefficients[0]
+        self.column_rep[1 + features] = coefficients[1:]
 
     def error(self, data: 'LabeledData') -> float:
         """Assuming column_rep has been set, returns error LinearPredictor
-           makes on given LabeledData, normalized by size of input."""
+           makes on given LabeledData, normalized by size of input (over all
+           targets, the root sum of squares of the target_errors)."""
         if self.column_rep is not None:
             return np.linalg.norm(np.linalg.norm(self.predict(data.X) - data.y,
                                                  axis=1)
-                                  / np.linalg.norm(data.X, axis=1))
+                                  / row_norms(data.X))
+        return None
+
+    def target_errors(self, data: 'LabeledData') -> np.array:
+        """Assuming column_rep has been set, returns float (T, ) np.array of
+           the errors LinearPredictor makes on each target of given
+           LabeledData, normalized by size of input."""
+        if self.column_rep is not None:
+            return np.linalg.norm((self.predict(data.X) - data.y)
+                                  / row_norms(data.X)[:, np.newaxis],
+                                  axis=0)
         return None
 
 
+def is_sparse(X: object) -> bool:
+    """Checks whether given X is a scipy.sparse matrix (without importing
+       scipy, which must already be imported if it is)."""
+    sparse = sys.modules.get('scipy.sparse')
+    return sparse is not None and sparse.issparse(X)
+
+
+def row_norms(X: object) -> np.array:
+    """Returns (N, ) np.array of Euclidean norms of the rows of given dense
+       or sparse (N, d) matrix, without forming any (N, d) temporary."""
+    if is_sparse(X):
+        return np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    return np.sqrt(np.einsum('ij,ij->i', X, X))
+
+
+RCOND = 1e-10
+"""Least ratio of smallest to largest diagonal entry of a triangular factor
+   for which least_squares trusts a QR factorization over an SVD."""
+
+
+def least_squares(A: np.array, b: np.array) -> np.array:
+    """Returns a least-squares solution x of Ax = b, for float (m, n) and
+       (m, T) np.arrays A and b (one solution per column of b).
+
+    A is factorized by QR; only if it has fewer rows than columns or its
+    triangular factor is ill-conditioned does least_squares fall back to the
+    (slower but rank-revealing) SVD, returning the minimum-norm solution.
+    """
+    if A.shape[0] >= A.shape[1]:
+        Q, R = np.linalg.qr(A)
+        diagonal = np.abs(np.diag(R))
+        if diagonal.size and diagonal.min() > RCOND * diagonal.max():
+            return np.linalg.solve(R, Q.T@b)
+    return np.linalg.lstsq(A, b, rcond=None)[0]
+
+
+SPARSE_TOL = 1e-8
+"""Relative tolerance at which sparse_least_squares stops iterating."""
+
+
+def sparse_least_squares(X: object,
+                         y: np.array,
+                         features: np.array,
+                         dtype: np.dtype) -> np.array:
+    """Returns (|features|+1, T) np.array of biases and coefficients of a
+       least-squares solution of [1 X[:, features]] c = y, for sparse (N, d)
+       matrix X and float (N, T) np.array y, found by LSMR (one target at a
+       time, the operator being shared).
+
+    The design matrix is never formed: LSMR is given a LinearOperator
+    applying the bias and the selected columns of X (sliced in CSR form), its
+    columns scaled to unit norm, which speeds convergence on one-hot data
+    whose columns are of very different norms. LSMR iterates in float64
+    whatever the dtype of X, since its stopping tolerance is finer than the
+    precision of float32; only the coefficients are of given dtype.
+    """
+    from scipy.sparse.linalg import LinearOperator, lsmr
+    Xf = X if features.size == X.shape[1] else X[:, features]
+    norms = np.sqrt(np.asarray(Xf.multiply(Xf).sum(axis=0)).ravel())
+    scale = np.empty(features.size + 1)
+    scale[0] = 1 / np.sqrt(max(X.shape[0], 1))
+    scale[1:] = 1 / np.where(norms > 0, norms, 1)
+
+    def matvec(v: np.array) -> np.array:
+        v = np.ravel(v) * scale
+        return Xf@v[1:] + v[0]
+
+    def rmatvec(u: np.array) -> np.array:
+        u = np.ravel(u)
+        return np.concatenate(([u.sum()], Xf.T@u)) * scale
+
+    design = LinearOperator((X.shape[0], features.size + 1),
+                            matvec=matvec,
+                            rmatvec=rmatvec,
+                            dtype=np.float64)
+    coefficients = np.empty((features.size + 1, y.shape[1]), dtype)
+    for column in range(y.shape[1]):
+        coefficients[:, column] = scale * lsmr(design,
+                                               y[:, column],
+                                               atol=SPARSE_TOL,
+                                               btol=SPARSE_TOL)[0]
+    return coefficients
+
+
+class Workspace:
+    """Buffer reused across fits for blocks of design matrices.
+
+    Rather than materialize the whole design matrix [1 X y] (X prefixed by a
+    column of ones, and suffixed by the labels), triangularize copies it into
+    the buffer a block of rows at a time, beneath the triangular factor of
+    the rows before, and factorizes each such block by QR, discarding Q.
+    The triangular factor of the last block is that of the whole matrix (up
+    to the signs of its rows), and the memory needed is proportional to the
+    size of a block rather than to the size of the data.
+
+    Attributes:
+        block_rows: An int, the number of rows of data in each block.
+        buffers: A dict with keys np.dtypes and values 1-dimensional
+                 np.arrays of those dtypes, the storage of blocks.
+    """
+
+    def __init__(self, block_rows: int = 4096) -> None:
+        """Initializes empty Workspace for blocks of given number of rows."""
+        self.block_rows = block_rows
+        self.buffers: Dict[np.dtype, np.array] = {}
+
+    def block(self, rows: int, columns: int, dtype: np.dtype) -> np.array:
+        """Returns uninitialized (rows, columns) np.array of given dtype, in
+           column-major order, stored in the buffer of that dtype (which is
+           enlarged if need be)."""
+        dtype = np.dtype(dtype)
+        buffer = self.buffers.get(dtype)
+        if buffer is None or buffer.size < rows * columns:
+            buffer = self.buffers[dtype] = np.empty(rows * columns, dtype)
+        return buffer[:rows * columns].reshape((rows, columns), order='F')
+
+    def triangularize(self,
+                      X: np.array,
+                      y: np.array,
+                      features: np.array,
+                      dtype: np.dtype) -> np.array:
+        """Returns upper triangular factor R, of given dtype, of the QR
+           factorization of [1 X[:, features] y], for float (N, d) and (N, T)
+           np.arrays X and y, and given feature indices; a sparse X is
+           densified a block at a time."""
+        width = features.size + 1 + y.shape[1]
+        R = np.zeros((0, width), dtype)
+        full = features.size == X.shape[1]
+        sparse = is_sparse(X)
+        for start in range(0, X.shape[0], self.block_rows):
+            stop = min(start + self.block_rows, X.shape[0])
+            block = self.block(R.shape[0] + stop - start, width, dtype)
+            block[:R.shape[0]] = R
+            rows = block[R.shape[0]:]
+            rows[:, 0] = 1
+            if sparse:
+                chunk = X[start:stop]
+                rows[:, 1:features.size + 1] = (
+                    chunk if full else chunk[:, features]).toarray()
+            elif full:
+                rows[:, 1:features.size + 1] = X[start:stop]
+            else:
+                for column, feature in enumerate(features, 1):
+                    rows[:, column] = X[start:stop, feature]
+            rows[:, features.size + 1:] = y[start:stop]
+            R = np.linalg.qr(block, mode='r').astype(dtype, copy=False)
+        return R
+
+
+_workspaces = threading.local()
+
+
+def thread_workspace() -> Workspace:
+    """Returns the calling thread's own Workspace."""
+    if not hasattr(_workspaces, 'workspace'):
+        _workspaces.workspace = Workspace()
+    return _workspaces.workspace
+
+
+class DesignFactorization:
+    """Factorization of the design matrix of a LabeledData, reusable by
+       LinearPredictor across Masks.
+
+    The design matrix [1 X] of the LabeledData (X prefixed by a column of ones)
+    is factorized once as QR, with Q having orthonormal columns and R upper
+    triangular. Since the columns of [1 X] selected by any Mask are then Q
+    times the corresponding columns of R, the least-squares problem for any
+    Mask reduces to one involving only those columns of R, whose size is
+    independent of the number of data. Only R and Q^T y need be retained, and
+    both are read off the triangular factor of [1 X y] as computed block by
+    block in a Workspace, so that Q is never formed.
+
+    Being the triangular factor of [1 X y], [R Q^T y] is a sufficient
+    statistic for every Mask (its Gram matrix is that of [1 X y], but for the
+    sum of squares of labels, retained separately), and a mergeable one:
+    the factor of the union of two LabeledData is the triangular factor of
+    their two factors stacked. So a DesignFactorization can be updated with
+    new batches of data, or merged with those made by other workers, at a
+    cost independent of the data already factorized, and persisted (as by
+    pickling) in between.
+
+    Attributes:
+        feature_dim: An int (d), the number of features of the LabeledData.
+        R: A float (r, d+1) upper triangular np.array, where r is the lesser
+           of d+1 and the size of the LabeledData.
+        qty: A float (r, T) np.array, the product of the transpose of Q and
+             the labels of the LabeledData.
+        size: An int (N), the size of the LabeledData.
+        yty: A float (T, ) np.array, the sums of squares of the labels of
+             the LabeledData, target by target.
+    """
+
+    def __init__(self,
+                 data: 'LabeledData',
+                 workspace: Workspace = None) -> None:
+        """Initializes DesignFactorization by factorizing given LabeledData
+           in given Workspace (by default the calling thread's)."""
+        self.feature_dim = data.feature_dim
+        self.set_factor((workspace or thread_workspace()).triangularize(
+            data.X, data.y, np.arange(data.feature_dim), data.dtype))
+        self.size = data.size
+        self.yty = np.einsum('ij,ij->j', data.y, data.y)
+
+    def factor(self) -> np.array:
+        """Returns the triangular factor [R qty]."""
+        return np.hstack((self.R, self.qty))
+
+    def set_factor(self, factor: np.array) -> None:
+        """Sets R and qty from given triangular factor of [1 X y], of which
+           only the first d+1 rows are retained."""
+        rank_bound = min(self.feature_dim + 1, factor.shape[0])
+        self.R = factor[:rank_bound, :self.feature_dim + 1]
+        self.qty = factor[:rank_bound, self.feature_dim + 1:]
+
+    def merge(self, other: 'DesignFactorization') -> None:
+        """Updates DesignFactorization to factorize the union of its
+           LabeledData and that of given DesignFactorization."""
+        assert other.feature_dim == self.feature_dim
+        stacked = np.vstack((self.factor(), other.factor()))
+        self.set_factor(np.linalg.qr(stacked, mode='r').astype(
+            self.R.dtype, copy=False))
+        self.size += other.size
+        self.yty = self.yty + other.yty
+
+    def update(self,
+               data: 'LabeledData',
+               workspace: Workspace = None) -> None:
+        """Updates DesignFactorization to factorize the union of its
+           LabeledData and given LabeledData, in time proportional to the
+           size of the latter."""
+        self.merge(DesignFactorization(data, workspace))
+
+    @classmethod
+    def combine(cls, *parts: 'DesignFactorization') -> 'DesignFactorization':
+        """Returns DesignFactorization of the union of the LabeledData of
+           given (one or more) DesignFactorizations, leaving them unchanged."""
+        combined = copy.copy(parts[0])
+        for part in parts[1:]:
+            combined.merge(part)
+        return combined
+
+    def solve(self, features: np.array) -> np.array:
+        """Returns (|features|+1, T) np.array of biases and coefficients of
+           least-squares predictor using only given feature indices."""
+        return least_squares(self.R[:, np.concatenate(([0], 1 + features))],
+                             self.qty)
+
+    def residual_sum_of_squares(self, features: np.array) -> np.array:
+        """Returns (T, ) np.array of the sums of squared residuals on the
+           LabeledData of the least-squares predictor using only given
+           feature indices, that is the sum of squares of the labels less
+           that of their projection onto the columns selected."""
+        columns = self.R[:, np.concatenate(([0], 1 + features))]
+        fitted = columns@least_squares(columns, self.qty)
+        return np.maximum(self.yty - np.einsum('ij,ij->j', fitted, fitted),
+                          0)
+
+
 class LabeledData:
     """Collection of feature vectors along with corresponding labels.
 
     Attributes:
-        X: A float (N, d) np.array representing N feature vectors.
-        y: A float (N, 1) np.array representing N labels corresponding to X.
+        X: A float (N, d) np.array, or scipy.sparse CSR matrix, representing
+           N feature vectors.
+        y: A float (N, T) np.array representing the labels of T targets
+           corresponding to X (T is 1 for a single target).
         size: An int (N), the number of feature vectors (and also labels).
         feature_dim: An int (d), the number of features in each input datum.
+        target_dim: An int (T), the number of targets of each label.
+        dtype: The float np.dtype of X and y.
     """
 
-    def __init__(self, X: np.array, y: np.array) -> None:
-        """Initializes all attributes, given X and y."""
+    def __init__(self,
+                 X: np.array,
+                 y: np.array,
+                 dtype: np.dtype = None) -> None:
+        """Initializes all attributes, given X (dense, or sparse in any
+           scipy.sparse format) and y, converted to given dtype (if any, and
+           only if not already of it); by default X keeps its dtype if a
+           float one and otherwise becomes float64, and y takes that of X.
+           A (N, ) y is taken as (N, 1), a single target."""
         assert X.shape[0] == y.shape[0]
-        self.X = X
-        self.y = y
+        if dtype is None:
+            dtype = (X.dtype if np.issubdtype(X.dtype, np.floating)
+                     else np.float64)
+        if is_sparse(X):
+            self.X = X.tocsr().astype(dtype, copy=False)
+        else:
+            self.X = np.asarray(X, dtype=dtype)
+        self.y = np.asarray(y, dtype=self.X.dtype)
+        if self.y.ndim == 1:
+            self.y = self.y.reshape((-1, 1))
         self.size = y.shape[0]
         self.feature_dim = X.shape[1]
+        self.target_dim = self.y.shape[1]
+        self.dtype = self.X.dtype
 
     def frac_split(self, frac: float) -> Tuple['LabeledData', 'LabeledData']:
         """Returns tuple of LabeledData randomly partitioning this LabeledData
@@ -141,9 +522,249 @@ class LabeledData:
 
     def get_subset(self, mask: Mask) -> 'LabeledData':
         """Returns LabeledData corresponding to the subset of this LabeledData
-           designated by the given Mask."""
-        marray = mask.get_array()
-        return LabeledData(self.X[marray], self.y[marray])
+           designated by the given Mask (a copy of only the rows in it)."""
+        rows = np.flatnonzero(mask.get_array())
+        return LabeledData(self.X[rows], self.y[rows])
+
+
+class FoldContext(NamedTuple):
+    """Everything needed to evaluate models on the folds of a LabeledData.
+
+    Attributes:
+        data: The LabeledData, its rows ordered fold by fold.
+        bounds: A (k+1, ) int np.array, the first row of each fold (and the
+                size of the data).
+        factorizations: A list of the DesignFactorizations of the data off
+                        each fold.
+    """
+
+    data: LabeledData
+    bounds: np.array
+    factorizations: List[DesignFactorization]
+
+
+_fold_context: FoldContext = None
+"""FoldContext of the cross validation run by this process, if any."""
+
+_shared_memory: List[shared_memory.SharedMemory] = []
+"""Shared memory attached by this (worker) process."""
+
+
+def attach_fold_context(names: Tuple[str, str],
+                        shapes: Tuple[Tuple[int, int], Tuple[int, int]],
+                        dtype: np.dtype,
+                        bounds: np.array,
+                        factorizations: List[DesignFactorization]) -> None:
+    """Sets the FoldContext of this worker process to data held in shared
+       memory blocks of given names, with given shapes and dtype, and given
+       fold bounds and DesignFactorizations."""
+    global _fold_context
+    arrays = []
+    for name, shape in zip(names, shapes):
+        block = shared_memory.SharedMemory(name=name)
+        _shared_memory.append(block)
+        arrays.append(np.ndarray(shape, dtype=dtype, buffer=block.buf))
+    _fold_context = FoldContext(LabeledData(*arrays), bounds, factorizations)
+
+
+EVALUATION_BATCH = 64
+"""Number of models whose predictions evaluate_fold makes at once."""
+
+
+def evaluate_fold(fold: int,
+                  codes: Sequence[int],
+                  per_target: bool = False) -> List[Any]:
+    """Returns errors made on given fold (of the FoldContext of this
+       process) by LinearPredictors fit off the fold with Masks of given
+       codes, exactly as LinearPredictor.error (or, if per_target, as
+       LinearPredictor.target_errors) would compute them.
+
+    The predictions of EVALUATION_BATCH models at a time are made by a
+    single product of the fold's feature vectors with their coefficients.
+    """
+    data, bounds, factorizations = _fold_context
+    X = data.X[bounds[fold]:bounds[fold + 1]]
+    y = data.y[bounds[fold]:bounds[fold + 1]]
+    norms = row_norms(X)
+    errors = []
+    for start in range(0, len(codes), EVALUATION_BATCH):
+        batch = codes[start:start + EVALUATION_BATCH]
+        columns = []
+        for code in batch:
+            predictor = LinearPredictor()
+            predictor.fit_factorization(factorizations[fold],
+                                        Mask(code=code,
+                                             full_dim=data.feature_dim))
+            columns.append(predictor.column_rep)
+        coefficients = np.hstack(columns)
+        predictions = X@coefficients[1:] + coefficients[0]
+        residuals = ((predictions.reshape((X.shape[0], len(batch), -1))
+                      - y[:, np.newaxis, :])
+                     / norms[:, np.newaxis, np.newaxis])
+        if per_target:
+            errors.extend(np.linalg.norm(residuals, axis=0))
+        else:
+            errors.extend(np.linalg.norm(np.linalg.norm(residuals, axis=2),
+                                         axis=0))
+    return errors
+
+
+def cross_validate(data: LabeledData,
+                   masks: Sequence[Mask],
+                   k: int,
+                   workers: int = None,
+                   folds: Sequence[Mask] = None,
+                   per_target: bool = False) -> np.array:
+    """Returns float (len(masks), k) np.array of the errors made on each of k
+       folds of given LabeledData by the LinearPredictor fit off that fold
+       with each given Mask of features, or if per_target a float
+       (len(masks), k, T) np.array of its errors on each target.
+
+    The folds are given Masks of rows, or else a random partition into k
+    parts of nearly equal size. The rows of the data are copied once, fold
+    by fold, into shared memory, so that each fold is a contiguous slice;
+    the data off each fold is factorized by merging the DesignFactorizations
+    of the other folds; and the errors are computed on a pool of given
+    number of worker processes (by default one per CPU), each of which reads
+    the data from shared memory, without copying it, and fits every Mask
+    from the factorizations alone. With 0 workers, or sparse data, the errors
+    are instead computed in this process.
+    """
+    assert k >= 2, "cross-validation needs at least 2 folds"
+    if folds is None:
+        fold_rows = np.array_split(np.random.permutation(data.size), k)
+    else:
+        assert len(folds) == k
+        fold_rows = [np.flatnonzero(fold.get_array()) for fold in folds]
+    order = np.concatenate(fold_rows)
+    bounds = np.concatenate(([0], np.cumsum([rows.size
+                                             for rows in fold_rows])))
+    workers = os.cpu_count() if workers is None else workers
+    codes = [mask.code for mask in masks]
+    errors = np.empty((len(codes), k, data.target_dim) if per_target
+                      else (len(codes), k))
+    blocks = []
+    try:
+        if workers and not is_sparse(data.X):
+            arrays = []
+            for array in (data.X, data.y):
+                blocks.append(shared_memory.SharedMemory(
+                    create=True, size=max(array[:1].nbytes * data.size, 1)))
+                arrays.append(np.ndarray(array.shape, dtype=data.dtype,
+                                         buffer=blocks[-1].buf))
+                np.take(array, order, axis=0, out=arrays[-1], mode='clip')
+            ordered = LabeledData(*arrays)
+        else:
+            ordered = LabeledData(data.X[order], data.y[order])
+        own = [DesignFactorization(LabeledData(
+                   ordered.X[bounds[fold]:bounds[fold + 1]],
+                   ordered.y[bounds[fold]:bounds[fold + 1]]))
+               for fold in range(k)]
+        factorizations = [DesignFactorization.combine(*own[:fold],
+                                                      *own[fold + 1:])
+                          for fold in range(k)]
+        if not blocks:
+            global _fold_context
+            _fold_context = FoldContext(ordered, bounds, factorizations)
+            for fold in range(k):
+                errors[:, fold] = evaluate_fold(fold, codes, per_target)
+            _fold_context = None
+            return errors
+        chunk = max(1, -(-len(codes) * k // (4 * workers)))
+        tasks = [(fold, start) for fold in range(k)
+                 for start in range(0, len(codes), chunk)]
+        with ProcessPoolExecutor(
+                workers,
+                initializer=attach_fold_context,
+                initargs=(tuple(block.name for block in blocks),
+                          (data.X.shape, data.y.shape),
+                          data.dtype,
+                          bounds,
+                          factorizations)) as pool:
+            results = pool.map(evaluate_fold,
+                               [fold for fold, _ in tasks],
+                               [codes[start:start + chunk]
+                                for _, start in tasks],
+                               [per_target] * len(tasks))
+            for (fold, start), result in zip(tasks, results):
+                errors[start:start + len(result), fold] = result
+        return errors
+    finally:
+        arrays = ordered = own = None  # views of blocks, released first
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+class Race:
+    """Elimination of dominated models from cross validation, fold by fold.
+
+    Models are raced over the folds: after each fold every surviving model's
+    errors are compared, fold for fold, with those of the surviving model of
+    least mean error, and a model is pruned (and so evaluated on no further
+    folds) once its mean excess error exceeds zero by more than a given number
+    of standard errors. Pairing the errors fold for fold cancels the variation
+    between folds common to all models.
+
+    Attributes:
+        errors: A dict with keys the indices of all models entered and values
+                the lists of errors each made on the folds evaluated so far.
+        pruned: A dict with keys the indices of pruned models and values the
+                number of folds on which each was evaluated before pruning.
+        confidence: A float, the number of standard errors of its mean excess
+                    error beyond which a model is pruned.
+        min_folds: An int, the number of folds on which every model is
+                   evaluated before any is pruned.
+    """
+
+    def __init__(self,
+                 model_indices: Iterable[int],
+                 confidence: float = 3.,
+                 min_folds: int = 2) -> None:
+        """Initializes Race among models with given indices."""
+        assert min_folds >= 2
+        self.errors: Dict[int, List[float]] = {index: []
+                                               for index in model_indices}
+        self.pruned: Dict[int, int] = {}
+        self.confidence = confidence
+        self.min_folds = min_folds
+
+    def survivors(self) -> List[int]:
+        """Returns the indices of all models not yet pruned."""
+        return [index for index in self.errors if index not in self.pruned]
+
+    def record(self, model_index: int, error: float) -> None:
+        """Records error of given surviving model on its next fold."""
+        assert model_index not in self.pruned
+        self.errors[model_index].append(error)
+
+    def mean_error(self, model_index: int) -> float:
+        """Returns mean error of given model over folds evaluated so far."""
+        return np.mean(self.errors[model_index])
+
+    def leader(self) -> int:
+        """Returns index of surviving model of least mean error."""
+        return min(self.survivors(), key=self.mean_error)
+
+    def prune(self) -> List[int]:
+        """Prunes every surviving model dominated by the leader, assuming
+           all surviving models have been evaluated on the same folds, and
+           returns the indices of the models so pruned."""
+        survivors = self.survivors()
+        folds = len(self.errors[survivors[0]])
+        assert all(len(self.errors[index]) == folds for index in survivors)
+        if folds < self.min_folds:
+            return []
+        leader_errors = np.array(self.errors[self.leader()])
+        dominated = []
+        for index in survivors:
+            excess = np.array(self.errors[index]) - leader_errors
+            margin = self.confidence * np.std(excess, ddof=1) / np.sqrt(folds)
+            if np.mean(excess) > margin:
+                dominated.append(index)
+        for index in dominated:
+            self.pruned[index] = folds
+        return dominated
 
 
 class Simulation(NamedTuple):
@@ -154,22 +775,29 @@ class Simulation(NamedTuple):
 
 def generate_target(feature_dim: int,
                     hot: int,
-                    scale: float) -> LinearPredictor:
-    """Returns a randomly generated LinearPredictor defined on a given number
-       of features, sensitive to only a given number of them, and having
-       entries within a given scale."""
+                    scale: float,
+                    targets: int = 1) -> LinearPredictor:
+    """Returns a randomly generated LinearPredictor of a given number of
+       targets defined on a given number of features, sensitive to only a
+       given number of them (the same for every target), and having entries
+       within a given scale."""
     active = np.random.choice(feature_dim, hot, replace=False)
-    random = np.random.uniform(-scale, scale, hot)
-    target_col = np.zeros(feature_dim + 1)
-    target_col[0] = np.random.uniform(-scale, scale)
-    target_col[1:][active] = random
-    return LinearPredictor(target_col.reshape((feature_dim + 1, 1)))
+    random = np.random.uniform(-scale, scale, (hot, targets))
+    target_cols = np.zeros((feature_dim + 1, targets))
+    target_cols[0] = np.random.uniform(-scale, scale, targets)
+    target_cols[1:][active] = random
+    return LinearPredictor(target_cols)
 
 
-def generate_X(feature_dim: int, cardinality: int, scale: float) -> np.array:
+def generate_X(feature_dim: int,
+               cardinality: int,
+               scale: float,
+               dtype: np.dtype = np.float64) -> np.array:
     """Generates cardinality feature vectors with feature_dim features,
-       each with absolute value bounded by given scale."""
-    return np.random.uniform(-scale, scale, size=((cardinality, feature_dim)))
+       each with absolute value bounded by given scale, of given dtype."""
+    return np.random.uniform(-scale, scale,
+                             size=((cardinality, feature_dim))).astype(
+                                 dtype, copy=False)
 
 
 def generate_label(target: LinearPredictor,
@@ -179,18 +807,21 @@ def generate_label(target: LinearPredictor,
        feature vectors X subject to random error controlled by given scale."""
     true = target.predict(X)
     error = np.random.normal(scale=scale, size=true.shape)
-    return true + error
+    return (true + error).astype(X.dtype, copy=False)
 
 
 def simulate(feature_dim: int,
              cardinality: int,
              target_scale: float,
              X_scale: float,
-             error_scale: float) -> Simulation:
+             error_scale: float,
+             dtype: np.dtype = np.float64,
+             targets: int = 1) -> Simulation:
     """Returns a Simulation with given number of features, data cardinality,
-       scale of LinearPredictor, scale of data, and scale of error in labels."""
+       scale of LinearPredictor, scale of data, scale of error in labels,
+       dtype of data, and number of targets."""
     hot = np.random.choice(feature_dim + 1)
-    target = generate_target(feature_dim, hot, target_scale)
-    X = generate_X(feature_dim, cardinality, X_scale)
+    target = generate_target(feature_dim, hot, target_scale, targets)
+    X = generate_X(feature_dim, cardinality, X_scale, dtype)
     return Simulation(target,
                       LabeledData(X, generate_label(target, X, error_scale)))
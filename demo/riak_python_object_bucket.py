@@ -1,40 +1,145 @@
 # riak_python_object_bucket.py
 """Provides abstraction of Riak bucket storing arbitrary Python objects."""
 
-from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
 import pickle
 import socket
 
 import riak
 
 
+class ChecksumError(Exception):
+    """Raised when a chunk of an object fetched from Riak is missing or does
+       not match its checksum."""
+
+
 class RiakPythonObjectBucket:
     """Abstraction of Riak bucket storing arbitrary Python objects.
 
+    Since Riak performs badly on values of more than about 1 MB, an object
+    whose pickle exceeds chunk_size bytes is not stored as a single value but
+    split into chunks of chunk_size bytes, each stored under a key derived
+    from the object's key, the digest of its pickle, and the chunk's index.
+    A manifest listing the keys and SHA-256 checksums of the chunks is then
+    stored under the object's own key, after all the chunks, so that a reader
+    never finds a manifest whose chunks are not all stored, and the chunks
+    of any object formerly stored under that key are deleted. Chunks are
+    stored and fetched concurrently, on a pool of threads shared by all
+    buckets, and fetched chunks are checked against their checksums and
+    copied into a buffer preallocated for the whole pickle. Smaller objects
+    are stored as single values, as ever.
+
     Attributes:
-        bucket: A string naming the bucket.
+        bucket: A riak.RiakBucket.
+        chunk_size: An int, the most bytes stored in a single value.
     """
 
+    OBJECT_TYPE = 'Python object'
+    """Content type of pickled Python objects stored as single values"""
+
+    CHUNK_TYPE = 'application/octet-stream'
+    """Content type of chunks of pickled Python objects"""
+
+    MANIFEST_TYPE = 'Python object manifest'
+    """Content type of manifests of chunked Python objects"""
+
+    pool = ThreadPoolExecutor(max_workers=8)
+    """Pool of threads storing and fetching chunks."""
+
     def __init__(self,
                  bucket: str,
-                 host=socket.gethostbyname(socket.gethostname())) -> None:
-        """Initializes RiaKPythonObjectBucket and sets encoder and decoder.
+                 host=socket.gethostbyname(socket.gethostname()),
+                 chunk_size: int = 1 << 20) -> None:
+        """Initializes RiaKPythonObjectBucket and sets encoders and decoders.
 
         Args:
             bucket: A string naming the bucket to be initialized.
             host: A string representation of the host's public IP address.
+            chunk_size: An int, the most bytes to store in a single value.
         """
         client = riak.RiakClient(host=host, pb_port=8087, protocol='pbc')
         self.bucket = client.bucket(bucket)
-        self.bucket.set_encoder('Python object', pickle.dumps)
-        self.bucket.set_decoder('Python object', pickle.loads)
+        self.bucket.set_encoder(self.OBJECT_TYPE, pickle.dumps)
+        self.bucket.set_decoder(self.OBJECT_TYPE, pickle.loads)
+        self.bucket.set_encoder(self.CHUNK_TYPE, bytes)
+        self.bucket.set_decoder(self.CHUNK_TYPE, bytes)
+        self.bucket.set_encoder(self.MANIFEST_TYPE,
+                                lambda manifest: json.dumps(manifest).encode())
+        self.bucket.set_decoder(self.MANIFEST_TYPE, json.loads)
+        self.chunk_size = chunk_size
 
     def put(self, key: str, pyobj: Any) -> None:
         """Sets given pyobject as value of given key."""
-        self.bucket.new(key=key,
-                        data=pyobj,
-                        content_type='Python object').store()
+        pickled = pickle.dumps(pyobj, protocol=pickle.HIGHEST_PROTOCOL)
+        old = self.manifest(key)
+        if len(pickled) <= self.chunk_size:
+            self.bucket.new(key=key,
+                            encoded_data=pickled,
+                            content_type=self.OBJECT_TYPE).store(
+                                return_body=False)
+            chunk_keys = []
+        else:
+            version = hashlib.sha256(pickled).hexdigest()[:16]
+            view = memoryview(pickled)
+            chunk_keys = [f"{key}/{version}/{index}" for index
+                          in range(-(-len(pickled) // self.chunk_size))]
+            checksums = list(self.pool.map(
+                self.store_chunk,
+                chunk_keys,
+                (view[start:start + self.chunk_size] for start
+                 in range(0, len(pickled), self.chunk_size))))
+            self.bucket.new(key=key,
+                            data={'size': len(pickled),
+                                  'chunk_size': self.chunk_size,
+                                  'chunks': list(zip(chunk_keys, checksums))},
+                            content_type=self.MANIFEST_TYPE).store(
+                                return_body=False)
+        if old:
+            stale = {chunk_key for chunk_key, _ in old['chunks']}
+            list(self.pool.map(self.bucket.delete,
+                               stale.difference(chunk_keys)))
 
-    def get(self, key: str) -> Any:
-        """Retrieves value of given key."""
+    def store_chunk(self, chunk_key: str, chunk: memoryview) -> str:
+        """Stores given chunk under given key and returns its checksum."""
+        chunk = bytes(chunk)
+        self.bucket.new(key=chunk_key,
+                        data=chunk,
+                        content_type=self.CHUNK_TYPE).store(return_body=False)
+        return hashlib.sha256(chunk).hexdigest()
+
+    def manifest(self, key: str) -> Optional[Dict[str, Any]]:
+        """Returns manifest stored under given key, or None if the value of
+           the key is not chunked, as found by fetching only its headers
+           (and only then, if chunked, the manifest itself), so that putting
+           a small object over another costs no transfer of the old value."""
+        stored = self.bucket.get(key, head_only=True)
+        if not stored.exists or stored.content_type != self.MANIFEST_TYPE:
+            return None
         return self.bucket.get(key).data
+
+    def get(self, key: str) -> Any:
+        """Retrieves value of given key (reassembled from its chunks if
+           chunked), or raises ChecksumError if any chunk is corrupt."""
+        stored = self.bucket.get(key)
+        if not stored.exists or stored.content_type != self.MANIFEST_TYPE:
+            return stored.data
+        manifest = stored.data
+        buffer = bytearray(manifest['size'])
+        view = memoryview(buffer)
+
+        def fetch(index: int, chunk: List[str]) -> None:
+            chunk_key, checksum = chunk
+            data = self.bucket.get(chunk_key).data
+            if (data is None
+                    or hashlib.sha256(data).hexdigest() != checksum):
+                raise ChecksumError(f"chunk {index} of {key} is corrupt")
+            start = index * manifest['chunk_size']
+            view[start:start + len(data)] = data
+
+        list(self.pool.map(fetch,
+                           range(len(manifest['chunks'])),
+                           manifest['chunks']))
+        return pickle.loads(buffer)
@@ -0,0 +1,378 @@
+# selection.py
+"""Model selection tasks and the graph of their dependencies.
+
+The tasks run cross validation of linear regression over all subsets of
+features, storing their inputs and outputs in object buckets. The task graph
+is independent of any workflow manager: model_select.py turns it into an
+Airflow DAG, but it can equally be run in process (see benchmark.py).
+Tasks read the constants below when they run, so these may be adjusted
+before running the graph in process.
+
+If MEMOIZE, tasks are memoized across runs: every key a task reads or writes
+is prefixed by a digest of all the inputs of the run (the constants below,
+including the version of the data and the seed of the folds, and the version
+of the code, a hash of the source of this module and of ml.py), and a task
+whose completion has been recorded under that digest returns at once. Runs
+with the same inputs thereby share their results, so that reruns, retries,
+and backfills cost next to nothing, while runs with different inputs never
+overwrite each other's. Memoization requires DATA_VERSION to be set (or to
+be passed to each task, as model_select.py passes the date of the DAG run),
+since only then is the simulated data reproducible.
+"""
+
+import functools
+import hashlib
+import os
+from typing import Any, Callable, Dict, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+import ml
+
+# constants at user's disposal
+FEATURE_DIM = 4
+CARDINALITY = 100
+TARGET_SCALE = 10
+X_SCALE = 1
+ERROR_SCALE = 4
+# float dtype of the simulated data and of all computation on it; float32
+# halves the memory held by data, factorizations, and predictors
+DTYPE = 'float64'
+# number of targets labeling each datum, all fit at once on the same features;
+# models are compared by their error over all targets (see ml.LinearPredictor)
+TARGETS = 1
+K = 5
+# adaptive cross validation: if ADAPTIVE, folds are evaluated one after another
+# and after each fold models dominated by the best model so far are pruned
+# (see ml.Race), trading parallelism across folds for far fewer fits
+ADAPTIVE = False
+CONFIDENCE = 3
+MIN_FOLDS = 2
+# memoization across runs (see above): DATA_VERSION, if set, seeds the
+# simulation of the data (and, unless FOLD_SEED is set, the folds)
+MEMOIZE = False
+DATA_VERSION: str = None
+FOLD_SEED: int = None
+
+INPUTS = ('FEATURE_DIM', 'CARDINALITY', 'TARGET_SCALE', 'X_SCALE',
+          'ERROR_SCALE', 'DTYPE', 'TARGETS', 'K', 'ADAPTIVE', 'CONFIDENCE',
+          'MIN_FOLDS', 'DATA_VERSION', 'FOLD_SEED')
+"""Names of the constants on which the results of tasks depend."""
+
+_code_version: str = None
+
+bucket_type: Callable[[str], Any] = None
+"""Class of the object buckets tasks use, called with a bucket name and
+   providing put and get; RiakPythonObjectBucket unless set otherwise."""
+
+
+def bucket(name: str) -> Any:
+    """Returns the object bucket (of type bucket_type) of given name."""
+    global bucket_type
+    if bucket_type is None:
+        # imported only as needed so that tasks can run without riak installed
+        from riak_python_object_bucket import RiakPythonObjectBucket
+        bucket_type = RiakPythonObjectBucket
+    if MEMOIZE:
+        return MemoizedBucket(bucket_type(name), run_digest())
+    return bucket_type(name)
+
+
+class MemoizedBucket:
+    """Object bucket whose keys are all prefixed by the digest of a run.
+
+    Attributes:
+        bucket: The object bucket (of type bucket_type) wrapped.
+        prefix: A string, the digest of the run.
+    """
+
+    def __init__(self, bucket: Any, prefix: str) -> None:
+        """Initializes MemoizedBucket wrapping given bucket with given
+           prefix."""
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def put(self, key: str, pyobj: Any) -> None:
+        """Sets given pyobject as value of given key."""
+        self.bucket.put(f"{self.prefix}/{key}", pyobj)
+
+    def get(self, key: str) -> Any:
+        """Retrieves value of given key."""
+        return self.bucket.get(f"{self.prefix}/{key}")
+
+
+def code_version() -> str:
+    """Returns hex digest of the source of this module and of ml.py."""
+    global _code_version
+    if _code_version is None:
+        code = hashlib.sha256()
+        for path in (__file__, ml.__file__):
+            with open(os.path.splitext(path)[0] + '.py', 'rb') as source:
+                code.update(source.read())
+        _code_version = code.hexdigest()
+    return _code_version
+
+
+def run_digest() -> str:
+    """Returns hex digest of the inputs of the run: the constants named in
+       INPUTS and the version of the code."""
+    if DATA_VERSION is None:
+        raise ValueError('memoization requires DATA_VERSION')
+    inputs = repr([(name, globals()[name]) for name in INPUTS])
+    return hashlib.sha256(
+        f"{code_version()} {inputs}".encode('utf8')).hexdigest()[:32]
+
+
+def derived_seed(*parts: Any) -> int:
+    """Returns seed for NumPy's random number generator derived from given
+       parts."""
+    return int(hashlib.sha256(repr(parts).encode('utf8')).hexdigest()[:8],
+               16)
+
+
+def memoized(task_callable: Callable[..., None]) -> Callable[..., None]:
+    """Returns task callable that, if MEMOIZE, calls given task callable
+       (on the same arguments) only if it has not completed under the
+       current run digest, and records its completion.
+
+    The task callable returned also accepts a keyword argument data_version,
+    which, if not None, sets DATA_VERSION first.
+    """
+    @functools.wraps(task_callable)
+    def wrapper(*args: Any, data_version: str = None) -> None:
+        global DATA_VERSION
+        if data_version is not None:
+            DATA_VERSION = data_version
+        if not MEMOIZE:
+            task_callable(*args)
+            return
+        done = bucket('done')
+        marker = f"{task_callable.__name__}{args}"
+        if done.get(marker) is None:
+            task_callable(*args)
+            done.put(marker, True)
+    return wrapper
+
+
+@memoized
+def simulate() -> None:
+    """Creates and stores ml.Simulation along with test/train split."""
+    if DATA_VERSION is not None:
+        np.random.seed(derived_seed('data', DATA_VERSION))
+    simulation = ml.simulate(feature_dim=FEATURE_DIM,
+                             cardinality=CARDINALITY,
+                             target_scale=TARGET_SCALE,
+                             X_scale=X_SCALE,
+                             error_scale=ERROR_SCALE,
+                             dtype=DTYPE,
+                             targets=TARGETS)
+    data = bucket('data')
+    data.put('target', simulation.target)
+    test_data, training_data = simulation.data.frac_split(.1)
+    data.put('train', training_data)
+    data.put('test', test_data)
+
+
+@memoized
+def fold_split() -> None:
+    """Creates and stores cross validation folds, along with the
+       ml.DesignFactorization of the training data off each fold, merged
+       from those of the other folds (so that the data is factorized once
+       rather than K - 1 times)."""
+    train = bucket('data').get('train')
+    folds = bucket('folds')
+    factorizations = bucket('factorizations')
+    if DATA_VERSION is not None or FOLD_SEED is not None:
+        np.random.seed(derived_seed('folds', DATA_VERSION, FOLD_SEED))
+    fold_masks = train.k_split(K)
+    own = [ml.DesignFactorization(train.get_subset(fold))
+           for fold in fold_masks]
+    for index, fold in enumerate(fold_masks):
+        folds.put(str(index), fold)
+        factorizations.put(str(index),
+                           ml.DesignFactorization.combine(
+                               *own[:index], *own[index + 1:]))
+
+
+def is_pruned(model_index: int, fold_index: int) -> bool:
+    """Checks whether given model was pruned before reaching given fold."""
+    if not ADAPTIVE or fold_index == 0:
+        return False
+    race = bucket('races').get(str(fold_index - 1))
+    return model_index in race.pruned
+
+
+@memoized
+def train_model(model_index: int, fold_index: int) -> None:
+    """Trains given model on complement of given fold and stores predictor."""
+    if is_pruned(model_index, fold_index):
+        return
+    model = ml.Mask(code=model_index, full_dim=FEATURE_DIM)
+    factorization = bucket('factorizations').get(
+        str(fold_index))
+    predictors = bucket('predictors')
+    predictor = ml.LinearPredictor()
+    predictor.fit_factorization(factorization=factorization, mask=model)
+    predictors.put(f"model {model_index}, fold {fold_index}", predictor)
+
+
+@memoized
+def evaluate_error(model_index: int, fold_index: int) -> None:
+    """Evaluates and stores error of given trained model on given fold."""
+    if is_pruned(model_index, fold_index):
+        return
+    fold = bucket('folds').get(str(fold_index))
+    train = bucket('data').get('train')
+    predictors = bucket('predictors')
+    predictor = predictors.get(f"model {model_index}, fold {fold_index}")
+    errors = bucket('errors')
+    error = predictor.error(train.get_subset(fold))
+    errors.put(f"model {model_index}, fold {fold_index}", error)
+
+
+@memoized
+def prune(fold_index: int) -> None:
+    """Records errors of surviving models on given fold in the race carried
+       over from the previous fold, prunes dominated models, and stores the
+       updated ml.Race."""
+    errors = bucket('errors')
+    races = bucket('races')
+    if fold_index == 0:
+        race = ml.Race(range(2**FEATURE_DIM),
+                       confidence=CONFIDENCE,
+                       min_folds=MIN_FOLDS)
+    else:
+        race = races.get(str(fold_index - 1))
+    for model_index in race.survivors():
+        race.record(model_index,
+                    errors.get(f"model {model_index}, fold {fold_index}"))
+    race.prune()
+    races.put(str(fold_index), race)
+
+
+@memoized
+def average_error(model_index: int) -> None:
+    """Calculates and stores fold average of error made by given model
+       (over the folds on which it was evaluated, if ADAPTIVE)."""
+    errors = bucket('errors')
+    error_averages = bucket('error_averages')
+    folds = K
+    if ADAPTIVE:
+        race = bucket('races').get(str(K - 1))
+        folds = len(race.errors[model_index])
+    avg_error = sum(errors.get(f"model {model_index}, fold {fold_index}")
+                    for fold_index in range(folds)) / folds
+    error_averages.put(f"model {model_index}", avg_error)
+
+
+@memoized
+def minimize() -> None:
+    """Finds and stores model minimizing average error over all folds
+       (among models never pruned, if ADAPTIVE)."""
+    error_averages = bucket('error_averages')
+    report = bucket('report')
+    model_indices = range(2**FEATURE_DIM)
+    if ADAPTIVE:
+        race = bucket('races').get(str(K - 1))
+        report.put('race', race)
+        model_indices = race.survivors()
+    min_model_index = model_indices[0]
+    for model_index in model_indices:
+        current_min_error = error_averages.get(f"model {min_model_index}")
+        current_error = error_averages.get(f"model {model_index}")
+        if current_error < current_min_error:
+            min_model_index = model_index
+    report.put('model', ml.Mask(code=min_model_index, full_dim=FEATURE_DIM))
+
+
+@memoized
+def train_min() -> None:
+    """Trains minimizing model on entire training set and stores predictor."""
+    report = bucket('report')
+    train = bucket('data').get('train')
+    predictor = ml.LinearPredictor()
+    predictor.fit(data=train, mask=report.get('model'))
+    report.put('predictor', predictor)
+
+
+@memoized
+def report_error() -> None:
+    """Computes and stores error made by trained minimizer on test set."""
+    report = bucket('report')
+    predictor = report.get('predictor')
+    test = bucket('data').get('test')
+    error = predictor.error(test)
+    report.put('test_error', error)
+
+
+class Task(NamedTuple):
+    """A task callable, its arguments, and the ids of the tasks it awaits."""
+    callable: Callable[..., None]
+    args: Tuple = ()
+    upstream: Sequence[str] = ()
+
+
+def task_graph() -> Dict[str, Task]:
+    """Returns dict with keys task ids and values the corresponding Tasks,
+       encoding the model selection workflow for the current constants."""
+    graph = {'simulate_data': Task(simulate),
+             'form_folds': Task(fold_split, upstream=['simulate_data'])}
+    min_upstream = []
+    for fold_index in range(K if ADAPTIVE else 0):
+        graph[f"prune_after_F_{fold_index}"] = Task(
+            prune,
+            (fold_index,),
+            [f"evaluate_error_of_M_{model_index}_on_F_{fold_index}"
+             for model_index in range(2**FEATURE_DIM)])
+
+    for model_index in range(2**FEATURE_DIM):
+        avg_err_task_id = f"evaluate_average_error_of_M_{model_index}"
+        avg_err_upstream = []
+        for fold_index in range(K):
+            train_task_id = f"train_M_{model_index}_off_F_{fold_index}"
+            if ADAPTIVE and fold_index > 0:
+                train_upstream = [f"prune_after_F_{fold_index - 1}"]
+            else:
+                train_upstream = ['form_folds']
+            graph[train_task_id] = Task(train_model,
+                                        (model_index, fold_index),
+                                        train_upstream)
+
+            error_task_id = (f"evaluate_error_of_M_{model_index}"
+                             f"_on_F_{fold_index}")
+            graph[error_task_id] = Task(evaluate_error,
+                                        (model_index, fold_index),
+                                        [train_task_id])
+            avg_err_upstream.append(error_task_id)
+
+        if ADAPTIVE:
+            avg_err_upstream = [f"prune_after_F_{K - 1}"]
+        graph[avg_err_task_id] = Task(average_error,
+                                      (model_index,),
+                                      avg_err_upstream)
+        min_upstream.append(avg_err_task_id)
+
+    graph['minimize_error'] = Task(minimize, upstream=min_upstream)
+    graph['train_minimizing_model'] = Task(train_min,
+                                           upstream=['minimize_error'])
+    graph['report_error'] = Task(report_error,
+                                 upstream=['train_minimizing_model'])
+    return graph
+
+
+def topological_order(graph: Dict[str, Task]) -> List[str]:
+    """Returns list of the ids of given task graph, each task appearing after
+       every task it awaits."""
+    order = []
+    visited = set()
+
+    def visit(task_id: str) -> None:
+        if task_id not in visited:
+            visited.add(task_id)
+            for upstream in graph[task_id].upstream:
+                visit(upstream)
+            order.append(task_id)
+
+    for task_id in graph:
+        visit(task_id)
+    return order
@@ -0,0 +1,325 @@
+# coordination.py
+
+"""Stores of the check-ins by which multischedulers coordinate.
+
+Each multischeduler registers its birth and then checks in periodically (see
+multischeduler.py); a CoordinationStore keeps the latest time of each
+check-in, keyed by the IP address and birth of the multischeduler, purges
+check-ins older than the grace period, and answers which multischedulers are
+available and which (the eldest) leads. The store's clock, not the
+multischedulers', measures all times.
+
+    PostgresStore
+        the schedulers table of the database housing the Airflow metadata
+        store, reached over the multischeduler's own database connection
+    RedisStore
+        a sorted set on a server speaking the Redis protocol (requiring the
+        redis package), which takes the coordination traffic off the
+        metadata database, so that check-ins can be made more often without
+        slowing the Airflow scheduler's own queries
+    MemoryStore
+        a dict in process memory, shared by Multischedulers run in one
+        process (as by simulator.py)
+
+A store that cannot be reached raises StoreUnavailable on connecting.
+"""
+
+import abc
+from datetime import datetime, timedelta
+import threading
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+from psycopg2 import sql
+
+from hfshared import Database
+
+CheckIns = Tuple[List[Tuple[str, datetime]], datetime]
+"""Pairs of IP addresses and times of all check-ins (in order of time) along
+   with the store's current time."""
+
+
+class StoreUnavailable(Exception):
+    """Raised when a CoordinationStore cannot be reached."""
+
+
+class CoordinationStore(abc.ABC):
+    """Store of the check-ins of multischedulers."""
+
+    def connect(self) -> None:
+        """Connects to store (by default, as for a store reached over another
+           party's connection, there is nothing to do), or raises
+           StoreUnavailable."""
+
+    def disconnect(self) -> None:
+        """Disconnects from store (by default, nothing to do)."""
+
+    @abc.abstractmethod
+    def register(self, ip: str) -> Any:
+        """Records check-in of newborn multischeduler with given IP address
+           and returns its birth (in a form taken by check_in())."""
+
+    @abc.abstractmethod
+    def check_in(self, ip: str, birth: Any) -> None:
+        """Records check-in of multischeduler with given IP address and
+           birth."""
+
+    @abc.abstractmethod
+    def toss_stale(self, grace_period: timedelta) -> None:
+        """Purges check-ins older than given grace period."""
+
+    @abc.abstractmethod
+    def leader(self) -> str:
+        """Returns IP address of the multischeduler of earliest birth."""
+
+    @abc.abstractmethod
+    def active(self) -> Set[str]:
+        """Returns IP addresses of all multischedulers checked in."""
+
+    @abc.abstractmethod
+    def checkins(self) -> CheckIns:
+        """Returns all check-ins (see CheckIns)."""
+
+    @abc.abstractmethod
+    def remove(self, ips: Iterable[str]) -> None:
+        """Purges all check-ins of multischedulers with given IP addresses."""
+
+
+class PostgresStore(CoordinationStore):
+    """Store of check-ins in the table
+    schedulers(ip varchar(15), birth timestamp, latest timestamp)
+    of the database, reached over a connection made (and closed) by the
+    Multischeduler.
+
+    Attributes:
+        db: A Database (defined in hfshared.py) holding the table.
+    """
+
+    def __init__(self, db: Database) -> None:
+        """Initializes PostgresStore in given Database."""
+        self.db = db
+
+    def execute(self, statement: str, fetch: bool = True) -> List[tuple]:
+        """Executes and commits given statement and returns all resulting
+           rows (none unless fetch)."""
+        self.db.cur.execute(sql.SQL(statement))
+        rows = self.db.cur.fetchall() if fetch else []
+        self.db.conn.commit()
+        return rows
+
+    def register(self, ip: str) -> datetime:
+        """Inserts check-in of newborn multischeduler with given IP
+           address and returns its birth, the database's current time."""
+        insert = (f"INSERT INTO schedulers (ip, birth, latest)\n"
+                  f"VALUES (\'{ip}\', "
+                  f"LOCALTIMESTAMP, LOCALTIMESTAMP)\n"
+                  f"RETURNING birth")
+        return self.execute(insert)[0][0]
+
+    def check_in(self, ip: str, birth: datetime) -> None:
+        """Inserts check-in of multischeduler with given IP address
+           and birth at the database's current time."""
+        insert = (f"INSERT INTO schedulers (ip, birth, latest)\n"
+                  f"VALUES (\'{ip}\', '{birth}', LOCALTIMESTAMP)")
+        self.execute(insert, fetch=False)
+
+    def toss_stale(self, grace_period: timedelta) -> None:
+        """Deletes rows of check-ins older than given grace period."""
+        delete = (f"DELETE FROM schedulers WHERE "
+                  f"latest<(LOCALTIMESTAMP-'{grace_period}'::interval)")
+        self.execute(delete, fetch=False)
+
+    def leader(self) -> str:
+        """Returns IP address in the row of earliest birth."""
+        select = ("SELECT x.ip FROM schedulers x\n"
+                  "WHERE x.birth=\n"
+                  "(SELECT MIN(y.birth) FROM schedulers y)")
+        return self.execute(select)[0][0]
+
+    def active(self) -> Set[str]:
+        """Returns IP addresses in all rows."""
+        select = f"SELECT DISTINCT ip from schedulers"
+        return {record[0] for record in self.execute(select)}
+
+    def checkins(self) -> CheckIns:
+        """Returns all check-ins (see CheckIns), by the database's
+           clock."""
+        select = ("SELECT ip, latest, LOCALTIMESTAMP FROM schedulers\n"
+                  "ORDER BY latest")
+        records = self.execute(select)
+        now = records[0][2] if records else None
+        return [(ip, latest) for ip, latest, _ in records], now
+
+    def remove(self, ips: Iterable[str]) -> None:
+        """Deletes rows of multischedulers with given IP addresses."""
+        listed = ', '.join(f"'{ip}'" for ip in ips)
+        if listed:
+            self.execute(f"DELETE FROM schedulers WHERE ip IN ({listed})",
+                         fetch=False)
+
+
+class RedisStore(CoordinationStore):
+    """Store of check-ins in a sorted set on a Redis-protocol server.
+
+    Each member of the sorted set is an IP address and birth (in seconds
+    since the epoch, by the server's clock) separated by a space, scored by
+    the time of its latest check-in.
+
+    Attributes:
+        host: A string, the server's host name or IP address.
+        port: An int, the server's port.
+        password: A string, the server's password, if any.
+        key: A string, the key of the sorted set.
+        timeout: A float, the seconds allowed each request.
+        client: A redis.Redis client while connected; otherwise None.
+    """
+
+    def __init__(self,
+                 host: str,
+                 port: int = 6379,
+                 password: str = None,
+                 key: str = 'heirflow:checkins',
+                 timeout: float = 1.) -> None:
+        """Initializes RedisStore on given server and key."""
+        self.host = host
+        self.port = port
+        self.password = password
+        self.key = key
+        self.timeout = timeout
+        self.client = None
+
+    def connect(self) -> None:
+        """Connects a client to the server and pings it, or raises
+           StoreUnavailable."""
+        import redis  # optional dependency, needed only for this store
+        try:
+            self.client = redis.Redis(host=self.host,
+                                      port=self.port,
+                                      password=self.password or None,
+                                      socket_timeout=self.timeout,
+                                      socket_connect_timeout=self.timeout,
+                                      decode_responses=True)
+            self.client.ping()
+        except redis.exceptions.RedisError as error:
+            self.client = None
+            raise StoreUnavailable(f"redis: {error}") from error
+
+    def disconnect(self) -> None:
+        """Closes client, if any, and clears it."""
+        if self.client:
+            self.client.close()
+            self.client = None
+
+    def now(self) -> float:
+        """Returns the server's current time, in seconds since the epoch."""
+        seconds, microseconds = self.client.time()
+        return seconds + microseconds / 1e6
+
+    def register(self, ip: str) -> float:
+        """Records check-in of newborn multischeduler with given IP
+           address and returns its birth, the server's current time."""
+        birth = self.now()
+        self.check_in(ip, birth)
+        return birth
+
+    def check_in(self, ip: str, birth: float) -> None:
+        """Scores member of multischeduler with given IP address and
+           birth by the server's current time."""
+        self.client.zadd(self.key, {f"{ip} {birth:.6f}": self.now()})
+
+    def toss_stale(self, grace_period: timedelta) -> None:
+        """Removes members scored before given grace period."""
+        cutoff = self.now() - grace_period.total_seconds()
+        self.client.zremrangebyscore(self.key, '-inf', f"({cutoff}")
+
+    def members(self) -> List[Tuple[str, float, float]]:
+        """Returns IP address, birth, and latest check-in of every member, in
+           order of latest check-in."""
+        return [(member.split()[0], float(member.split()[1]), latest)
+                for member, latest
+                in self.client.zrange(self.key, 0, -1, withscores=True)]
+
+    def leader(self) -> str:
+        """Returns IP address of the member of earliest birth."""
+        return min(self.members(), key=lambda member: member[1:])[0]
+
+    def active(self) -> Set[str]:
+        """Returns IP addresses of all members."""
+        return {ip for ip, _, _ in self.members()}
+
+    def checkins(self) -> CheckIns:
+        """Returns all check-ins (see CheckIns), by the server's clock."""
+        now = datetime.fromtimestamp(self.now())
+        return [(ip, datetime.fromtimestamp(latest))
+                for ip, _, latest in self.members()], now
+
+    def remove(self, ips: Iterable[str]) -> None:
+        """Removes members of multischedulers with given IP addresses."""
+        ips = set(ips)
+        doomed = [f"{ip} {birth:.6f}" for ip, birth, _ in self.members()
+                  if ip in ips]
+        if doomed:
+            self.client.zrem(self.key, *doomed)
+
+
+class MemoryStore(CoordinationStore):
+    """Store of check-ins in process memory.
+
+    Attributes:
+        latest: A dict with keys pairs of IP addresses and births and values
+                the datetimes of latest check-ins.
+        lock: A threading.Lock guarding latest.
+    """
+
+    def __init__(self) -> None:
+        """Initializes empty MemoryStore."""
+        self.latest: Dict[Tuple[str, datetime], datetime] = {}
+        self.lock = threading.Lock()
+
+    def register(self, ip: str) -> datetime:
+        """Records check-in of newborn multischeduler with given IP
+           address and returns its birth, the current time."""
+        with self.lock:
+            birth = datetime.now()
+            self.latest[(ip, birth)] = birth
+        return birth
+
+    def check_in(self, ip: str, birth: datetime) -> None:
+        """Records check-in of multischeduler with given IP address and
+           birth at the current time."""
+        with self.lock:
+            self.latest[(ip, birth)] = datetime.now()
+
+    def toss_stale(self, grace_period: timedelta) -> None:
+        """Deletes check-ins older than given grace period."""
+        with self.lock:
+            cutoff = datetime.now() - grace_period
+            for member in [member for member, latest in self.latest.items()
+                           if latest < cutoff]:
+                del self.latest[member]
+
+    def leader(self) -> str:
+        """Returns IP address of the multischeduler of earliest birth."""
+        with self.lock:
+            return min(self.latest, key=lambda member: member[::-1])[0]
+
+    def active(self) -> Set[str]:
+        """Returns IP addresses of all multischedulers checked in."""
+        with self.lock:
+            return {ip for ip, _ in self.latest}
+
+    def checkins(self) -> CheckIns:
+        """Returns all check-ins (see CheckIns)."""
+        with self.lock:
+            return (sorted(((ip, latest) for (ip, _), latest
+                            in self.latest.items()),
+                           key=lambda checkin: checkin[1]),
+                    datetime.now())
+
+    def remove(self, ips: Iterable[str]) -> None:
+        """Deletes all check-ins of multischedulers with given IP
+           addresses."""
+        ips = set(ips)
+        with self.lock:
+            for member in [member for member in self.latest
+                           if member[0] in ips]:
+                del self.latest[member]
@@ -0,0 +1,139 @@
+# detector.py
+
+"""Adaptive failure detection for multischedulers.
+
+A PhiAccrualDetector (after Hayashibara et al., "The phi accrual failure
+detector") learns, for every scheduler, the distribution of the intervals
+between its check-ins, and from the time elapsed since a scheduler's latest
+check-in computes a suspicion level phi: the negative base-10 logarithm of the
+probability that a check-in would arrive at least that late, were the
+scheduler still available. A scheduler is deemed unavailable once phi exceeds
+a threshold, so that where check-ins arrive like clockwork failures are
+detected within little more than a check-in interval, while where they are
+irregular (for example because of database hiccups) suspicion grows slowly.
+
+An AdaptiveHeartbeat stretches the interval between a multischeduler's own
+check-ins as the latency it observes in the database grows, sparing a
+struggling database, without exceeding a fraction of the grace period.
+"""
+
+from collections import deque
+from datetime import datetime, timedelta
+import math
+from typing import Deque, Dict, List
+
+
+class PhiAccrualDetector:
+    """Phi accrual failure detector over the check-ins of many schedulers.
+
+    Check-in times are as recorded in the database (by its clock), so phi is
+    computed against the database's current time. Since a stalled database
+    delays every scheduler's check-ins alike, no scheduler is suspected while
+    the observing scheduler's own check-ins are themselves suspiciously late.
+
+    Attributes:
+        threshold: A float, the level of phi beyond which a scheduler is
+                   deemed unavailable.
+        window: An int, the number of most recent intervals between check-ins
+                retained for each scheduler.
+        min_std: A float, the least standard deviation, in seconds, assumed
+                 of the intervals, lest perfectly regular check-ins make the
+                 detector hair-triggered.
+        intervals: A dict with keys IP addresses of schedulers and values
+                   deques of their latest intervals between check-ins, in
+                   seconds.
+        latest: A dict with keys IP addresses of schedulers and values the
+                datetimes of their latest check-ins.
+    """
+
+    MIN_INTERVALS = 3
+    """Number of intervals needed for a scheduler before it is suspected."""
+
+    def __init__(self,
+                 threshold: float = 8.,
+                 window: int = 100,
+                 min_std: float = .1) -> None:
+        """Initializes PhiAccrualDetector with given threshold, window size,
+           and minimum standard deviation."""
+        self.threshold = threshold
+        self.window = window
+        self.min_std = min_std
+        self.intervals: Dict[str, Deque[float]] = {}
+        self.latest: Dict[str, datetime] = {}
+
+    def heartbeat(self, ip: str, when: datetime) -> None:
+        """Records check-in of scheduler with given IP address at given time,
+           unless it is no later than one already recorded."""
+        if ip in self.latest:
+            if when <= self.latest[ip]:
+                return
+            interval = (when - self.latest[ip]).total_seconds()
+            self.intervals.setdefault(ip, deque(maxlen=self.window)).append(
+                interval)
+        self.latest[ip] = when
+
+    def phi(self, ip: str, now: datetime) -> float:
+        """Returns suspicion level of scheduler with given IP address at given
+           time (zero if too few of its check-ins have been recorded)."""
+        intervals = self.intervals.get(ip, ())
+        if len(intervals) < self.MIN_INTERVALS:
+            return 0.
+        mean = sum(intervals) / len(intervals)
+        variance = sum((x - mean)**2 for x in intervals) / len(intervals)
+        std = max(math.sqrt(variance), self.min_std)
+        elapsed = (now - self.latest[ip]).total_seconds()
+        # probability a normally distributed interval exceeds elapsed
+        later = .5 * math.erfc((elapsed - mean) / (std * math.sqrt(2)))
+        return -math.log10(max(later, 1e-300))
+
+    def suspects(self, me: str, now: datetime) -> List[str]:
+        """Returns IP addresses of schedulers other than given one (the
+           observer's) whose suspicion level exceeds threshold at given time,
+           or no schedulers if the observer itself is so suspect."""
+        if self.phi(me, now) > self.threshold:
+            return []
+        return [ip for ip in self.latest
+                if ip != me and self.phi(ip, now) > self.threshold]
+
+    def forget(self, ip: str) -> None:
+        """Discards all record of scheduler with given IP address."""
+        self.intervals.pop(ip, None)
+        self.latest.pop(ip, None)
+
+
+class AdaptiveHeartbeat:
+    """Interval between check-ins adapted to observed database latency.
+
+    The interval is a given multiple of the exponentially weighted moving
+    average of the latency of check-ins, but no less than a base interval and
+    no more than a ceiling.
+
+    Attributes:
+        base: A float, the least interval, in seconds.
+        ceiling: A float, the greatest interval, in seconds.
+        factor: A float, the multiple of the average latency aimed at.
+        smoothing: A float in (0, 1], the weight of each new latency in the
+                   moving average.
+        latency: A float, the moving average of latency, in seconds.
+    """
+
+    def __init__(self,
+                 base: timedelta,
+                 ceiling: timedelta,
+                 factor: float = 10.,
+                 smoothing: float = .2) -> None:
+        """Initializes AdaptiveHeartbeat with given bounds, factor, and
+           smoothing."""
+        self.base = base.total_seconds()
+        self.ceiling = max(ceiling.total_seconds(), self.base)
+        self.factor = factor
+        self.smoothing = smoothing
+        self.latency = 0.
+
+    def observe(self, latency: float) -> None:
+        """Records latency, in seconds, of a check-in."""
+        self.latency += self.smoothing * (latency - self.latency)
+
+    def interval(self) -> float:
+        """Returns the current interval between check-ins, in seconds."""
+        return min(max(self.base, self.factor * self.latency), self.ceiling)
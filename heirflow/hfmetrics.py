@@ -0,0 +1,190 @@
+# hfmetrics.py
+
+"""Instrumentation of a multischeduler, served in Prometheus text format.
+
+A Metrics object records latency histograms of the phases of each check-in,
+counters of notable events (such as reconnects and changes of leadership),
+and gauges of current state (such as the number of available schedulers),
+and can serve all of them over HTTP at /metrics in the Prometheus text
+exposition format, so that they can be scraped and alerted on, for example
+when check-ins slow down enough to risk spurious failovers.
+"""
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+from typing import Dict, Iterator, List, Sequence
+
+
+class Histogram:
+    """Cumulative histogram of observed durations, in seconds.
+
+    Attributes:
+        bounds: An increasing sequence of floats, the upper bounds of buckets.
+        counts: A list of ints, whose jth entry counts the observations not
+                exceeding the jth bound.
+        count: An int, the number of observations.
+        sum: A float, the sum of all observations.
+    """
+
+    BOUNDS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+    """Default bucket bounds, spanning quick queries to the default grace."""
+
+    def __init__(self, bounds: Sequence[float] = BOUNDS) -> None:
+        """Initializes empty Histogram with given bucket bounds."""
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value: float) -> None:
+        """Records given observation."""
+        for index, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Metrics:
+    """Latency histograms, counters, and gauges describing a multischeduler.
+
+    All methods are thread-safe, so that metrics may be served by one thread
+    while recorded by another.
+
+    Attributes:
+        histograms: A dict with keys names of phases and values Histograms of
+                    their durations.
+        counters: A dict with keys names of events and values the number of
+                  times each has occurred.
+        gauges: A dict with keys names of quantities and values their current
+                values.
+        info: A dict with keys names of string-valued properties (such as the
+              leader's IP address) and values their current values.
+        lock: A threading.Lock guarding all of the above.
+        timers: A threading.local whose attribute open is, for each thread,
+                the list of [phase, start, recorded] lists of the phases
+                being timed, outermost first.
+    """
+
+    PREFIX = 'multischeduler'
+    """Prefix of the name of every metric served."""
+
+    def __init__(self) -> None:
+        """Initializes Metrics with nothing recorded."""
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+        self.gauges: Dict[str, float] = {}
+        self.info: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        self.timers = threading.local()
+
+    def open_timers(self) -> List[list]:
+        """Returns the calling thread's list of phases being timed."""
+        if not hasattr(self.timers, 'open'):
+            self.timers.open = []
+        return self.timers.open
+
+    @contextmanager
+    def time(self, phase: str) -> Iterator[None]:
+        """Context manager recording duration of its body as given phase,
+           whether the body finishes, raises, or is abandoned (see
+           close_timers())."""
+        timer = [phase, time.perf_counter(), False]
+        self.open_timers().append(timer)
+        try:
+            yield
+        finally:
+            self.record(timer)
+
+    def close_timers(self) -> None:
+        """Records durations so far of all phases being timed by the calling
+           thread, which is abandoning them (as when a Multischeduler resets,
+           recursing rather than returning)."""
+        for timer in list(self.open_timers()):
+            self.record(timer)
+
+    def record(self, timer: list) -> None:
+        """Records duration of phase of given timer, unless recorded, and
+           stops timing it."""
+        phase, start, recorded = timer
+        if recorded:
+            return
+        timer[2] = True
+        duration = time.perf_counter() - start
+        timers = self.open_timers()
+        timers[:] = [other for other in timers if other is not timer]
+        with self.lock:
+            self.histograms.setdefault(phase, Histogram()).observe(duration)
+
+    def count(self, event: str) -> None:
+        """Increments counter of given event."""
+        with self.lock:
+            self.counters[event] = self.counters.get(event, 0) + 1
+
+    def set(self, quantity: str, value: float) -> None:
+        """Sets gauge of given quantity to given value."""
+        with self.lock:
+            self.gauges[quantity] = value
+
+    def set_info(self, prop: str, value: str) -> None:
+        """Sets given string-valued property to given value."""
+        with self.lock:
+            self.info[prop] = value
+
+    def render(self) -> str:
+        """Returns all metrics in Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            name = f"{self.PREFIX}_phase_seconds"
+            lines.append(f"# TYPE {name} histogram")
+            for phase, histogram in sorted(self.histograms.items()):
+                for bound, count in zip(histogram.bounds, histogram.counts):
+                    lines.append(f'{name}_bucket{{phase="{phase}",'
+                                 f'le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{phase="{phase}",le="+Inf"}} '
+                             f'{histogram.count}')
+                lines.append(f'{name}_sum{{phase="{phase}"}} {histogram.sum}')
+                lines.append(f'{name}_count{{phase="{phase}"}} '
+                             f'{histogram.count}')
+            for event, count in sorted(self.counters.items()):
+                lines.append(f"# TYPE {self.PREFIX}_{event}_total counter")
+                lines.append(f"{self.PREFIX}_{event}_total {count}")
+            for quantity, value in sorted(self.gauges.items()):
+                lines.append(f"# TYPE {self.PREFIX}_{quantity} gauge")
+                lines.append(f"{self.PREFIX}_{quantity} {value}")
+            for prop, value in sorted(self.info.items()):
+                name = f"{self.PREFIX}_{prop}_info"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f'{name}{{{prop}="{value}"}} 1')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int) -> ThreadingHTTPServer:
+        """Serves metrics at /metrics on given port from a daemon thread and
+           returns the server."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Responds to GET /metrics with rendered metrics."""
+
+            def do_GET(self) -> None:
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                """Suppresses logging of each request."""
+
+        server = ThreadingHTTPServer(('', port), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
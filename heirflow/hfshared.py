@@ -2,6 +2,7 @@
 
 """Basic shared HeirFlow datastructures and classes."""
 
+from datetime import datetime
 from enum import Enum
 import random
 from typing import List, NamedTuple
@@ -26,17 +27,31 @@ class Message(NamedTuple):
         subject: A string representation of the public IP address of the
                  multischeduler being reported on.
         status: A StatusUpdate indicating the reported status of the subject.
+        timestamp: A datetime, as measured by the database's clock, at which
+                   the status was recorded in the scheduler_status snapshot
+                   table, or None if it was not recorded.
     """
 
     sender: str
     subject: str
     status: StatusUpdate
+    timestamp: datetime = None
 
     def __str__(self):
         return (f"sender={self.sender}, "
                 f"self.subject={self.subject}, "
                 f"status={str(self.status.value)}")
 
+
+def declare_news(channel: pika.channel) -> None:
+    """Declares news queue on given channel (the queue must be declared alike
+       by every party). Its messages expire after a minute, by the news-ttl
+       policy set on the broker by config/provision_q_first, rather than by
+       an argument here, which a queue already declared without it would
+       refuse."""
+    channel.queue_declare(queue='news')
+
+
 class Credentials(NamedTuple):
     """Simply stores login credentials, a username and password, as strings."""
 
@@ -0,0 +1,238 @@
+# identity.py
+
+"""Resolution of a multischeduler's identity, the IP address of its host.
+
+Every multischeduler identifies itself (in the database, in reports, and to
+interface.py, which reaches it by SSH) by its host's public IP address, which
+on AWS is served by the instance metadata service. An IdentityProvider
+resolves that address:
+
+    InstanceMetadataIdentity
+        asks the metadata service, by IMDSv2 (falling back to IMDSv1), with
+        a strict timeout on every request
+    ConfiguredIdentity
+        returns an address set in multischeduler.ini
+    InterfaceIdentity
+        returns the address of the local interface routing to the internet
+        (a private address on AWS, which other hosts in the same network can
+        nonetheless reach)
+    FallbackIdentity
+        returns the address resolved by the first of several providers to
+        succeed
+    CachedIdentity
+        returns an address cached on disk since the host last booted, if
+        any, and otherwise resolves (and caches) one by another provider, so
+        that a restarted multischeduler need not wait on the metadata
+        service at all
+
+A provider that cannot resolve an address raises IdentityError. Since a
+host's public IP address can change while it runs (as when an Elastic IP is
+associated with it or disassociated from it), a resolved address is trusted
+only until it is refreshed, which bypasses any cache.
+"""
+
+import abc
+from http.client import HTTPException
+import os
+import socket
+import time
+import urllib.request
+from typing import Sequence
+
+
+class IdentityError(Exception):
+    """Raised when an IdentityProvider cannot resolve an address."""
+
+
+class IdentityProvider(abc.ABC):
+    """Source of the IP address identifying a multischeduler."""
+
+    @abc.abstractmethod
+    def resolve(self) -> str:
+        """Returns IP address, or raises IdentityError."""
+
+    def refresh(self) -> str:
+        """Returns IP address resolved afresh, bypassing any cache, or raises
+           IdentityError (by default, as resolve())."""
+        return self.resolve()
+
+
+class InstanceMetadataIdentity(IdentityProvider):
+    """Public IP address served by the AWS instance metadata service.
+
+    Attributes:
+        timeout: A float, the seconds allowed each request to the service.
+    """
+
+    BASE_URL = 'http://169.254.169.254/latest'
+    """AWS metadata service root"""
+
+    TOKEN_TTL = 60
+    """Seconds an IMDSv2 session token is requested to remain valid"""
+
+    def __init__(self, timeout: float = 1.) -> None:
+        """Initializes InstanceMetadataIdentity with given timeout."""
+        self.timeout = timeout
+
+    def resolve(self) -> str:
+        """Returns public IP address, requested with an IMDSv2 session token
+           if one can be had, and otherwise by IMDSv1."""
+        headers = {}
+        try:
+            headers['X-aws-ec2-metadata-token'] = self.fetch(
+                'api/token',
+                method='PUT',
+                headers={'X-aws-ec2-metadata-token-ttl-seconds':
+                         str(self.TOKEN_TTL)})
+        except IdentityError:
+            pass
+        return self.fetch('meta-data/public-ipv4', headers=headers)
+
+    def fetch(self, path: str, **kwargs) -> str:
+        """Returns body of response from given path of the service to a
+           request with given keyword arguments (as taken by Request)."""
+        request = urllib.request.Request(f"{self.BASE_URL}/{path}", **kwargs)
+        try:
+            with urllib.request.urlopen(request,
+                                        timeout=self.timeout) as response:
+                return response.read().decode('utf8').strip()
+        except (OSError, HTTPException) as error:
+            raise IdentityError(f"metadata service: {error}") from error
+
+
+class ConfiguredIdentity(IdentityProvider):
+    """IP address set in configuration.
+
+    Attributes:
+        ip: A string, the address set, possibly empty.
+    """
+
+    def __init__(self, ip: str) -> None:
+        """Initializes ConfiguredIdentity with given address."""
+        self.ip = ip
+
+    def resolve(self) -> str:
+        """Returns address set, if any."""
+        if not self.ip:
+            raise IdentityError("no address configured")
+        return self.ip
+
+
+class InterfaceIdentity(IdentityProvider):
+    """IP address of the local interface routing to a given remote address.
+
+    Attributes:
+        remote: A string, the remote IP address routed to (no packet is
+                actually sent).
+    """
+
+    def __init__(self, remote: str = '8.8.8.8') -> None:
+        """Initializes InterfaceIdentity routing to given remote address."""
+        self.remote = remote
+
+    def resolve(self) -> str:
+        """Returns address of the local interface."""
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+                probe.connect((self.remote, 80))
+                return probe.getsockname()[0]
+        except OSError as error:
+            raise IdentityError(f"interface: {error}") from error
+
+
+class FallbackIdentity(IdentityProvider):
+    """First IP address resolved by any of several providers.
+
+    Attributes:
+        providers: A sequence of IdentityProviders, tried in order.
+    """
+
+    def __init__(self, providers: Sequence[IdentityProvider]) -> None:
+        """Initializes FallbackIdentity with given providers."""
+        self.providers = providers
+
+    def resolve(self) -> str:
+        """Returns address resolved by the first provider to succeed."""
+        errors = []
+        for provider in self.providers:
+            try:
+                return provider.resolve()
+            except IdentityError as error:
+                errors.append(str(error))
+        raise IdentityError('; '.join(errors) or "no providers")
+
+    def refresh(self) -> str:
+        """Returns address refreshed by the first provider to succeed."""
+        errors = []
+        for provider in self.providers:
+            try:
+                return provider.refresh()
+            except IdentityError as error:
+                errors.append(str(error))
+        raise IdentityError('; '.join(errors) or "no providers")
+
+
+class CachedIdentity(IdentityProvider):
+    """IP address cached on disk since the host last booted.
+
+    An instance's public IP address changes whenever the instance is stopped
+    and started again, so an address cached before the last boot is never
+    used. It can also change while the instance runs, when an Elastic IP is
+    associated with it or disassociated from it, so a cached address is no
+    more than a good guess, to be refreshed when in doubt (as after a failure
+    to reach the database or queue).
+
+    Attributes:
+        provider: An IdentityProvider resolving the address when the cache
+                  is missing or stale.
+        path: A string, the path of the cache file.
+    """
+
+    def __init__(self, provider: IdentityProvider, path: str) -> None:
+        """Initializes CachedIdentity with given provider and cache path."""
+        self.provider = provider
+        self.path = path
+
+    def resolve(self) -> str:
+        """Returns cached address if fresh, and otherwise resolves and caches
+           an address."""
+        return self.cached() or self.refresh()
+
+    def refresh(self) -> str:
+        """Returns address resolved by provider, rewriting the cache, or if
+           that fails the cached address, if fresh."""
+        try:
+            ip = self.provider.resolve()
+        except IdentityError:
+            ip = self.cached()
+            if ip:
+                return ip
+            raise
+        try:
+            temporary = f"{self.path}.tmp"
+            with open(temporary, 'w') as cache:
+                cache.write(ip)
+            os.replace(temporary, self.path)
+        except OSError:
+            pass
+        return ip
+
+    def cached(self) -> str:
+        """Returns address cached since the host last booted, or None."""
+        try:
+            if os.path.getmtime(self.path) > self.boot_time():
+                with open(self.path) as cache:
+                    return cache.read().strip() or None
+        except OSError:
+            pass
+        return None
+
+    @staticmethod
+    def boot_time() -> float:
+        """Returns time (per time.time()) the host last booted, or the
+           present if unknown (so that no cache is deemed fresh)."""
+        try:
+            with open('/proc/uptime') as uptime:
+                return time.time() - float(uptime.read().split()[0])
+        except (OSError, ValueError, IndexError):
+            return time.time()
@@ -12,20 +12,78 @@ the program indicates whether or not it is available and, if it is available,
 whether or not it is the leader (the scheduler currently active or on duty)
 and, if it is available but not leading, what scheduler it is following
 (that is acknowleding as the leader).
+
+On startup the program loads in a single query the last-value snapshot of
+every scheduler's status kept in the database by the multischedulers (see
+multischeduler.py), and thereafter applies only messages newer than what it
+already knows of their subjects. Meanwhile it reconciles its view in the
+background against the schedulers table every few seconds (as set in
+interface.ini), over a single lasting connection and fetching only check-ins
+made since the previous reconciliation, and applies only what has changed.
 The program also supports the following commands.
 
     update
-        queries database directly to determine and display available
-        multischedulers and leader
+        reconciles at once against the database to determine and display
+        available multischedulers and leader
 
-    stop [number labeling scheduler, as displayed on terminal]
+    stop [selection of schedulers]
         sends command via ssh to stop systemd airflow-multischeduler service
 
-    start [number labeling scheduler, as displayed on terminal]
+    start [selection of schedulers]
         sends command via ssh to start systemd airflow-multischeduler service
 
+    restart [selection of schedulers]
+        sends command via ssh to restart systemd airflow-multischeduler service
+
+        where a selection of schedulers is a number labeling a scheduler (as
+        displayed on terminal), a range of such numbers (such as 1-8, taking
+        in whichever schedulers are still listed between its ends, even if
+        those ends have been removed), a comma-separated list of numbers and
+        ranges (such as 1,3,5-7), or one
+        of all, available, unavailable, leader, or following (that is
+        available but not leading); commands are sent to all selected
+        schedulers concurrently, over ssh connections kept open to each host,
+        without blocking the prompt, and the result and duration of each
+        command is displayed as it arrives
+
     report
-        clears screen and last known status of all known multischedulers
+        clears screen and displays last known status of multischedulers
+        (those on the current page of the current view)
+
+    view [all, available, unavailable, leader, or following]
+        displays, from its first page, the given view of multischedulers
+        (following being those available but not leading)
+
+    view following [number labeling scheduler]
+        displays, from its first page, the followers of the given leader
+
+    page [number]
+        displays the given page of the current view
+
+    next [or] prev
+        displays the next or previous page of the current view
+
+    history [number]
+        displays the given number (by default 20) of the latest transitions,
+        that is messages applied, each with the time it was received
+
+    failovers [minutes]
+        displays percentiles of the durations of leader gaps (during which no
+        available scheduler was known to be leading) and of how long
+        followers went on following a leader reported unavailable, over the
+        given number of latest minutes (by default all transitions logged)
+
+    flaps [minutes]
+        displays percentiles of how often, per hour, each scheduler went from
+        available to unavailable, and the schedulers flapping most
+
+    availability [minutes]
+        displays percentiles of the fraction of time each scheduler was
+        available, and the schedulers least available
+
+        where transitions are kept in a bounded ring buffer in memory and
+        appended to a log file (as set in interface.ini; see transitions.py),
+        from which the ring buffer is refilled when the program restarts
 
     remove [or] delete [number labeling scheduler]
         deletes a multischeduler from the reporting list
@@ -60,13 +118,35 @@ Database failover will also break the interface, which can simply be restarted
 after updating the database public IP in interface.ini.
 """
 
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 import configparser
+from datetime import datetime, timedelta
+from itertools import islice
 from os import system
 import pickle
+import subprocess
+import tempfile
 import threading
-from typing import Any, Dict, List, Union
-
-from hfshared import Credentials, Database, Message, QueueHost, StatusUpdate
+import time
+from typing import (Any,
+                    Dict,
+                    Iterable,
+                    Iterator,
+                    List,
+                    Optional,
+                    Set,
+                    Tuple,
+                    Union)
+
+import psycopg2
+
+from hfshared import (Credentials,
+                      Database,
+                      Message,
+                      QueueHost,
+                      StatusUpdate,
+                      declare_news)
+from transitions import Replay, TransitionLog, summarize
 
 
 News = Union[StatusUpdate, str]
@@ -86,11 +166,14 @@ class ReportedScheduler:
     scheduler's status.
 
     Attributes:
-        key: An integer to identify, concisely, the multischeduler.
+        key: An integer to identify, concisely, the multischeduler, never
+             reused by another multischeduler.
         ip: A string representation of the multischeduler's public IP address.
         cluster: A SchedulerCluster (below), to which this scheduler belongs.
         available: A boolean indicating availability of this scheduler.
         leading: A boolean indicating whether or not this scheduler is leading.
+        leader: A string representation of the public IP address of the
+                scheduler this scheduler is following, if known.
     """
 
     def __init__(self, key: int,
@@ -119,24 +202,35 @@ class ReportedScheduler:
         if news == StatusUpdate.UNAVAILABLE:
             self.available = False
             self.leading = False
-            self.leader = None
+            self.follow(None)
         if news == StatusUpdate.LEADER:
             self.leading = True
         if isinstance(news, str):  # in this case the news is the leader's IP
-            self.leader = news
+            self.follow(news)
+
+    def follow(self, leader: str) -> None:
+        """Sets leader to given IP address (or None), keeping the cluster's
+           index of followers current."""
+        if leader != self.leader:
+            self.cluster.index_follower(self.ip, self.leader, leader)
+            self.leader = leader
 
     def report(self) -> str:
         """Returns a string summarizing the state of the ReportedScheduler."""
         head = f"Scheduler {self.key} ({self.ip}) is "
         if self.leading:
-            tail = "leading."
+            followers = len(self.cluster.followers.get(self.ip, ())) - (
+                self.ip in self.cluster.followers.get(self.ip, ()))
+            tail = f"leading (followed by {followers})."
             style = "\033[35;1;48m"  # bold purple with black background
         elif self.available:
             tail = "available"
             if self.leader:
-                leader_key = self.cluster.dict[self.leader].key
+                leader = self.cluster.dict.get(self.leader)
                 tail += " and following "
-                tail += "\033[35;1;48m" + f"Scheduler {leader_key}."  # purple
+                tail += "\033[35;1;48m"  # purple
+                tail += (f"Scheduler {leader.key}." if leader
+                         else f"{self.leader}.")
             else:
                 tail += "."
             style = "\033[32;1;48m"  # bold green with black background
@@ -145,93 +239,465 @@ class ReportedScheduler:
             style = "\033[31;1;48m"  # bold red with black background
         return style + head + tail + "\033[0m"  # revert to default style
 
-    def update_key(self, key: int) -> None:
-        """Replaces current key with given value."""
-        self.key = key
-
 
 class SchedulerCluster:
     """Abstraction of the cluster of schedulers as reported to the interface.
 
+    Schedulers are indexed both by IP address and by key, and followers by
+    leader, so that adding, updating, and removing a scheduler, and counting
+    the followers of a leader, all take constant time. Reports display one
+    page of a view of the schedulers (all of them, or only those available,
+    unavailable, leading, or following), so that they remain quick however
+    many schedulers are known.
+
     Attributes:
         dict: A dictionary with keys the server public IP addresses (as strs)
               known to the interface and values the corresponding
               ReportedSchedulers.
-        list: A list whose entries are the ReportedSchedulers in dict, in the
-              order they are reported to the interface (with deletions
-              supported).
+        keys: A dictionary with keys the keys of the ReportedSchedulers in
+              dict and values those ReportedSchedulers, in order of key (that
+              is the order they are reported to the interface).
+        next_key: An int, the key to be given the next scheduler reported.
+        followers: A dictionary with keys IP addresses of schedulers followed
+                   and values the sets of IP addresses of their followers.
+        updated: A dictionary with keys server public IP addresses and values
+                 the latest timestamps (by the database's clock) of News
+                 applied to the corresponding ReportedSchedulers.
+        view: A tuple, the name of the view reported (one of VIEWS) and the
+              key of a leader, if only its followers are to be viewed.
+        page: An int, the base-1 index of the page of the view reported.
+        page_size: An int, the number of schedulers on each page.
+        pending: A boolean indicating whether a report has been requested
+                 by refresh() but not yet made.
+        lock: A threading.Lock serializing access to all of the above, which
+              are updated from the queue, the database, and the prompt.
+        log: A TransitionLog (defined in transitions.py) recording every
+             Message applied.
     """
 
-    def __init__(self) -> None:
-        """Initializes SchedulerCluster with dict and list both empty."""
+    VIEWS = ('all', 'available', 'unavailable', 'leader', 'following')
+    """Names of views of schedulers"""
+
+    REFRESH = .2
+    """Seconds over which reports requested by refresh() are coalesced"""
+
+    def __init__(self,
+                 page_size: int = 40,
+                 log: TransitionLog = None) -> None:
+        """Initializes empty SchedulerCluster reporting pages of given size
+           and recording Messages applied in given TransitionLog (by default
+           one kept in memory alone)."""
         self.dict: Dict[str, ReportedScheduler] = dict()
-        self.list: List[ReportedScheduler] = []
+        self.keys: Dict[int, ReportedScheduler] = dict()
+        self.next_key = 1
+        self.followers: Dict[str, Set[str]] = dict()
+        self.updated: Dict[str, datetime] = dict()
+        self.view: Tuple[str, Optional[int]] = ('all', None)
+        self.page = 1
+        self.page_size = page_size
+        self.pending = False
+        self.lock = threading.Lock()
+        self.log = log or TransitionLog()
 
     def consume(self, message: Message) -> None:
         """Updates SchedulerCluster in response to given Message.
 
         Extracts News from given Message and directs each such piece of News
         to the relevant Scheduler, adding the Scheduler to SchedulerCluster if
-        not already present.
+        not already present, unless the Message is older than News already
+        applied to that Scheduler. Records the Message in log if any of its
+        News is applied.
         """
         recipients: List[str] = [message.subject]
         news: List[News] = [message.status]
         if message.status == StatusUpdate.LEADER:
             recipients.append(message.sender)
             news.append(message.subject)
-        for recipient, news in zip(recipients, news):
-            if recipient not in self.dict:
-                new_rs = ReportedScheduler(key=len(self.list) + 1,
-                                           ip=recipient,
-                                           cluster=self,
-                                           news=news)
-                self.dict[recipient] = new_rs
-                self.list.append(new_rs)
-            else:
-                self.dict[recipient].update(news)
+        with self.lock:
+            applied = False
+            for recipient, news in zip(recipients, news):
+                if self.is_stale(recipient, message.timestamp):
+                    continue
+                applied = True
+                if message.timestamp:
+                    self.updated[recipient] = message.timestamp
+                if recipient not in self.dict:
+                    new_rs = ReportedScheduler(key=self.next_key,
+                                               ip=recipient,
+                                               cluster=self,
+                                               news=news)
+                    self.dict[recipient] = new_rs
+                    self.keys[new_rs.key] = new_rs
+                    self.next_key += 1
+                else:
+                    self.dict[recipient].update(news)
+            if applied:
+                self.log.record(message)
+
+    def index_follower(self, ip: str, old: str, new: str) -> None:
+        """Moves scheduler with given IP address from the followers of given
+           old leader (if any) to those of given new leader (if any)."""
+        if old in self.followers:
+            self.followers[old].discard(ip)
+            if not self.followers[old]:
+                del self.followers[old]
+        if new:
+            self.followers.setdefault(new, set()).add(ip)
+
+    def is_stale(self, ip: str, timestamp: datetime) -> bool:
+        """Checks whether News of given timestamp (if any) about scheduler
+           with given IP address is older than News already applied."""
+        return (timestamp is not None and ip in self.updated
+                and timestamp < self.updated[ip])
+
+    def restore(self,
+                records: Iterable[Tuple[str, str, str, datetime]]) -> None:
+        """Updates SchedulerCluster from given records of the scheduler_status
+           snapshot table, (ip, status, leader, updated) tuples in order of
+           update, as if from the Messages that produced them."""
+        for ip, status, leader, updated in records:
+            self.consume(Message(sender=ip,
+                                 subject=ip,
+                                 status=StatusUpdate(status),
+                                 timestamp=updated))
+            if leader:
+                self.consume(Message(sender=ip,
+                                     subject=leader,
+                                     status=StatusUpdate.LEADER,
+                                     timestamp=updated))
+
+    def select(self,
+               name: str,
+               leader_key: int = None) -> Iterator[ReportedScheduler]:
+        """Yields, in order of key, schedulers in view of given name (one of
+           VIEWS), those following only the leader of given key, if any."""
+        if name == 'following' and leader_key is not None:
+            leader = self.keys.get(leader_key)
+            ips = self.followers.get(leader.ip, ()) if leader else ()
+            yield from sorted((self.dict[ip] for ip in ips
+                               if ip != leader.ip),
+                              key=lambda scheduler: scheduler.key)
+            return
+        tests = {'all': lambda scheduler: True,
+                 'available': lambda scheduler: scheduler.available,
+                 'unavailable': lambda scheduler: not scheduler.available,
+                 'leader': lambda scheduler: scheduler.leading,
+                 'following': lambda scheduler: (scheduler.available
+                                                 and not scheduler.leading)}
+        yield from filter(tests[name], list(self.keys.values()))
+
+    def set_view(self, name: str, leader_key: int = None) -> None:
+        """Sets view reported to that of given name (one of VIEWS), of
+           followers only of the leader of given key, if any, from page 1."""
+        with self.lock:
+            self.view = (name, leader_key)
+            self.page = 1
+
+    def set_page(self, page: int) -> None:
+        """Sets page of view reported to given base-1 index (or the nearest
+           page there is)."""
+        with self.lock:
+            self.page = max(1, min(page, self.pages()))
+
+    def pages(self) -> int:
+        """Returns the number of pages in the view reported."""
+        if self.view[0] == 'all':
+            size = len(self.keys)
+        else:
+            size = sum(1 for _ in self.select(*self.view))
+        return max(1, -(-size // self.page_size))
 
     def report(self) -> None:
-        """Prints to screen a report on every Scheduler in SchedulerCluster."""
+        """Prints to screen a report on every Scheduler on the current page of
+           the current view of SchedulerCluster."""
+        with self.lock:
+            pages = self.pages()
+            self.page = min(self.page, pages)
+            start = (self.page - 1) * self.page_size
+            lines = [scheduler.report() for scheduler
+                     in islice(self.select(*self.view),
+                               start,
+                               start + self.page_size)]
+            name, leader_key = self.view
+            if leader_key is not None:
+                name += f" {leader_key}"
+            lines.append(f"...{len(self.keys)} scheduler(s) known; "
+                         f"view {name}, page {self.page} of {pages}...")
         system('clear')
-        for scheduler in self.list:
-            print(scheduler.report())
+        print('\n'.join(lines))
+
+    def refresh(self) -> None:
+        """Requests a report, to be made within REFRESH seconds along with
+           any other reports requested meanwhile."""
+        with self.lock:
+            if self.pending:
+                return
+            self.pending = True
+        timer = threading.Timer(self.REFRESH, self.flush)
+        timer.daemon = True
+        timer.start()
+
+    def flush(self) -> None:
+        """Makes a report requested by refresh()."""
+        with self.lock:
+            self.pending = False
+        self.report()
 
     def is_valid_key(self, wannakey: Any) -> bool:
-        """Checks whether given input is a valid key for some scheduler.
-
-        Here a key is a base-1 index for the list attribute.
-        """
+        """Checks whether given input is the key of some scheduler."""
         try:
-            integrated = int(wannakey)
-            return 0 < integrated <= len(self.list)
+            return int(wannakey) in self.keys
         except BaseException:
             return False
 
     def key_to_ip(self, str_key: str) -> str:
-        """Returns the public IP address of scheduler with given key.
+        """Returns the public IP address of scheduler with given key."""
+        return self.keys[int(str_key)].ip
 
-           Here key has the same meaning as in the def of is_valid_key above.
-        """
-        return self.list[int(str_key) - 1].ip
+    def name(self, ip: str) -> str:
+        """Returns label of scheduler with given IP address, as reported."""
+        scheduler = self.dict.get(ip)
+        return f"Scheduler {scheduler.key} ({ip})" if scheduler else ip
 
     def remove(self, str_key: str) -> None:
-        """Removes scheduler with given key SchedulerCluster.
+        """Removes scheduler with given key from SchedulerCluster.
 
-        Appropriately updates dict and list attributes.
+        Appropriately updates dict, keys, and followers attributes.
         """
-        del self.dict[self.key_to_ip(str_key)]
-        del self.list[int(str_key) - 1]
-        self.update_keys()
+        with self.lock:
+            scheduler = self.keys.pop(int(str_key))
+            del self.dict[scheduler.ip]
+            self.updated.pop(scheduler.ip, None)
+            scheduler.follow(None)
 
-    def update_keys(self) -> None:
-        """Enforces definition of key.
 
-        Specifically the key attribute of each scheduler in SchedulerCluster is
-        updated to agree with the base-1 index of that scheduler in the list
-        attribute of SchedulerCluster.
-        """
-        for index, scheduler in enumerate(self.list):
-            scheduler.update_key(index + 1)
+class Reconciler:
+    """Reconciler of a SchedulerCluster against the schedulers table.
+
+    Keeps a single database connection and, at each reconciliation, fetches
+    only the check-ins made since its watermark (less a lookback, lest
+    transactions committed out of order be missed), deems unavailable the
+    schedulers all of whose check-ins have since been purged, and feeds the
+    SchedulerCluster only Messages that change it.
+
+    Attributes:
+        cluster: A SchedulerCluster to reconcile.
+        db: A Database (class defined in hfshared.py) used by Reconciler alone.
+        db_cred: Credentials (class defined in hfshared.py) to access db.
+        period: A float, the seconds between background reconciliations
+                (none if not positive).
+        watermark: A datetime, the latest check-in fetched, or None if none
+                   has been.
+        births: A dict with keys IP addresses of schedulers deemed available
+                and values their births, as of their latest check-ins.
+        latest: A dict with the same keys and values their latest check-ins.
+        lock: A threading.Lock serializing reconciliations.
+    """
+
+    LOOKBACK = timedelta(seconds=1)
+    """How far before the watermark to fetch check-ins"""
+
+    def __init__(self,
+                 cluster: SchedulerCluster,
+                 database: Database,
+                 db_cred: Credentials,
+                 period: float = 5.) -> None:
+        """Initializes Reconciler with given SchedulerCluster, Database,
+           Credentials, and period."""
+        self.cluster = cluster
+        self.db = database
+        self.db_cred = db_cred
+        self.period = period
+        self.watermark: datetime = None
+        self.births: Dict[str, datetime] = dict()
+        self.latest: Dict[str, datetime] = dict()
+        self.lock = threading.Lock()
+
+    def start(self) -> None:
+        """Starts reconciling every period seconds in a daemon thread, if
+           period is positive."""
+        if self.period <= 0:
+            return
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def run(self) -> None:
+        """Reconciles every period seconds, reporting any change; a failed
+           reconciliation is logged (or if the database failed, its
+           connection dropped) and retried rather than ending the thread."""
+        while True:
+            try:
+                if self.reconcile():
+                    self.cluster.refresh()
+            except psycopg2.Error:
+                self.disconnect()
+            except Exception as error:
+                print(f"...reconciliation failed: {error!r}...", flush=True)
+            time.sleep(self.period)
+
+    def reconcile(self) -> bool:
+        """Fetches check-ins since watermark and feeds SchedulerCluster
+           Messages for every change; returns whether there were any."""
+        with self.lock:
+            if not self.db.conn:
+                self.db.connect(self.db_cred)
+            query = "SELECT ip, birth, latest FROM schedulers"
+            if self.watermark:
+                since = self.watermark - self.LOOKBACK
+                query += f"\nWHERE latest > '{since}'"
+            self.db.cur.execute(query)
+            for ip, birth, latest in self.db.cur.fetchall():
+                if ip not in self.latest or latest >= self.latest[ip]:
+                    self.births[ip] = birth
+                    self.latest[ip] = latest
+                if not self.watermark or latest > self.watermark:
+                    self.watermark = latest
+            self.db.cur.execute("SELECT MIN(latest), LOCALTIMESTAMP "
+                                "FROM schedulers")
+            oldest, now = self.db.cur.fetchone()
+            self.db.conn.commit()
+            for ip in list(self.latest):
+                if oldest is None or self.latest[ip] < oldest:  # purged
+                    del self.births[ip]
+                    del self.latest[ip]
+            messages = self.changes(now)
+            for message in messages:
+                self.cluster.consume(message)
+            return bool(messages)
+
+    def changes(self, now: datetime) -> List[Message]:
+        """Returns Messages, timestamped now, bringing SchedulerCluster into
+           agreement with the schedulers deemed available."""
+        leader = min(self.births, key=self.births.get, default=None)
+        messages = [Message(sender=ip,
+                            subject=ip,
+                            status=StatusUpdate.UNAVAILABLE,
+                            timestamp=now)
+                    for ip, scheduler in list(self.cluster.dict.items())
+                    if scheduler.available and ip not in self.latest]
+        for ip in self.latest:
+            scheduler = self.cluster.dict.get(ip)
+            if not scheduler or not scheduler.available:
+                messages.append(Message(sender=ip,
+                                        subject=ip,
+                                        status=StatusUpdate.AVAILABLE,
+                                        timestamp=now))
+            if not scheduler or scheduler.leader != leader:
+                messages.append(Message(sender=ip,
+                                        subject=leader,
+                                        status=StatusUpdate.LEADER,
+                                        timestamp=now))
+        return messages
+
+    def disconnect(self) -> None:
+        """Drops database connection, to be reestablished when next needed."""
+        try:
+            self.db.disconnect()
+        except psycopg2.Error:
+            self.db.conn = None
+            self.db.cur = None
+
+
+class RemoteControl:
+    """Runner of commands over SSH on many multischeduler hosts at once.
+
+    Commands run concurrently on a bounded pool of worker threads, over SSH
+    connections multiplexed (via ControlMaster) through a master connection
+    kept open to each host for a while after its last use, so that only the
+    first of a series of commands sent to a host waits on connection setup.
+
+    Attributes:
+        ssh_key: A string representation of the path to an SSH key by which to
+                 access all schedulers.
+        persist: An int, the seconds a master connection to a host is kept
+                 open after its last use.
+        control_dir: A string, the path of a private directory holding the
+                     sockets of master connections.
+        pool: A ThreadPoolExecutor running commands.
+    """
+
+    SERVICE = 'airflow-multischeduler'
+    """Name of the systemd service running each multischeduler"""
+
+    TIMEOUT = 30
+    """Seconds allowed each remote command before it is abandoned"""
+
+    def __init__(self,
+                 ssh_key: str,
+                 workers: int = 16,
+                 persist: int = 600) -> None:
+        """Initializes RemoteControl with given SSH key, number of workers,
+           and persistence of master connections."""
+        self.ssh_key = ssh_key
+        self.persist = persist
+        self.control_dir = tempfile.mkdtemp(prefix='heirflow-ssh-')
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def ssh_command(self, ip: str, remote_cmd: str) -> List[str]:
+        """Returns command to run given remote command on host with given IP
+           address over a multiplexed SSH connection."""
+        return ['ssh',
+                '-o', 'ConnectTimeout=5',
+                '-o', 'StrictHostKeyChecking=no',
+                '-o', 'BatchMode=yes',
+                '-o', 'ControlMaster=auto',
+                '-o', f"ControlPath={self.control_dir}/%C",
+                '-o', f"ControlPersist={self.persist}",
+                '-i', self.ssh_key,
+                f"ubuntu@{ip}",
+                remote_cmd]
+
+    def run(self,
+            ip: str,
+            remote_cmd: str) -> Tuple[Optional[int], str, float]:
+        """Runs given remote command on host with given IP address; returns
+           its exit status (None if it timed out), the last line of its
+           output, and its duration in seconds."""
+        start = time.perf_counter()
+        try:
+            completed = subprocess.run(self.ssh_command(ip, remote_cmd),
+                                       stdin=subprocess.DEVNULL,
+                                       capture_output=True,
+                                       text=True,
+                                       timeout=self.TIMEOUT)
+            lines = (completed.stderr or completed.stdout).strip().splitlines()
+            result = completed.returncode, lines[-1] if lines else ''
+        except subprocess.TimeoutExpired:
+            result = None, 'timed out'
+        return result + (time.perf_counter() - start,)
+
+    def fan_out(self, action: str, targets: List[Tuple[int, str]]) -> None:
+        """Submits given systemctl action on the multischeduler service of
+           each given (key, IP address) target, and displays results from a
+           daemon thread as they arrive."""
+        remote_cmd = f"sudo systemctl {action} {self.SERVICE}"
+        futures = {self.pool.submit(self.run, ip, remote_cmd): (key, ip)
+                   for key, ip in targets}
+        thread = threading.Thread(target=self.collect, args=(action, futures))
+        thread.daemon = True
+        thread.start()
+
+    def collect(self,
+                action: str,
+                futures: Dict[Future, Tuple[int, str]]) -> None:
+        """Displays the result of each given future, keyed by its (key, IP
+           address) target, as it completes, then a summary."""
+        start = time.perf_counter()
+        failures = 0
+        for future in as_completed(futures):
+            key, ip = futures[future]
+            status, output, seconds = future.result()
+            if status == 0:
+                outcome = "done"
+            else:
+                failures += 1
+                outcome = f"failed ({output or f'exit status {status}'})"
+            print(f"...{action} Scheduler {key} ({ip}): {outcome} "
+                  f"in {seconds:.2f}s...")
+        print(f"...{action} of {len(futures)} scheduler(s) finished "
+              f"in {time.perf_counter() - start:.2f}s "
+              f"with {failures} failure(s)...")
 
 
 class CommandPrompt():
@@ -245,46 +711,80 @@ class CommandPrompt():
                  access all schedulers.
         db: A Database (class defined in hfshared.py)
         db_cred: Credentials (class defined in hfshared.py) to access db
+        reconciler: A Reconciler of schedulers against db, with a connection
+                    of its own.
+        remote: A RemoteControl running commands on schedulers over ssh.
     """
 
     def __init__(self,
                  schedulers: SchedulerCluster,
                  ssh_key: str,
                  database: Database,
-                 db_cred: Credentials) -> None:
+                 db_cred: Credentials,
+                 period: float = 5.,
+                 remote: RemoteControl = None) -> None:
         """Initializes CommandPrompt() with given SchedulerCluster, ssh key,
-           Database, and Credentials; calls update function; and initiates
-           input loop."""
+           Database, Credentials, and RemoteControl (by default one with
+           given ssh key); loads snapshot; starts a Reconciler with given
+           period; and initiates input loop."""
         self.schedulers = schedulers
         self.listening = True
         self.ssh_key = ssh_key
         self.db = database
         self.db_cred = db_cred
-        self.update()
+        self.reconciler = Reconciler(schedulers,
+                                     Database(database.host_ip, database.name),
+                                     db_cred,
+                                     period)
+        self.remote = remote or RemoteControl(ssh_key)
+        self.load_snapshot()
+        self.reconciler.start()
         while self.listening:
             self.process(input())
 
-    def update(self) -> None:
-        """Gets and displays current info on all schedulers by querying db."""
+    def load_snapshot(self) -> None:
+        """Gets and displays last known status of all schedulers from the
+           scheduler_status snapshot table in db."""
         self.db.connect(self.db_cred)
-        query = ("SELECT DISTINCT \n"
-                 + "\t ip, birth \n"
-                 + "FROM \n"
-                 + "\t schedulers\n"
-                 + "ORDER BY \n"
-                 + "\t birth \n"
-                 + "ASC")
+        query = ("SELECT ip, status, leader, updated\n"
+                 "FROM scheduler_status\n"
+                 "ORDER BY updated")
         self.db.cur.execute(query)
-        ips_by_rank = [record[0] for record in self.db.cur.fetchall()]
-        self.schedulers.consume(Message(sender=ips_by_rank[0],
-                                        subject=ips_by_rank[0],
-                                        status=StatusUpdate.LEADER))
-        for ip in ips_by_rank[1:]:
-            self.schedulers.consume(Message(sender=ip,
-                                            subject=ip,
-                                            status=StatusUpdate.AVAILABLE))
+        self.schedulers.restore(self.db.cur.fetchall())
+        self.db.disconnect()
         self.schedulers.report()
 
+    def update(self) -> None:
+        """Reconciles schedulers against db at once and displays them."""
+        try:
+            self.reconciler.reconcile()
+        except psycopg2.Error:
+            self.reconciler.disconnect()
+            print("...database unreachable...")
+            return
+        self.schedulers.report()
+
+    def select(self, selection: str) -> Optional[List[Tuple[int, str]]]:
+        """Returns keys and IP addresses of schedulers in given selection (as
+           described in the module docstring), or None if the selection is
+           not understood."""
+        if selection in SchedulerCluster.VIEWS:
+            with self.schedulers.lock:
+                return [(scheduler.key, scheduler.ip) for scheduler
+                        in self.schedulers.select(selection)]
+        keys = set()
+        for part in selection.split(','):
+            bounds = part.split('-')
+            if len(bounds) == 1 and not self.schedulers.is_valid_key(part):
+                return None
+            if len(bounds) > 2 or not all(map(str.isdigit, bounds)):
+                return None
+            keys.update(key for key in range(int(bounds[0]),
+                                             int(bounds[-1]) + 1)
+                        if self.schedulers.is_valid_key(key))
+        return [(key, self.schedulers.key_to_ip(str(key)))
+                for key in sorted(keys)]
+
     def process(self, cmd: str) -> None:
         """Parses and responds to text input."""
         parsed = cmd.split()
@@ -299,26 +799,108 @@ class CommandPrompt():
         elif cmd == 'update':
             self.update()
 
-        elif len(parsed) == 2 and self.schedulers.is_valid_key(parsed[1]):
-            action, key = parsed
-            if action in {'start', 'stop'}:
-                ip = self.schedulers.key_to_ip(key)
-                service = "airflow-multischeduler"
-                remote_cmd = f"sudo systemctl {action} {service}"
-                local_cmd = "ssh -o ConnectTimeout=5"
-                local_cmd += " -o StrictHostKeyChecking=no"
-                local_cmd += f" -i {self.ssh_key} ubuntu@{ip} {remote_cmd}"
-                system(local_cmd)
-                self.schedulers.report()
-                print(f"...attempted to {action} Scheduler {key}...")
-
-            elif action in {'delete', 'remove'}:
-                self.schedulers.remove(key)
-                self.schedulers.report()
+        elif (parsed and parsed[0] == 'view' and len(parsed) in {2, 3}
+              and parsed[1] in SchedulerCluster.VIEWS
+              and (len(parsed) == 2 or (parsed[1] == 'following'
+                                        and self.schedulers.is_valid_key(
+                                            parsed[2])))):
+            leader_key = int(parsed[2]) if len(parsed) == 3 else None
+            self.schedulers.set_view(parsed[1], leader_key)
+            self.schedulers.report()
+
+        elif cmd in {'next', 'prev'}:
+            step = 1 if cmd == 'next' else -1
+            self.schedulers.set_page(self.schedulers.page + step)
+            self.schedulers.report()
+
+        elif len(parsed) == 2 and parsed[0] == 'page' and parsed[1].isdigit():
+            self.schedulers.set_page(int(parsed[1]))
+            self.schedulers.report()
+
+        elif (len(parsed) == 2 and parsed[0] in {'start', 'stop', 'restart'}
+              and self.select(parsed[1]) is not None):
+            action, selection = parsed
+            targets = self.select(selection)
+            if targets:
+                self.remote.fan_out(action, targets)
+                print(f"...attempting to {action} "
+                      f"{len(targets)} scheduler(s)...")
+            else:
+                print("...no schedulers selected...")
+
+        elif (parsed and parsed[0] == 'history' and len(parsed) <= 2
+              and (len(parsed) == 1 or parsed[1].isdigit())):
+            self.history(int(parsed[1]) if len(parsed) == 2 else 20)
+
+        elif (parsed and parsed[0] in {'failovers', 'flaps', 'availability'}
+              and len(parsed) <= 2
+              and (len(parsed) == 1 or parsed[1].isdigit())):
+            minutes = int(parsed[1]) if len(parsed) == 2 else None
+            getattr(self, parsed[0])(self.replay(minutes))
+
+        elif (len(parsed) == 2 and parsed[0] in {'delete', 'remove'}
+              and self.schedulers.is_valid_key(parsed[1])):
+            self.schedulers.remove(parsed[1])
+            self.schedulers.report()
 
         else:
             print("...command not understood...")
 
+    def history(self, number: int) -> None:
+        """Displays given number of the latest transitions."""
+        transitions = self.schedulers.log.transitions()
+        for transition in transitions[max(0, len(transitions) - number):]:
+            received = datetime.fromtimestamp(transition.received)
+            print(f"{received:%Y-%m-%d %H:%M:%S.%f}"[:-3]
+                  + f"  {transition.sender} reports "
+                  f"{transition.subject} {transition.status.value}")
+        print(f"...{len(transitions)} transition(s) logged...")
+
+    def replay(self, minutes: Optional[int]) -> Replay:
+        """Returns Replay of transitions logged over given number of latest
+           minutes (all of them if None)."""
+        since = time.time() - 60 * minutes if minutes is not None else None
+        return Replay(self.schedulers.log.transitions(since))
+
+    def failovers(self, replay: Replay) -> None:
+        """Displays durations of leader gaps and of stale following."""
+        gaps = replay.gap_durations()
+        print(f"...leader gaps (s) {summarize(gaps)}...")
+        open_gaps = [start for start, end in replay.gaps if end is None]
+        if open_gaps:
+            print(f"...no leader for {replay.end - open_gaps[0]:.3g}s "
+                  f"and counting...")
+        stale = [seconds for _, _, seconds in replay.stale
+                 if seconds is not None]
+        print(f"...following after leader unavailable (s) "
+              f"{summarize(stale)}...")
+        with self.schedulers.lock:
+            for follower, leader, seconds in replay.stale:
+                if seconds is None:
+                    print(f"...{self.schedulers.name(follower)} still "
+                          f"following {self.schedulers.name(leader)}...")
+
+    def flaps(self, replay: Replay) -> None:
+        """Displays flap rates of schedulers."""
+        rates = replay.flap_rates()
+        print(f"...flaps per hour {summarize(list(rates.values()))}...")
+        with self.schedulers.lock:
+            for ip in sorted(rates, key=rates.get, reverse=True)[:10]:
+                if replay.flaps[ip]:
+                    print(f"...{self.schedulers.name(ip)}: "
+                          f"{replay.flaps[ip]} flap(s), "
+                          f"{rates[ip]:.3g} per hour...")
+
+    def availability(self, replay: Replay) -> None:
+        """Displays availability of schedulers."""
+        fractions = replay.availability()
+        print(f"...availability "
+              f"{summarize(list(fractions.values()), (1, 10, 50))}...")
+        with self.schedulers.lock:
+            for ip in sorted(fractions, key=fractions.get)[:10]:
+                print(f"...{self.schedulers.name(ip)}: "
+                      f"{100 * fractions[ip]:.2f}% available...")
+
 
 class MessageConsumer:
     """Consumer to receive messages from given queue, feed them to given
@@ -339,7 +921,7 @@ class MessageConsumer:
         callback."""
         self.cluster = cluster
         q.connect(credentials)
-        q.channel.queue_declare(queue='news')
+        declare_news(q.channel)
         q.channel.basic_consume(queue='news',
                                 on_message_callback=self.callback,
                                 auto_ack=True)
@@ -353,7 +935,7 @@ class MessageConsumer:
     def callback(self, ch, method, properties, body) -> None:
         """Directs message body to SchedulerCluster cluster and reports."""
         self.cluster.consume(pickle.loads(body))
-        self.cluster.report()
+        self.cluster.refresh()
 
 
 def main() -> None:
@@ -370,11 +952,20 @@ def main() -> None:
     database = Database(host_ip=db['db_public_ip'], name=db['database'])
     db_cred = Credentials(user=db['db_user'], password=db['db_pwd'])
 
-    schedulers = SchedulerCluster()
+    period = config.getfloat('RECONCILE', 'period', fallback=5.)
+    remote = RemoteControl(ssh_key,
+                           workers=config.getint('SSH', 'workers',
+                                                 fallback=16),
+                           persist=config.getint('SSH', 'persist',
+                                                 fallback=600))
+
+    log = TransitionLog(config.get('LOG', 'path', fallback=None),
+                        config.getint('LOG', 'capacity', fallback=10000))
+    schedulers = SchedulerCluster(log=log)
 
     MessageConsumer(qvh, q_cred, schedulers)
 
-    CommandPrompt(schedulers, ssh_key, database, db_cred)
+    CommandPrompt(schedulers, ssh_key, database, db_cred, period, remote)
 
 
 if __name__ == '__main__':
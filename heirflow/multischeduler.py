@@ -24,46 +24,126 @@ apparent).
 The script assumes a Postgres database (though CockroachDB may be supported in
 a future release) containing a table
 Schedulers(ip varchar(15), birth timestamp, latest timestamp),
-and the script will interact with no other tables. For proper functioning this
-database should also house the Airflow metadata store.
+the snapshot table scheduler_status (below), and (if fencing is enabled) a
+sequence fencing_tokens, and the script will interact with no other tables.
+For proper functioning this database should also house the Airflow metadata
+store. Check-ins may instead (as set in multischeduler.ini) be kept in a
+lighter store, such as a Redis server (see coordination.py), in which case
+the schedulers table goes unused and coordination traffic no longer competes
+with the Airflow scheduler's own queries of the metadata database.
 
 Secondarily the script sends updates on the status of schedulers to the message
 queue (assumed RabbitMQ and on the same server as the task queue) to be picked
-up by the monitoring script interface.py.
+up by the monitoring script interface.py, and records each update in a
+last-value snapshot table
+scheduler_status(ip varchar(15) primary key, status varchar(11),
+                 leader varchar(15), updated timestamp),
+holding the latest status of each scheduler and the leader it follows, from
+which the interface starts before applying only newer updates. Updates expire
+from the queue after a while (see hfshared.py), so they cannot pile up while
+no interface is running.
 
 Database and message queue connection data, along with certain tunable timing
 parameters, are imported from multischeduler.ini.
 
-In the current version no action is taken against a scheduler that becomes
-unavailable (though a notification is issued to be read by interface.py); it is
-simply trusted that if that scheduler is later able to access the database then
-it will observe that it is no longer the leader and so stop (if necessary) its
-Airflow scheduler process. A future version may implement some kind of fencing:
-for example the database and queue servers could (like interface.py) subscribe
-to the notification queue and block the IP address of the defunct scheduler
-until it issues some kind of assurance that it is healthy.
+The host's public IP address, by which a multischeduler identifies itself, is
+resolved (see identity.py) from the AWS metadata service under a strict
+timeout, cached on disk until the host reboots (but refreshed after any
+failure to connect, in case an Elastic IP has been associated or
+disassociated), and failing that taken from multischeduler.ini or the host's
+network interface. It is resolved while the
+database and queue connections are made, and both connections are always made
+concurrently, so that a restarted multischeduler rejoins its peers at once.
+
+The script records latency histograms of each phase of its check-ins, counts
+reconnects, failovers, and relinquishments of leadership, and tracks the
+current leader and number of available schedulers (see hfmetrics.py), all
+served in Prometheus text format on the port set in multischeduler.ini.
+
+Optionally (as set in multischeduler.ini) a standby multischeduler keeps warm
+a process with Airflow imported and the DAG folder parsed (see
+warm_scheduler.py), which it merely signals to begin scheduling upon accepting
+leadership, sparing the new leader the cold start of an Airflow scheduler.
+
+By default no action is taken against a scheduler that becomes unavailable
+(though a notification is issued to be read by interface.py); it is simply
+trusted that if that scheduler is later able to access the database then it
+will observe that it is no longer the leader and so stop (if necessary) its
+Airflow scheduler process, and a new leader waits a while (its patience) before
+activating its own scheduler, in the hope that the old one has stopped.
+
+Optionally (as set in multischeduler.ini) a scheduler is deemed unavailable
+not only once it has failed to check in within the grace period but as soon as
+a phi accrual failure detector, learning the usual intervals between its
+check-ins, grows confident enough that it has failed (see detector.py), and
+the time between check-ins stretches as the database grows slower to respond.
+
+Alternatively (as set in multischeduler.ini) leaders may be fenced. Upon
+accepting leadership a multischeduler draws a fencing token, the next value of
+the fencing_tokens sequence, and activates its scheduler at once, without
+waiting. At every check-in a leader compares its token with the sequence's
+last value, and should a later token have been drawn it stops its scheduler
+and relinquishes leadership. Fencing can moreover be enforced at the database:
+every Airflow scheduler connects under the application name
+heirflow-scheduler-IP (for its multischeduler's IP), and at every check-in
+the leader terminates all database sessions of schedulers but its own, so that
+a stale leader cut off from the database (and so unaware of its fencing) cannot
+keep scheduling through it.
+
+Finally (as set in multischeduler.ini) the multischedulers may run in sharded
+mode, in which there is no single active scheduler: the DAG files are
+partitioned among all available schedulers by consistent hashing (see
+sharding.py) and every multischeduler runs an Airflow scheduler restricted to
+its own shard, rewriting the restriction (but not relaunching the scheduler)
+whenever membership changes its shard. Each DAG then has a single owner (but
+while shards change hands, for up to a check-in interval plus Airflow's
+dag_dir_list_interval), and scheduling capacity grows with the number of
+nodes. Warm
+standbys, patience, and fencing concern a single active scheduler and so are
+disregarded in sharded mode.
 """
 
+from concurrent.futures import Future, ThreadPoolExecutor
 import configparser
+import os
 import pickle
 import signal
 import subprocess
+import sys
 import time
-import urllib.request
 from datetime import datetime, timedelta
-from typing import Dict
+from typing import Dict, List
 
 import psycopg2
 from psycopg2 import sql
 
 import pika
 
+from coordination import (CoordinationStore,
+                          PostgresStore,
+                          RedisStore,
+                          StoreUnavailable)
+from detector import AdaptiveHeartbeat, PhiAccrualDetector
+from hfmetrics import Metrics
+from identity import (CachedIdentity,
+                      ConfiguredIdentity,
+                      FallbackIdentity,
+                      IdentityError,
+                      IdentityProvider,
+                      InstanceMetadataIdentity,
+                      InterfaceIdentity)
 from hfshared import (Credentials,
                       Database,
                       Message,
                       QueueHost,
                       Services,
-                      StatusUpdate)
+                      StatusUpdate,
+                      declare_news)
+from sharding import ShardedDagFolder
+
+WARM_SETTLE = .5
+"""Seconds a warm standby is given to die of a promotion signalled before it
+   could handle one, before it is trusted to be scheduling"""
 
 
 class Multischeduler:
@@ -95,16 +175,74 @@ class Multischeduler:
                 all Multischedulers this Multischeduler perceives as available.
         process: A subprocess.Popen Airflow scheduler process if Multischeduler
                  is leader; otherwise None.
+        metrics: A Metrics (defined in hfmetrics.py) instrumenting
+                 Multischeduler.
+        warm_refresh: If not None, a float, the seconds between refreshes of
+                      a warm standby scheduler (see warm_scheduler.py), kept
+                      while Multischeduler is available but not leader;
+                      if None, no warm standby is kept.
+        warm: A subprocess.Popen warm standby scheduler process if one is
+              kept; otherwise None.
+        fencing: A boolean indicating whether leaders are fenced (see module
+                 docstring), in which case patience is disregarded.
+        enforce_fencing: A boolean indicating whether fencing is enforced at
+                         the database by terminating sessions of other
+                         schedulers.
+        token: An int, the fencing token drawn upon accepting leadership if
+               Multischeduler is fenced leader; otherwise None.
+        detector: If not None, a PhiAccrualDetector (defined in detector.py)
+                  deeming schedulers unavailable before their grace period
+                  has elapsed.
+        heartbeat: If not None, an AdaptiveHeartbeat (defined in detector.py)
+                   setting the time between check-ins, in place of
+                   time_between_checkins.
+        sharding: If not None, a ShardedDagFolder (defined in sharding.py),
+                  in which case Multischeduler runs in sharded mode (see
+                  module docstring), and process is its Airflow scheduler
+                  process whether or not it is leader.
+        shard: A set of paths, relative to the DAG folder, of the DAG files
+               in Multischeduler's shard in sharded mode.
+        identity: An IdentityProvider (defined in identity.py) resolving ip.
+        store: A CoordinationStore (defined in coordination.py) holding the
+               check-ins of all Multischedulers.
     """
 
-    AWS_MD_URL = 'http://169.254.169.254/latest/meta-data/public-ipv4'
-    """AWS metadata URL to get public IP address of Multischeduler's host"""
+    RECONNECT_DELAY = 30
+    """Seconds to wait after a connection failure before starting over"""
 
     def __init__(self,
                  services: Services,
                  credentials: Dict[str, Credentials],
-                 timing: Dict[str, timedelta]) -> None:
-        """Initializes Multischeduler and calls reset()."""
+                 timing: Dict[str, timedelta],
+                 metrics: Metrics = None,
+                 warm_refresh: float = None,
+                 fencing: bool = False,
+                 enforce_fencing: bool = False,
+                 detector: PhiAccrualDetector = None,
+                 heartbeat: AdaptiveHeartbeat = None,
+                 sharding: ShardedDagFolder = None,
+                 identity: IdentityProvider = None,
+                 store: CoordinationStore = None) -> None:
+        """Initializes Multischeduler (with given Metrics, if any, keeping a
+           warm standby with given refresh period, if any, fenced as given,
+           with given failure detector and heartbeat, if any, sharding given
+           folder, if any, identified by given IdentityProvider, by default
+           the AWS metadata service, and checking in with given
+           CoordinationStore, by default the database's schedulers table),
+           resolving its IP address while connecting to the database, queue,
+           and store, and calls reset()."""
+        self.metrics = metrics or Metrics()
+        self.warm_refresh = warm_refresh
+        self.warm: subprocess.Popen = None
+        self.fencing = fencing
+        self.enforce_fencing = enforce_fencing
+        self.token: int = None
+        self.detector = detector
+        self.heartbeat = heartbeat
+        self.sharding = sharding
+        self.shard = set()
+        self.identity = identity or InstanceMetadataIdentity()
+        self.store = store or PostgresStore(services.db)
         self.services = services
         self.credentials = credentials
         self.timing = timing
@@ -113,96 +251,167 @@ class Multischeduler:
         self.leader: str = None
         self.active = {}
         self.process: subprocess.Popen = None
-        self.set_public_ip()
-        self.reset()
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            resolving = pool.submit(self.set_public_ip)
+            connections = self.open_connections(pool)
+        resolving.result()
+        self.metrics.set_info('ip', self.ip)
+        self.reset(connections)
 
     def set_public_ip(self) -> None:
-        """Sets ip attribute (using AWS)."""
-        self.ip = urllib.request.urlopen(self.AWS_MD_URL).read().decode('utf8')
+        """Sets ip attribute (using identity)."""
+        self.ip = self.identity.resolve()
 
-    def reset(self) -> None:
-        """Reinitializes Multischeduler; calls register_birth() and loop()."""
+    def refresh_public_ip(self) -> None:
+        """Resets ip attribute to the address identity resolves afresh, if
+           it can, since a failure to connect may be due to a change of the
+           host's public IP address."""
+        try:
+            ip = self.identity.refresh()
+        except IdentityError:
+            return
+        if ip != self.ip:
+            self.metrics.count('ip_changes')
+            self.ip = ip
+            self.metrics.set_info('ip', ip)
+
+    def reset(self, connections: List[Future] = None) -> None:
+        """Reinitializes Multischeduler (connecting as in connect(), given
+           connections, if any); calls register_birth() and loop()."""
+        self.metrics.count('resets')
+        self.metrics.close_timers()
         self.leader = None
         self.active = {self.ip}
+        if self.sharding and self.process:
+            self.process.send_signal(signal.SIGINT)
         self.process = None
-        self.db_connect()
-        self.q_connect()
-        self.services.q.channel.queue_declare('news')
+        self.shard = set()
+        self.token = None
+        if self.warm:
+            self.warm.send_signal(signal.SIGINT)
+            self.warm = None
+        self.metrics.set('is_leader', 0)
+        self.metrics.set('active_schedulers', len(self.active))
+        with self.metrics.time('connect'):
+            self.connect(connections)
+        declare_news(self.services.q.channel)
         self.register_birth()
         self.services.q.disconnect()
         self.services.db.disconnect()
+        self.store.disconnect()
         self.loop()
 
-    def db_connect(self) -> None:
-        """Tries to establish database connection."""
+    def connect(self, connections: List[Future] = None) -> None:
+        """Tries to establish database and queue connections, awaiting
+           given attempts, if any, and otherwise making them concurrently."""
+        if connections is None:
+            with ThreadPoolExecutor(max_workers=3) as pool:
+                connections = self.open_connections(pool)
         try:
-            self.services.db.connect(self.credentials['db'])
-        except psycopg2.OperationalError:
+            for connection in connections:
+                connection.result()
+        except (psycopg2.OperationalError,
+                pika.exceptions.AMQPConnectionError,
+                StoreUnavailable):
             self.on_connection_failure()
 
-    def q_connect(self):
-        """Tries to establish queue connection."""
-        try:
-            self.services.q.connect(self.credentials['q'])
-        except pika.exceptions.AMQPConnectionError:
-            self.on_connection_failure()
+    def open_connections(self, pool: ThreadPoolExecutor) -> List[Future]:
+        """Submits attempts to connect to database, queue, and store to given
+           pool and returns them."""
+        return [pool.submit(self.services.db.connect, self.credentials['db']),
+                pool.submit(self.services.q.connect, self.credentials['q']),
+                pool.submit(self.store.connect)]
 
     def on_connection_failure(self):
         """Handles connection failure."""
+        self.metrics.count('reconnects')
         if self.is_leader():
             self.relinquish_leadership()
         self.report(subject=self.ip, status=StatusUpdate.UNAVAILABLE)
-        time.sleep(30)
+        self.refresh_public_ip()
+        time.sleep(self.RECONNECT_DELAY)
         self.reset()
 
     def register_birth(self) -> None:
         """Registers birth."""
-        insert = (f"INSERT INTO schedulers (ip, birth, latest)\n"
-                  f"VALUES (\'{self.ip}\', "
-                  f"CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)\n"
-                  f"RETURNING birth")
-        self.services.db.cur.execute(sql.SQL(insert))
-        self.birth = self.services.db.cur.fetchone()[0]
-        self.services.db.conn.commit()
+        self.birth = self.store.register(self.ip)
         self.report(subject=self.ip, status=StatusUpdate.AVAILABLE)
 
     def loop(self):
         """Executes all check-in tasks."""
         while True:
-            time.sleep(self.timing['time_between_checkins'].total_seconds())
-            self.db_connect()
-            self.q_connect()
-            self.toss_stale()
-            self.send_news()
-            self.fall_in_line()
-            self.take_stock()
-            if self.is_leader() and self.process.returncode:
-                self.relinquish_leadership()
-            self.services.db.disconnect()
-            self.services.q.disconnect()
+            time.sleep(self.checkin_interval())
+            with self.metrics.time('checkin'):
+                with self.metrics.time('connect'):
+                    self.connect()
+                start = time.perf_counter()
+                with self.metrics.time('toss_stale'):
+                    self.toss_stale()
+                with self.metrics.time('send_news'):
+                    self.send_news()
+                if self.heartbeat:
+                    self.heartbeat.observe(time.perf_counter() - start)
+                with self.metrics.time('fall_in_line'):
+                    self.fall_in_line()
+                with self.metrics.time('take_stock'):
+                    self.take_stock()
+                if self.sharding:
+                    self.rebalance()
+                else:
+                    self.keep_warm()
+                    if self.is_leader() and self.process.poll():
+                        self.relinquish_leadership()
+                    if self.is_leader() and self.fencing:
+                        self.check_fence()
+                self.services.db.disconnect()
+                self.services.q.disconnect()
+                self.store.disconnect()
+
+    def checkin_interval(self) -> float:
+        """Returns seconds to wait before the next check-in."""
+        if self.heartbeat:
+            interval = self.heartbeat.interval()
+        else:
+            interval = self.timing['time_between_checkins'].total_seconds()
+        self.metrics.set('checkin_interval', interval)
+        return interval
 
     def toss_stale(self) -> None:
-        """Purges schedulers table in database of all old records."""
-        wait = self.timing['grace_period']
-        delete = (f"DELETE FROM schedulers WHERE "
-                  f"latest<(CURRENT_TIMESTAMP-'{wait}'::interval)")
-        self.services.db.cur.execute(sql.SQL(delete))
-        self.services.db.conn.commit()
+        """Purges store of all old check-ins (and, if there is a detector,
+           calls toss_suspects())."""
+        self.store.toss_stale(self.timing['grace_period'])
+        if self.detector:
+            self.toss_suspects()
+
+    def toss_suspects(self) -> None:
+        """Feeds all check-ins to detector and purges store of all check-ins
+           of schedulers detector suspects."""
+        checkins, now = self.store.checkins()
+        if not checkins:
+            return
+        for ip, latest in checkins:
+            self.detector.heartbeat(ip, latest)
+        suspects = self.detector.suspects(self.ip, now)
+        self.store.remove(suspects)
+        for ip in suspects:
+            self.metrics.count('suspicions')
+            self.detector.forget(ip)
 
     def send_news(self) -> None:
-        """Commits a new record to the database's schedulers table."""
-        insert = (f"INSERT INTO schedulers (ip, birth, latest)\n"
-                  f"VALUES (\'{self.ip}\', '{self.birth}', CURRENT_TIMESTAMP)")
-        self.services.db.cur.execute(sql.SQL(insert))
-        self.services.db.conn.commit()
+        """Records a new check-in in store."""
+        self.store.check_in(self.ip, self.birth)
 
     def fall_in_line(self) -> None:
         """Calls update_leader() and responds accordingly."""
         old_leader = self.leader
         was_leader = self.is_leader()
         self.update_leader()
+        self.metrics.set_info('leader', self.leader)
         if self.leader != old_leader:
-            if was_leader and not self.is_leader():
+            self.metrics.count('leader_changes')
+            if self.sharding:
+                self.metrics.set('is_leader', int(bool(self.is_leader())))
+            elif was_leader and not self.is_leader():
                 self.relinquish_leadership()
             elif self.is_leader() and not was_leader:
                 self.accept_leadership()
@@ -215,6 +424,7 @@ class Multischeduler:
         """Calls update_active() and responds accordingly."""
         formerly_active = self.active
         self.update_active()
+        self.metrics.set('active_schedulers', len(self.active))
         if self.ip not in self.active:
             if self.is_leader():
                 self.relinquish_leadership()
@@ -225,49 +435,193 @@ class Multischeduler:
 
     def update_leader(self) -> None:
         """Determines the current leader and updates leader attribute."""
-        select = ("SELECT x.ip FROM schedulers x\n"
-                  "WHERE x.birth=\n"
-                  "(SELECT MIN(y.birth) FROM schedulers y)")
-        self.services.db.cur.execute(sql.SQL(select))
-        self.leader = self.services.db.cur.fetchone()[0]
-        self.services.db.conn.commit()
+        self.leader = self.store.leader()
 
     def update_active(self) -> None:
         """Determines all available schedulers and updates active attribute."""
-        select = f"SELECT DISTINCT ip from schedulers"
-        self.services.db.cur.execute(sql.SQL(select))
-        self.active = {record[0] for record
-                       in self.services.db.cur.fetchall()}
+        self.active = self.store.active()
 
     def accept_leadership(self) -> None:
-        """Launches Airflow scheduler process and calls send_news()."""
-        time.sleep(self.timing['patience'])
-        self.process = subprocess.Popen(['airflow', 'scheduler'],
-                                        stdout=subprocess.DEVNULL,
-                                        stderr=subprocess.DEVNULL)
+        """Launches Airflow scheduler process (if fenced, as soon as a token
+           is drawn; otherwise after waiting patience) and calls
+           send_news()."""
+        self.metrics.count('failovers')
+        self.metrics.set('is_leader', 1)
+        if self.fencing:
+            self.draw_token()
+            if self.is_fenced():  # a rival drew a later token in the meantime
+                self.metrics.count('fenced')
+                self.reset()
+            if self.enforce_fencing:
+                self.enforce_fence()
+        else:
+            time.sleep(self.timing['patience'])
+        self.process = None
+        if self.warm and self.warm.poll() is None:
+            self.warm.send_signal(signal.SIGUSR1)
+            try:  # a warm standby signalled before handling SIGUSR1 dies
+                self.warm.wait(timeout=WARM_SETTLE)
+            except subprocess.TimeoutExpired:
+                self.metrics.count('warm_promotions')
+                self.process = self.warm
+            self.warm = None
+        if self.process is None:
+            self.process = self.launch_scheduler()
         self.send_news()
 
+    def rebalance(self) -> None:
+        """Determines Multischeduler's shard among available schedulers and,
+           should it have changed, rewrites the restriction of the Airflow
+           scheduler process to it, which the running process picks up when
+           next it lists the DAG folder; launches the process if it is not
+           running (as it is not relaunched on a change of shard, lest its
+           reset of orphaned tasks disturb those of other shards)."""
+        shard = self.sharding.shard(self.active, self.ip)
+        if shard != self.shard or self.process is None:
+            if shard != self.shard:
+                self.metrics.count('rebalances')
+            self.metrics.set('shard_files', len(shard))
+            self.sharding.restrict(shard)
+            self.shard = shard
+        if self.process is None or self.process.poll() is not None:
+            self.process = self.launch_scheduler()
+
+    def launch_scheduler(self) -> subprocess.Popen:
+        """Launches and returns Airflow scheduler process (over the shared
+           DAG folder, restricted by its .airflowignore, in sharded mode)."""
+        command = ['airflow', 'scheduler']
+        if self.sharding:
+            command += ['-sd', self.sharding.dag_folder]
+        return subprocess.Popen(command,
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL,
+                                env=self.scheduler_env())
+
+    def keep_warm(self) -> None:
+        """Launches warm standby scheduler, if one is to be kept while on
+           standby and none is running."""
+        if (self.warm_refresh is None or self.is_leader()
+                or (self.warm and self.warm.poll() is None)):
+            return
+        self.warm = self.launch_warm_scheduler()
+
+    def launch_warm_scheduler(self) -> subprocess.Popen:
+        """Launches and returns warm standby scheduler process."""
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'warm_scheduler.py')
+        return subprocess.Popen([sys.executable,
+                                 script,
+                                 str(self.warm_refresh)],
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL,
+                                env=self.scheduler_env())
+
+    def scheduler_env(self) -> Dict[str, str]:
+        """Returns environment for an Airflow scheduler process, in which it
+           connects to the database under the application name
+           heirflow-scheduler-IP (with IP that of this Multischeduler)."""
+        return dict(os.environ, PGAPPNAME=f"heirflow-scheduler-{self.ip}")
+
+    def draw_token(self) -> None:
+        """Sets token to the next value drawn from fencing_tokens."""
+        select = "SELECT nextval('fencing_tokens')"
+        self.services.db.cur.execute(sql.SQL(select))
+        self.token = self.services.db.cur.fetchone()[0]
+        self.services.db.conn.commit()
+
+    def is_fenced(self) -> bool:
+        """Checks whether a later token than this Multischeduler's has been
+           drawn from fencing_tokens."""
+        select = "SELECT last_value FROM fencing_tokens"
+        self.services.db.cur.execute(sql.SQL(select))
+        last_value = self.services.db.cur.fetchone()[0]
+        self.services.db.conn.commit()
+        return last_value != self.token
+
+    def check_fence(self) -> None:
+        """Relinquishes leadership if fenced and otherwise, if fencing is
+           enforced, calls enforce_fence()."""
+        if self.is_fenced():
+            self.metrics.count('fenced')
+            self.relinquish_leadership()
+        elif self.enforce_fencing:
+            self.enforce_fence()
+
+    def enforce_fence(self) -> None:
+        """Terminates database sessions of all Airflow schedulers launched by
+           other Multischedulers."""
+        terminate = ("SELECT pg_terminate_backend(pid) FROM pg_stat_activity\n"
+                     "WHERE application_name LIKE 'heirflow-scheduler-%'\n"
+                     f"AND application_name<>'heirflow-scheduler-{self.ip}'")
+        self.services.db.cur.execute(sql.SQL(terminate))
+        self.services.db.conn.commit()
+
     def relinquish_leadership(self) -> None:
         """Kills Airflow scheduler process and calls reset()."""
-        self.process.send_signal(signal.SIGINT)
+        self.metrics.count('relinquishments')
+        if self.process:
+            self.process.send_signal(signal.SIGINT)
         self.reset()
 
     def is_leader(self) -> bool:
         """Checks whether or not this Multischeduler is the leader."""
         return self.leader and self.leader == self.ip
 
+    def record_status(self, subject: str, status: StatusUpdate) -> datetime:
+        """Records given status of given subject (and, if the subject is
+           reported leader, that this Multischeduler follows it) in the
+           scheduler_status table, if the database is reachable, and returns
+           the database's timestamp of the record (None if not recorded)."""
+        if not self.services.db.conn:
+            return None
+        leader = 'NULL' if status == StatusUpdate.UNAVAILABLE else 'leader'
+        upsert = ("INSERT INTO scheduler_status (ip, status, updated)\n"
+                  f"VALUES ('{subject}', '{status.value}', LOCALTIMESTAMP)"
+                  "\nON CONFLICT (ip) DO UPDATE SET status=EXCLUDED.status, "
+                  f"leader={leader}, updated=EXCLUDED.updated\n"
+                  "RETURNING updated")
+        follow = ("INSERT INTO scheduler_status (ip, status, leader, updated)"
+                  f"\nVALUES ('{self.ip}', 'available', '{subject}', "
+                  "LOCALTIMESTAMP)\n"
+                  "ON CONFLICT (ip) DO UPDATE SET leader=EXCLUDED.leader, "
+                  "updated=EXCLUDED.updated")
+        try:
+            self.services.db.cur.execute(sql.SQL(upsert))
+            timestamp = self.services.db.cur.fetchone()[0]
+            if status == StatusUpdate.LEADER and subject != self.ip:
+                self.services.db.cur.execute(sql.SQL(follow))
+            self.services.db.conn.commit()
+            return timestamp
+        except psycopg2.Error:
+            try:
+                self.services.db.conn.rollback()
+            except psycopg2.Error:
+                pass
+            return None
+
     def report(self, subject, status: StatusUpdate) -> None:
-        """Publishes Message with given attributes to the queue."""
-        message = Message(sender=self.ip, subject=subject, status=status)
-        self.services.q.channel.basic_publish(exchange='',
-                                              routing_key='news',
-                                              body=pickle.dumps(message))
+        """Records Message with given attributes in the scheduler_status table
+           and publishes it to the queue, if connected (the Message is
+           otherwise lost, as when reporting a failure to connect, and the
+           interface learns the status from the table or later news)."""
+        message = Message(sender=self.ip,
+                          subject=subject,
+                          status=status,
+                          timestamp=self.record_status(subject, status))
         print(message)
+        if not self.services.q.channel:
+            self.metrics.count('unpublished')
+            return
+        with self.metrics.time('publish'):
+            self.services.q.channel.basic_publish(exchange='',
+                                                  routing_key='news',
+                                                  body=pickle.dumps(message))
 
 
 def main() -> None:
-    """Imports database, queue, and timing data from multischeduler.ini and
-       launches a Multischeduler."""
+    """Imports database, queue, timing, metrics, standby, fencing, detector,
+       sharding, identity, and store data from multischeduler.ini, serves
+       metrics, and launches a Multischeduler."""
     # read timing specs and database login info from ini file
     config = configparser.ConfigParser(inline_comment_prefixes='#')
     config.read('multischeduler.ini')
@@ -285,7 +639,49 @@ def main() -> None:
     times = {'grace_period': timing['grace_period'],
              'time_between_checkins': timing['time_between_checkins'],
              'patience': timing['patience'].total_seconds()}
-    Multischeduler(servs, creds, times)
+    metrics = Metrics()
+    port = config.get('METRICS', 'port', fallback='')
+    if port:
+        metrics.serve(int(port))
+    warm_refresh = None
+    if config.getboolean('STANDBY', 'warm', fallback=False):
+        warm_refresh = config.getfloat('STANDBY', 'refresh')
+    fencing = config.getboolean('FENCING', 'fencing', fallback=False)
+    enforce_fencing = config.getboolean('FENCING', 'enforce', fallback=False)
+    detector = heartbeat = None
+    if config.get('DETECTOR', 'phi_threshold', fallback=''):
+        detector = PhiAccrualDetector(
+            threshold=config.getfloat('DETECTOR', 'phi_threshold'),
+            window=config.getint('DETECTOR', 'window', fallback=100),
+            min_std=config.getfloat('DETECTOR', 'min_std', fallback=.1))
+    if config.get('DETECTOR', 'latency_factor', fallback=''):
+        heartbeat = AdaptiveHeartbeat(
+            base=timing['time_between_checkins'],
+            ceiling=timing['grace_period'] / 3,
+            factor=config.getfloat('DETECTOR', 'latency_factor'))
+    sharding = None
+    if config.getboolean('SHARDING', 'sharded', fallback=False):
+        sharding = ShardedDagFolder(
+            dag_folder=config.get('SHARDING', 'dag_folder'),
+            ignore_path=config.get('SHARDING', 'ignore_path'),
+            replicas=config.getint('SHARDING', 'replicas', fallback=64))
+    metadata = InstanceMetadataIdentity(
+        timeout=config.getfloat('IDENTITY', 'timeout', fallback=1.))
+    cache = config.get('IDENTITY', 'cache', fallback='')
+    identity = FallbackIdentity([
+        CachedIdentity(metadata, cache) if cache else metadata,
+        ConfiguredIdentity(config.get('IDENTITY', 'ip', fallback='')),
+        InterfaceIdentity()])
+    store = None
+    if config.get('STORE', 'store', fallback='postgres') == 'redis':
+        store = RedisStore(
+            host=config.get('STORE', 'redis_ip'),
+            port=config.getint('STORE', 'redis_port', fallback=6379),
+            password=config.get('STORE', 'redis_pwd', fallback=''),
+            key=config.get('STORE', 'key', fallback='heirflow:checkins'))
+    Multischeduler(servs, creds, times, metrics, warm_refresh,
+                   fencing, enforce_fencing, detector, heartbeat, sharding,
+                   identity, store)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,164 @@
+# sharding.py
+
+"""Partition of the DAG folder among multischedulers, by consistent hashing.
+
+In sharded mode every available multischeduler runs an Airflow scheduler,
+each restricted to its own shard of the DAG folder. DAG files, rather than
+DAG ids, are what is hashed, since a scheduler can only be restricted to a
+set of files, and a file's DAG ids are not known until the file is parsed;
+every DAG in a file has that file's owner.
+
+Every scheduler still runs over the shared DAG folder itself, so that the
+fileloc Airflow records for each DAG (and hands the Celery workers as
+`airflow run -sd`) is a path every host has. A scheduler is restricted
+instead by the .airflowignore of the DAG folder, which is a symbolic link to
+a local file, at the same path on every scheduler: resolved on each host, it
+is that host's own, generated to ignore every Python file but those in its
+shard (so a DAG file added since is ignored until assigned, rather than
+scheduled by all). Elsewhere, as on workers and the webserver, the link
+dangles and so is disregarded (by Airflow 1.10.3 or later). Patterns of the
+DAG folder's own, if any, belong in .airflowignore.base, copied into every
+generated file. A running scheduler rereads .airflowignore whenever it lists
+the DAG folder (every dag_dir_list_interval seconds), so a shard changing
+hands needs no relaunch; this matters since an Airflow scheduler, when
+launched, resets the state of orphaned task instances of every DAG, those of
+other shards included, which are then requeued by their own schedulers.
+
+Owners are assigned by a HashRing over the IP addresses of the available
+schedulers, each placed at many pseudorandom points of the ring, with a file
+owned by the scheduler at the first point following the file's own hash. When
+a scheduler joins or leaves, only the files between its points and their
+predecessors change hands (about 1/n of them among n schedulers), and every
+scheduler computes the same assignment from the same set of IP addresses.
+"""
+
+import bisect
+import hashlib
+import os
+import re
+from typing import Dict, Iterable, List, Set, Tuple
+
+
+def digest(key: str) -> int:
+    """Returns position of given key on a HashRing."""
+    return int.from_bytes(hashlib.md5(key.encode('utf8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hash ring over the IP addresses of schedulers.
+
+    Attributes:
+        points: A sorted list of (position, IP address) pairs, replicas
+                of them for each scheduler.
+        positions: A sorted list of the positions of points alone, for
+                   bisection.
+    """
+
+    def __init__(self, nodes: Iterable[str], replicas: int = 64) -> None:
+        """Initializes HashRing placing each of given IP addresses at given
+           number of points."""
+        self.points: List[Tuple[int, str]] = sorted(
+            (digest(f"{node}#{replica}"), node)
+            for node in nodes for replica in range(replicas))
+        self.positions = [position for position, _ in self.points]
+
+    def owner(self, key: str) -> str:
+        """Returns IP address of the scheduler owning given key (None if the
+           ring is empty)."""
+        if not self.points:
+            return None
+        index = bisect.bisect(self.positions, digest(key))
+        return self.points[index % len(self.points)][1]
+
+
+class ShardedDagFolder:
+    """DAG folder shared by all schedulers, and one scheduler's shard of it.
+
+    Attributes:
+        dag_folder: A string, the path of the (shared) Airflow DAG folder.
+        ignore_path: A string, the path of the (local) file to which the
+                     .airflowignore of dag_folder links, restricting this
+                     host's scheduler to its shard.
+        replicas: An int, the number of points of each scheduler on the
+                  HashRing.
+        checked: A dict with keys paths of Python files in dag_folder and
+                 values pairs of their modification times and whether they
+                 might then have defined DAGs, lest every file be reread at
+                 every check-in.
+    """
+
+    def __init__(self,
+                 dag_folder: str,
+                 ignore_path: str,
+                 replicas: int = 64) -> None:
+        """Initializes ShardedDagFolder with given folder, local ignore file,
+           and replicas, making .airflowignore of the folder link to the
+           ignore file (or raising ValueError if it is a file of its own,
+           whose patterns belong in .airflowignore.base)."""
+        self.dag_folder = os.path.abspath(dag_folder)
+        self.ignore_path = os.path.abspath(ignore_path)
+        self.replicas = replicas
+        self.checked: Dict[str, Tuple[float, bool]] = {}
+        link = os.path.join(self.dag_folder, '.airflowignore')
+        if not os.path.islink(link):
+            if os.path.lexists(link):
+                raise ValueError(f"{link} must be moved to "
+                                 f"{link}.base in sharded mode")
+            try:
+                os.symlink(self.ignore_path, link)
+            except FileExistsError:  # linked by another scheduler meanwhile
+                pass
+
+    def dag_files(self) -> List[str]:
+        """Returns paths, relative to dag_folder, of all Python files in it
+           that (by Airflow's own heuristic) might define DAGs."""
+        paths = []
+        for root, dirs, files in os.walk(self.dag_folder, followlinks=True):
+            dirs[:] = [name for name in dirs if name != '__pycache__']
+            for name in files:
+                path = os.path.join(root, name)
+                if name.endswith('.py') and self.might_contain_dag(path):
+                    paths.append(os.path.relpath(path, self.dag_folder))
+        return sorted(paths)
+
+    def might_contain_dag(self, path: str) -> bool:
+        """Checks whether file at given path mentions both airflow and DAG,
+           as Airflow requires of DAG files by default."""
+        try:
+            modified = os.path.getmtime(path)
+            if path in self.checked and self.checked[path][0] == modified:
+                return self.checked[path][1]
+            with open(path, 'rb') as file:
+                content = file.read()
+        except OSError:
+            return False
+        self.checked[path] = (modified,
+                              b'airflow' in content and b'DAG' in content)
+        return self.checked[path][1]
+
+    def shard(self, active: Iterable[str], me: str) -> Set[str]:
+        """Returns paths, relative to dag_folder, of DAG files owned by
+           scheduler with given IP address among given available ones."""
+        ring = HashRing(active, self.replicas)
+        return {path for path in self.dag_files() if ring.owner(path) == me}
+
+    def restrict(self, shard: Set[str]) -> None:
+        """Rewrites ignore_path to ignore every Python file in dag_folder but
+           the DAG files at given paths, relative to dag_folder (and whatever
+           .airflowignore.base ignores)."""
+        lines = []
+        try:
+            with open(os.path.join(self.dag_folder,
+                                   '.airflowignore.base')) as base:
+                lines = [line.rstrip('\n') for line in base if line.strip()]
+        except FileNotFoundError:
+            pass
+        owned = '|'.join(re.escape(os.path.join(self.dag_folder, path))
+                         .replace('\\#', '\\x23')  # not taken as a comment
+                         for path in sorted(shard))
+        lines.append(f"^(?!(?:{owned})$).*\\.py$")
+        temporary = f"{self.ignore_path}.tmp"
+        os.makedirs(os.path.dirname(self.ignore_path), exist_ok=True)
+        with open(temporary, 'w') as ignore:
+            ignore.write('\n'.join(lines) + '\n')
+        os.replace(temporary, self.ignore_path)
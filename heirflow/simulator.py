@@ -0,0 +1,664 @@
+# simulator.py
+
+"""Local simulator of a multischeduler cluster, for benchmarking failover.
+
+Runs any number of real Multischedulers (see multischeduler.py) as threads in
+one process, against in-process stand-ins for their services:
+
+    - the database is an in-memory SQLite database shared by all nodes,
+      into which the Postgres statements issued by Multischedulers are
+      translated (LOCALTIMESTAMP and intervals following the simulation's
+      clock, and CURRENT_TIMESTAMP offset-aware, as psycopg2 returns it),
+      and which serves one statement at a time like a busy server;
+    - the queue accepts and counts every message published;
+    - the public IP address of each node is assigned by the simulator;
+    - the Airflow scheduler is a fake process recording when it runs.
+
+Multischedulers may be fenced (see multischeduler.py), though fencing is not
+enforced, since the simulated database has no sessions to terminate, and may
+detect failures with a phi accrual failure detector (see detector.py).
+Check-ins may be kept in the simulated database's schedulers table or in a
+separate in-memory CoordinationStore (see coordination.py), which a database
+stall does not affect and whose operations are not counted as database
+statements.
+
+Each node is supervised as by systemd (see config/airflow-multischeduler
+.service): if its Multischeduler crashes, its scheduler process is stopped
+and it is restarted after a delay.
+
+Once the cluster has settled a fault is injected into the leader or the
+database:
+
+    kill
+        the leader's host dies, taking its scheduler with it
+    partition
+        the leader is cut off from the database and queue for a while
+    stall
+        the database answers no statements for a while
+
+and the simulator measures the time until another node starts its
+scheduler, the time without any scheduler running, the time (and number of
+intervals) with two or more schedulers running at once, and the rate of
+database statements.
+
+The simulation runs in real time, so timing parameters are best scaled down
+(say tenfold) from production values and the results scaled back up. Any
+timing parameter may be given several values, in which case every
+combination is simulated, each for a given number of trials, to compare.
+
+Example:
+    python3 simulator.py --nodes 3 --fault kill --checkin .5 --grace 3 \\
+        --patience .2 .5 1 --trials 3
+    python3 simulator.py --nodes 3 --fault kill --checkin .5 --grace 3 \\
+        --fencing
+    python3 simulator.py --nodes 3 --fault kill --checkin .5 --grace 3 \\
+        --fencing --phi 8
+    python3 simulator.py --nodes 3 --fault stall --checkin .5 --grace 3 \\
+        --store memory
+"""
+
+import argparse
+import contextlib
+from datetime import datetime, timedelta
+import itertools
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set
+
+import psycopg2
+import pika
+
+from coordination import (CheckIns,
+                          CoordinationStore,
+                          MemoryStore,
+                          StoreUnavailable)
+from detector import PhiAccrualDetector
+from hfshared import Services
+from identity import ConfiguredIdentity
+from multischeduler import Multischeduler
+
+
+TIMESTAMP = re.compile(r'\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d{6}'
+                       r'(?:[+-]\d\d:\d\d)?')
+"""Format of timestamps stored by the simulated database."""
+
+
+class Killed(BaseException):
+    """Raised in a simulated node's thread to halt it, as if its host died.
+
+    Not derived from Exception so that no handler within Multischeduler
+    intercepts it.
+    """
+
+
+class Simulation:
+    """State shared by all simulated nodes and their stand-in services.
+
+    Attributes:
+        timing: A dict of timing parameters, as taken by Multischeduler.
+        reconnect_delay: A float, the seconds a Multischeduler waits after a
+                         connection failure (see Multischeduler).
+        restart_delay: A float, the seconds the supervisor waits before
+                       restarting a crashed Multischeduler.
+        fencing: A boolean indicating whether Multischedulers are fenced.
+        phi: If not None, a float, the threshold of the phi accrual failure
+             detector of every Multischeduler; if None, none detects.
+        store: If not None, a MemoryStore holding every Multischeduler's
+               check-ins; if None, they are kept in the database.
+        db: An in-memory sqlite3 connection holding the schedulers and
+            scheduler_status tables.
+        lock: A threading.Lock serializing access to db.
+        stalled_until: A float, the time (per time.time()) until which the
+                       database answers no statements.
+        queries: An int, the number of database statements executed.
+        messages: An int, the number of messages published.
+        intervals: A list of [ip, start, stop] lists recording when each fake
+                   scheduler process ran (stop None while running).
+        nodes: A dict with keys IP addresses and values the Nodes simulated.
+        finished: A boolean indicating whether the simulation has ended.
+    """
+
+    def __init__(self,
+                 timing: Dict[str, Any],
+                 reconnect_delay: float,
+                 restart_delay: float,
+                 fencing: bool = False,
+                 phi: float = None,
+                 store: str = 'database') -> None:
+        """Initializes Simulation with given timing parameters, delays,
+           fencing, detector threshold, and store of check-ins (database or
+           memory), and creates schedulers and scheduler_status tables and
+           fencing_tokens sequence."""
+        self.timing = timing
+        self.reconnect_delay = reconnect_delay
+        self.restart_delay = restart_delay
+        self.fencing = fencing
+        self.phi = phi
+        self.store = MemoryStore() if store == 'memory' else None
+        self.db = sqlite3.connect(':memory:',
+                                  check_same_thread=False,
+                                  isolation_level=None)
+        self.db.create_function('sim_now', 0, self.now)
+        self.db.create_function('sim_now_tz', 0, self.now_tz)
+        self.db.create_function('sim_ago', 1, self.ago)
+        self.db.execute('CREATE TABLE schedulers '
+                        '(ip varchar(15), birth timestamp, latest timestamp)')
+        self.db.execute('CREATE TABLE scheduler_status '
+                        '(ip varchar(15) primary key, status varchar(11), '
+                        'leader varchar(15), updated timestamp)')
+        self.db.execute('CREATE TABLE fencing_tokens (last_value integer)')
+        self.db.execute('INSERT INTO fencing_tokens VALUES (0)')
+        self.lock = threading.Lock()
+        self.stalled_until = 0.
+        self.queries = 0
+        self.messages = 0
+        self.intervals: List[List] = []
+        self.nodes: Dict[str, 'Node'] = {}
+        self.finished = False
+
+    @staticmethod
+    def now() -> str:
+        """Returns the database's current timestamp."""
+        return datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+
+    @staticmethod
+    def now_tz() -> str:
+        """Returns the database's current timestamp with time zone."""
+        return datetime.now().astimezone().isoformat(' ')
+
+    @staticmethod
+    def ago(interval: str) -> str:
+        """Returns the database's timestamp given Postgres interval ago, the
+           interval being formatted as a str of a timedelta."""
+        match = re.fullmatch(r'(?:(-?\d+) days?, )?(\d+):(\d+):([\d.]+)',
+                             interval)
+        days, hours, minutes, seconds = match.groups()
+        then = datetime.now() - timedelta(days=int(days or 0),
+                                          hours=int(hours),
+                                          minutes=int(minutes),
+                                          seconds=float(seconds))
+        return then.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+    @staticmethod
+    def translate(statement: str) -> str:
+        """Returns SQLite translation of given Postgres statement (sequences
+           being represented by tables holding their last values)."""
+        statement = re.sub(r"SELECT nextval\('(\w+)'\)",
+                           r"UPDATE \1 SET last_value=last_value+1 "
+                           r"RETURNING last_value",
+                           statement)
+        statement = re.sub(r"LOCALTIMESTAMP\s*-\s*'([^']*)'::interval",
+                           r"sim_ago('\1')",
+                           statement)
+        statement = statement.replace('LOCALTIMESTAMP', 'sim_now()')
+        statement = statement.replace('CURRENT_TIMESTAMP', 'sim_now_tz()')
+        return re.sub(r'::\w+', '', statement)
+
+    @staticmethod
+    def convert(value: Any) -> Any:
+        """Returns given value from SQLite, as a datetime if it is a
+           timestamp (as psycopg2 would return it)."""
+        if isinstance(value, str) and TIMESTAMP.fullmatch(value):
+            return datetime.fromisoformat(value)
+        return value
+
+    def execute(self, statement: str) -> List[tuple]:
+        """Executes given Postgres statement, once the database is no longer
+           stalled, and returns all resulting rows."""
+        with self.lock:
+            while time.time() < self.stalled_until:
+                time.sleep(.01)
+            self.queries += 1
+            rows = self.db.execute(self.translate(statement)).fetchall()
+        return [tuple(map(self.convert, row)) for row in rows]
+
+    def stall(self, duration: float) -> None:
+        """Stalls the database for given number of seconds."""
+        self.stalled_until = time.time() + duration
+
+    def running(self) -> List[str]:
+        """Returns IP addresses of nodes currently running a scheduler."""
+        return [ip for ip, _, stop in self.intervals if stop is None]
+
+
+class Node:
+    """A simulated multischeduler host.
+
+    Attributes:
+        ip: A string, the node's simulated public IP address.
+        simulation: The Simulation to which the node belongs.
+        killed: A boolean indicating whether the host is down.
+        partitioned: A boolean indicating whether the host is cut off from
+                     the database and queue.
+        scheduler: The node's most recently launched FakeScheduler, if any.
+        crashes: A list of the exceptions that crashed the Multischeduler.
+        thread: The threading.Thread supervising the node's Multischeduler.
+    """
+
+    def __init__(self, ip: str, simulation: Simulation) -> None:
+        """Initializes Node with given IP address in given Simulation."""
+        self.ip = ip
+        self.simulation = simulation
+        self.killed = False
+        self.partitioned = False
+        self.scheduler: FakeScheduler = None
+        self.crashes: List[Exception] = []
+        self.thread = threading.Thread(target=self.supervise)
+        self.thread.daemon = True
+
+    def check(self, unreachable: type) -> None:
+        """Raises Killed if node is down, or given exception type if it is
+           partitioned."""
+        if self.killed:
+            raise Killed()
+        if self.partitioned:
+            raise unreachable(f"{self.ip} is partitioned")
+
+    def supervise(self) -> None:
+        """Runs and, should it crash, restarts a Multischeduler on the node,
+           until the simulation is finished."""
+        while not self.simulation.finished:
+            if self.killed:
+                time.sleep(.01)
+                continue
+            try:
+                SimulatedMultischeduler(self)
+            except Killed:
+                pass
+            except Exception as error:  # as systemd would, restart on crash
+                self.crashes.append(error)
+            if self.scheduler:
+                self.scheduler.send_signal(None)
+            if not self.killed:
+                time.sleep(self.simulation.restart_delay)
+
+    def kill(self) -> None:
+        """Takes the node down, along with its scheduler."""
+        self.killed = True
+        if self.scheduler:
+            self.scheduler.send_signal(None)
+
+    def revive(self) -> None:
+        """Brings the node back up."""
+        self.killed = False
+
+
+class FakeScheduler:
+    """Stand-in for an Airflow scheduler process, recording when it runs.
+
+    Attributes:
+        returncode: None while running, then 0.
+        interval: The list [ip, start, stop] in its Simulation's intervals
+                  recording when it ran.
+    """
+
+    def __init__(self, node: Node) -> None:
+        """Starts FakeScheduler on given Node."""
+        self.returncode: Optional[int] = None
+        self.interval = [node.ip, time.time(), None]
+        node.simulation.intervals.append(self.interval)
+        node.scheduler = self
+
+    def poll(self) -> Optional[int]:
+        """Returns returncode."""
+        return self.returncode
+
+    def send_signal(self, signal: Any) -> None:
+        """Stops FakeScheduler, if running."""
+        if self.returncode is None:
+            self.returncode = 0
+            self.interval[2] = time.time()
+
+
+class SimCursor:
+    """Stand-in for a psycopg2 cursor on the simulated database."""
+
+    def __init__(self, node: Node) -> None:
+        """Initializes SimCursor for given Node."""
+        self.node = node
+        self.rows: List[tuple] = []
+
+    def execute(self, query: Any) -> None:
+        """Executes given query, a string or psycopg2.sql.SQL."""
+        self.node.check(psycopg2.OperationalError)
+        self.rows = self.node.simulation.execute(getattr(query, 'string',
+                                                         query))
+        self.node.check(psycopg2.OperationalError)
+
+    def fetchone(self) -> Optional[tuple]:
+        """Returns the next row of the last result, if any."""
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self) -> List[tuple]:
+        """Returns all remaining rows of the last result."""
+        rows, self.rows = self.rows, []
+        return rows
+
+
+class SimConnection:
+    """Stand-in for a psycopg2 connection to the simulated database."""
+
+    def commit(self) -> None:
+        """Does nothing, since every statement commits on its own."""
+
+    def rollback(self) -> None:
+        """Does nothing, since every statement commits on its own."""
+
+    def close(self) -> None:
+        """Does nothing."""
+
+
+class SimDatabase:
+    """Stand-in for a Database (see hfshared.py) as reached from a Node."""
+
+    def __init__(self, node: Node) -> None:
+        """Initializes SimDatabase as reached from given Node."""
+        self.node = node
+        self.conn: SimConnection = None
+        self.cur: SimCursor = None
+
+    def connect(self, credentials: Any) -> None:
+        """Connects, unless the node is down or partitioned."""
+        self.node.check(psycopg2.OperationalError)
+        self.conn = SimConnection()
+        self.cur = SimCursor(self.node)
+
+    def disconnect(self) -> None:
+        """Disconnects."""
+        self.conn = None
+        self.cur = None
+
+
+class SimChannel:
+    """Stand-in for a pika channel, counting messages published."""
+
+    def __init__(self, node: Node) -> None:
+        """Initializes SimChannel as opened from given Node."""
+        self.node = node
+
+    def queue_declare(self, *args, **kwargs) -> None:
+        """Does nothing."""
+
+    def basic_publish(self, *args, **kwargs) -> None:
+        """Counts a published message, unless node is down or partitioned."""
+        self.node.check(pika.exceptions.AMQPConnectionError)
+        self.node.simulation.messages += 1
+
+    def close(self) -> None:
+        """Does nothing."""
+
+
+class SimQueueHost:
+    """Stand-in for a QueueHost (see hfshared.py) as reached from a Node."""
+
+    def __init__(self, node: Node) -> None:
+        """Initializes SimQueueHost as reached from given Node."""
+        self.node = node
+        self.connection: Any = None
+        self.channel: SimChannel = None
+
+    def connect(self, credentials: Any) -> None:
+        """Connects, unless the node is down or partitioned."""
+        self.node.check(pika.exceptions.AMQPConnectionError)
+        self.connection = True
+        self.channel = SimChannel(self.node)
+
+    def disconnect(self) -> None:
+        """Disconnects."""
+        self.connection = None
+        self.channel = None
+
+
+class SimStore(CoordinationStore):
+    """Stand-in for a remote CoordinationStore (see coordination.py) as
+       reached from a Node, backed by the simulation's MemoryStore."""
+
+    def __init__(self, node: Node) -> None:
+        """Initializes SimStore as reached from given Node."""
+        self.node = node
+        self.store = node.simulation.store
+
+    def connect(self) -> None:
+        """Raises StoreUnavailable if the Node is cut off."""
+        self.node.check(StoreUnavailable)
+
+    def register(self, ip: str) -> datetime:
+        """Returns birth registered in the shared MemoryStore, unless
+           the Node is cut off."""
+        self.node.check(StoreUnavailable)
+        return self.store.register(ip)
+
+    def check_in(self, ip: str, birth: datetime) -> None:
+        """Records check-in in the shared MemoryStore, unless the Node
+           is cut off."""
+        self.node.check(StoreUnavailable)
+        self.store.check_in(ip, birth)
+
+    def toss_stale(self, grace_period: timedelta) -> None:
+        """Purges stale check-ins from the shared MemoryStore, unless
+           the Node is cut off."""
+        self.node.check(StoreUnavailable)
+        self.store.toss_stale(grace_period)
+
+    def leader(self) -> str:
+        """Returns leader per the shared MemoryStore, unless the Node is
+           cut off."""
+        self.node.check(StoreUnavailable)
+        return self.store.leader()
+
+    def active(self) -> Set[str]:
+        """Returns schedulers active per the shared MemoryStore, unless
+           the Node is cut off."""
+        self.node.check(StoreUnavailable)
+        return self.store.active()
+
+    def checkins(self) -> CheckIns:
+        """Returns check-ins in the shared MemoryStore, unless the Node
+           is cut off."""
+        self.node.check(StoreUnavailable)
+        return self.store.checkins()
+
+    def remove(self, ips: Iterable[str]) -> None:
+        """Purges check-ins of given IP addresses from the shared
+           MemoryStore, unless the Node is cut off."""
+        self.node.check(StoreUnavailable)
+        self.store.remove(ips)
+
+
+class SimulatedMultischeduler(Multischeduler):
+    """Multischeduler running on a simulated Node."""
+
+    def __init__(self, node: Node) -> None:
+        """Initializes SimulatedMultischeduler on given Node, which (like any
+           Multischeduler) runs until it crashes or is killed."""
+        self.node = node
+        self.RECONNECT_DELAY = node.simulation.reconnect_delay
+        super().__init__(Services(SimDatabase(node), SimQueueHost(node)),
+                         {'db': None, 'q': None},
+                         node.simulation.timing,
+                         fencing=node.simulation.fencing,
+                         detector=(PhiAccrualDetector(node.simulation.phi)
+                                   if node.simulation.phi else None),
+                         identity=ConfiguredIdentity(node.ip),
+                         store=(SimStore(node) if node.simulation.store
+                                else None))
+
+    def launch_scheduler(self) -> FakeScheduler:
+        """Launches and returns a FakeScheduler on the Node."""
+        return FakeScheduler(self.node)
+
+
+class Outcome(NamedTuple):
+    """Measurements of a single simulated fault.
+
+    Attributes:
+        takeover: Seconds from the fault until a node other than the old
+                  leader started its scheduler (None if none did).
+        downtime: Seconds after the fault with no scheduler running.
+        overlap: Seconds with two or more schedulers running at once.
+        overlaps: Number of separate intervals of such overlap.
+        qps: Database statements per second over the whole simulation.
+        crashes: Number of Multischeduler crashes over all nodes.
+    """
+
+    takeover: Optional[float]
+    downtime: float
+    overlap: float
+    overlaps: int
+    qps: float
+    crashes: int
+
+
+def simulate(nodes: int,
+             timing: Dict[str, Any],
+             fault: str,
+             fault_duration: float,
+             warmup: float,
+             settle: float,
+             reconnect_delay: float,
+             restart_delay: float,
+             fencing: bool = False,
+             phi: float = None,
+             store: str = 'database') -> Outcome:
+    """Simulates given number of nodes with given timing, fencing, detector
+       threshold, and store of check-ins, injecting given fault (of given
+       duration, where applicable) into the leader after given warmup, and
+       measures the Outcome after given settling time."""
+    simulation = Simulation(timing,
+                            reconnect_delay,
+                            restart_delay,
+                            fencing,
+                            phi,
+                            store)
+    begin = time.time()
+    for index in range(nodes):
+        node = Node(f"10.0.0.{index + 1}", simulation)
+        simulation.nodes[node.ip] = node
+        node.thread.start()
+        time.sleep(.01)  # so that births are distinct
+    time.sleep(warmup)
+
+    fault_time = time.time()
+    running = simulation.running()
+    leader = simulation.nodes[running[0]] if running else None
+    if fault == 'kill' and leader:
+        leader.kill()
+    elif fault == 'partition' and leader:
+        leader.partitioned = True
+    elif fault == 'stall':
+        simulation.stall(fault_duration)
+    if fault in {'partition', 'stall'}:
+        time.sleep(fault_duration)
+        if leader:
+            leader.partitioned = False
+        time.sleep(settle - fault_duration)
+    else:
+        time.sleep(settle)
+    end = time.time()
+    simulation.finished = True
+    for node in simulation.nodes.values():
+        node.kill()
+
+    intervals = [(ip, start, stop or end)
+                 for ip, start, stop in simulation.intervals]
+    starts = [start for ip, start, _ in intervals
+              if start >= fault_time and (not leader or ip != leader.ip)]
+    takeover = min(starts) - fault_time if starts else None
+    events = sorted([(start, 1) for _, start, _ in intervals]
+                    + [(stop, -1) for _, _, stop in intervals])
+    downtime = overlap = 0.
+    overlaps = 0
+    count = 0
+    previous = begin
+    for moment, change in events + [(end, 0)]:
+        if count == 0:
+            downtime += max(0., moment - max(previous, fault_time))
+        elif count >= 2:
+            overlap += moment - previous
+        if count == 1 and change == 1:
+            overlaps += 1
+        count += change
+        previous = moment
+    crashes = sum(len(node.crashes) for node in simulation.nodes.values())
+    return Outcome(takeover,
+                   downtime,
+                   overlap,
+                   overlaps,
+                   simulation.queries / (end - begin),
+                   crashes)
+
+
+def main() -> None:
+    """Simulates faults under every combination of timing parameters given
+       on the command line and reports mean Outcomes."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--fault', choices=['kill', 'partition', 'stall'],
+                        default='kill')
+    parser.add_argument('--fault-duration', type=float, default=5,
+                        help='seconds a partition or stall lasts')
+    parser.add_argument('--checkin', type=float, nargs='+', default=[.5],
+                        help='time_between_checkins, in seconds')
+    parser.add_argument('--grace', type=float, nargs='+', default=[3],
+                        help='grace_period, in seconds')
+    parser.add_argument('--patience', type=float, nargs='+', default=[.5],
+                        help='patience, in seconds')
+    parser.add_argument('--reconnect-delay', type=float, default=3)
+    parser.add_argument('--restart-delay', type=float, default=.5)
+    parser.add_argument('--warmup', type=float, default=5,
+                        help='seconds to run before injecting the fault')
+    parser.add_argument('--settle', type=float, default=15,
+                        help='seconds to run after injecting the fault')
+    parser.add_argument('--trials', type=int, default=1)
+    parser.add_argument('--fencing', action='store_true',
+                        help='fence leaders (so disregarding patience)')
+    parser.add_argument('--phi', type=float,
+                        help='threshold of phi accrual failure detector')
+    parser.add_argument('--store', choices=['database', 'memory'],
+                        default='database',
+                        help='where Multischedulers keep their check-ins')
+    args = parser.parse_args()
+
+    print(f"{'checkin':>8} {'grace':>6} {'patience':>8} {'takeover':>9} "
+          f"{'downtime':>9} {'overlap':>8} {'overlaps':>8} {'qps':>7} "
+          f"{'crashes':>7}")
+    for checkin, grace, patience in itertools.product(args.checkin,
+                                                      args.grace,
+                                                      args.patience):
+        timing = {'time_between_checkins': timedelta(seconds=checkin),
+                  'grace_period': timedelta(seconds=grace),
+                  'patience': patience}
+        with open(os.devnull, 'w') as devnull:  # silence Multischedulers
+            with contextlib.redirect_stdout(devnull):
+                outcomes = [simulate(args.nodes,
+                                     timing,
+                                     args.fault,
+                                     args.fault_duration,
+                                     args.warmup,
+                                     args.settle,
+                                     args.reconnect_delay,
+                                     args.restart_delay,
+                                     args.fencing,
+                                     args.phi,
+                                     args.store)
+                            for _ in range(args.trials)]
+        takeovers = [outcome.takeover for outcome in outcomes
+                     if outcome.takeover is not None]
+        takeover = (f"{sum(takeovers) / len(takeovers):>9.2f}" if takeovers
+                    else f"{'none':>9}")
+
+        def mean(field: str) -> float:
+            return sum(getattr(outcome, field)
+                       for outcome in outcomes) / len(outcomes)
+
+        print(f"{checkin:>8} {grace:>6} {patience:>8} {takeover} "
+              f"{mean('downtime'):>9.2f} {mean('overlap'):>8.2f} "
+              f"{mean('overlaps'):>8.1f} {mean('qps'):>7.1f} "
+              f"{mean('crashes'):>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# test_coordination.py
+
+"""Tests that PostgresStore hands the failure detector timestamps it can
+compare.
+
+The schedulers table holds plain timestamp columns, which psycopg2 returns as
+naive datetimes, so the store's current time must be naive too. Against a
+live Postgres (named by the HEIRFLOW_TEST_DSN environment variable, as a
+libpq connection string) the real types are checked; otherwise a cursor
+typing each column as psycopg2 would stands in for the server.
+"""
+
+from datetime import datetime, timedelta
+import os
+import re
+
+import psycopg2
+import pytest
+
+from coordination import PostgresStore
+from detector import PhiAccrualDetector
+from hfshared import Database
+
+
+class TypingCursor:
+    """Cursor answering the check-ins query of PostgresStore with rows
+       typed as psycopg2 types them: naive for timestamp columns and
+       LOCALTIMESTAMP, offset-aware for CURRENT_TIMESTAMP."""
+
+    def __init__(self, birth: datetime) -> None:
+        self.latest = birth
+        self.rows = []
+
+    def execute(self, statement) -> None:
+        text = statement.string
+        columns = re.match(r'SELECT (.*) FROM', text).group(1).split(', ')
+        now = datetime.now()
+        if columns[-1] == 'CURRENT_TIMESTAMP':
+            now = now.astimezone()
+        self.latest += timedelta(seconds=1)
+        self.rows = [('10.0.0.1', self.latest, now)]
+
+    def fetchall(self):
+        return self.rows
+
+
+class Connection:
+    """Connection committing nothing."""
+
+    def commit(self) -> None:
+        pass
+
+
+def feed(detector: PhiAccrualDetector, store: PostgresStore) -> datetime:
+    """Feeds detector the store's check-ins, returning the store's time."""
+    checkins, now = store.checkins()
+    for ip, latest in checkins:
+        detector.heartbeat(ip, latest)
+        detector.phi(ip, now)
+    return now
+
+
+def test_checkins_time_is_naive():
+    db = Database('localhost', 'airflow')
+    db.conn = Connection()
+    db.cur = TypingCursor(datetime.now() - timedelta(minutes=1))
+    store = PostgresStore(db)
+    detector = PhiAccrualDetector()
+    for _ in range(PhiAccrualDetector.MIN_INTERVALS + 1):
+        now = feed(detector, store)
+    assert now.tzinfo is None
+
+
+@pytest.mark.skipif('HEIRFLOW_TEST_DSN' not in os.environ,
+                    reason="no Postgres to test against")
+def test_checkins_time_is_naive_in_postgres():
+    db = Database('localhost', 'airflow')
+    db.conn = psycopg2.connect(os.environ['HEIRFLOW_TEST_DSN'])
+    db.cur = db.conn.cursor()
+    try:
+        db.cur.execute('CREATE TEMPORARY TABLE schedulers '
+                       '(ip varchar(15), birth timestamp, latest timestamp)')
+        store = PostgresStore(db)
+        detector = PhiAccrualDetector()
+        birth = store.register('10.0.0.1')
+        for _ in range(PhiAccrualDetector.MIN_INTERVALS + 1):
+            store.check_in('10.0.0.1', birth)
+            now = feed(detector, store)
+        assert birth.tzinfo is None and now.tzinfo is None
+        assert detector.latest['10.0.0.1'].tzinfo is None
+    finally:
+        db.disconnect()
@@ -0,0 +1,83 @@
+# test_interface.py
+
+"""Tests that SchedulerCluster applies, in order of time, Messages from the
+Reconciler along with those published by multischedulers.
+
+Published Messages carry the naive timestamps of the scheduler_status table,
+so the Reconciler's must be naive too. A cursor typing each column as
+psycopg2 would stands in for the database.
+"""
+
+from datetime import datetime, timedelta
+
+from hfshared import Database, Message, StatusUpdate
+from interface import Reconciler, SchedulerCluster
+
+IP = '10.0.0.1'
+
+
+class TypingCursor:
+    """Cursor answering the queries of Reconciler about a single scheduler
+       with rows typed as psycopg2 types them: naive for timestamp columns
+       and LOCALTIMESTAMP, offset-aware for CURRENT_TIMESTAMP."""
+
+    def __init__(self, birth: datetime) -> None:
+        self.birth = birth
+        self.rows = []
+
+    def execute(self, statement: str) -> None:
+        if statement.startswith('SELECT ip, birth, latest'):
+            self.rows = [(IP, self.birth, self.birth)]
+            return
+        now = datetime.now()
+        if 'CURRENT_TIMESTAMP' in statement:
+            now = now.astimezone()
+        self.rows = [(self.birth, now)]
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0]
+
+
+class Connection:
+    """Connection committing nothing."""
+
+    def commit(self) -> None:
+        pass
+
+
+def reconciler(cluster: SchedulerCluster) -> Reconciler:
+    """Returns Reconciler of given SchedulerCluster against a database in
+       which a scheduler checked in a second ago."""
+    db = Database('localhost', 'airflow')
+    db.conn = Connection()
+    db.cur = TypingCursor(datetime.now() - timedelta(seconds=1))
+    return Reconciler(cluster, db, None, period=0)
+
+
+def test_published_after_reconciled():
+    cluster = SchedulerCluster()
+    assert reconciler(cluster).reconcile()
+    assert cluster.dict[IP].available
+    cluster.consume(Message(sender=IP,
+                            subject=IP,
+                            status=StatusUpdate.UNAVAILABLE,
+                            timestamp=datetime.now()))
+    assert not cluster.dict[IP].available
+
+
+def test_reconciled_after_published():
+    cluster = SchedulerCluster()
+    cluster.consume(Message(sender=IP,
+                            subject=IP,
+                            status=StatusUpdate.UNAVAILABLE,
+                            timestamp=datetime.now() - timedelta(minutes=1)))
+    assert reconciler(cluster).reconcile()
+    assert cluster.dict[IP].available
+    cluster.consume(Message(sender=IP,
+                            subject=IP,
+                            status=StatusUpdate.UNAVAILABLE,
+                            timestamp=datetime.now() - timedelta(minutes=1)))
+    assert cluster.dict[IP].available
@@ -0,0 +1,296 @@
+# transitions.py
+
+"""Log of the transitions of multischedulers, and analytics thereof.
+
+The interface (see interface.py) otherwise knows only the latest status of
+each multischeduler. A TransitionLog records every Message it applies, along
+with the time (by the interface's clock) the Message was received, in a
+bounded ring buffer in memory and, unless disabled, in an append-only file of
+one tab-separated line per Transition, from whose tail the ring buffer is
+refilled when the interface restarts. Replaying the Transitions in order
+yields
+
+    leader gaps
+        the intervals during which no available multischeduler was known to
+        be leading, from the leader's reported unavailability until another
+        was reported leading (a failover, as seen by the interface)
+    stale following
+        for each follower of a leader reported unavailable, how long it went
+        on following that leader before following another (or becoming
+        unavailable itself)
+    flaps
+        for each multischeduler, how often it went from available to
+        unavailable, per hour observed
+    availability
+        for each multischeduler, the fraction of the time observed (since its
+        first Transition) that it was available
+
+Times are those at which the interface received the Messages, so they include
+the delays of the queue, and any period during which the interface was not
+running counts as if nothing had changed.
+"""
+
+from collections import deque
+from datetime import datetime
+import math
+import threading
+import time
+from typing import (Deque,
+                    Dict,
+                    List,
+                    NamedTuple,
+                    Optional,
+                    Sequence,
+                    Set,
+                    Tuple)
+
+from hfshared import Message, StatusUpdate
+
+
+class Transition(NamedTuple):
+    """Message applied by the interface, with the time it was received.
+
+    Attributes:
+        received: A float, the time (per time.time()) the Message was
+                  received.
+        sender: A string, the IP address of the Message's sender.
+        subject: A string, the IP address of the Message's subject.
+        status: A StatusUpdate, the Message's status.
+        timestamp: A datetime, the Message's timestamp (by the database's
+                   clock), or None if it had none.
+    """
+
+    received: float
+    sender: str
+    subject: str
+    status: StatusUpdate
+    timestamp: datetime = None
+
+    def to_line(self) -> str:
+        """Returns Transition as a line of the log file."""
+        timestamp = self.timestamp.isoformat() if self.timestamp else '-'
+        return (f"{self.received:.3f}\t{self.sender}\t{self.subject}\t"
+                f"{self.status.value}\t{timestamp}\n")
+
+    @classmethod
+    def from_line(cls, line: str) -> 'Transition':
+        """Returns Transition read from given line of the log file, or raises
+           ValueError."""
+        received, sender, subject, status, timestamp = line.split('\t')
+        timestamp = timestamp.strip()
+        return cls(received=float(received),
+                   sender=sender,
+                   subject=subject,
+                   status=StatusUpdate(status),
+                   timestamp=(datetime.fromisoformat(timestamp)
+                              if timestamp != '-' else None))
+
+
+class TransitionLog:
+    """Bounded ring buffer of Transitions, spilled to an append-only file.
+
+    Attributes:
+        path: A string, the path of the log file, or None if Transitions are
+              kept in memory alone.
+        ring: A deque of at most capacity Transitions, in order received.
+        file: The log file, open for appending, or None.
+        lock: A threading.Lock serializing access to ring and file.
+    """
+
+    def __init__(self, path: str = None, capacity: int = 10000) -> None:
+        """Initializes TransitionLog of given capacity, refilled from and
+           spilled to the file at given path, if any."""
+        self.path = path or None
+        self.ring: Deque[Transition] = deque(maxlen=capacity)
+        self.file = None
+        self.lock = threading.Lock()
+        if self.path:
+            self.load()
+            self.file = open(self.path, 'a', buffering=1)
+
+    def load(self) -> None:
+        """Fills ring from the tail of the log file, if any, skipping lines
+           that cannot be read (as a line cut short by a crash)."""
+        try:
+            with open(self.path) as file:
+                for line in deque(file, maxlen=self.ring.maxlen):
+                    try:
+                        self.ring.append(Transition.from_line(line))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+
+    def record(self, message: Message, received: float = None) -> None:
+        """Appends given Message, received at given time (by default now), to
+           ring and log file."""
+        transition = Transition(
+            received=time.time() if received is None else received,
+            sender=message.sender,
+            subject=message.subject,
+            status=message.status,
+            timestamp=message.timestamp)
+        with self.lock:
+            self.ring.append(transition)
+            if self.file:
+                self.file.write(transition.to_line())
+
+    def transitions(self, since: float = None) -> List[Transition]:
+        """Returns Transitions in ring received at or after given time (by
+           default all of them), in order received."""
+        with self.lock:
+            return [transition for transition in self.ring
+                    if since is None or transition.received >= since]
+
+    def close(self) -> None:
+        """Closes log file."""
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+
+class Replay:
+    """Reconstruction of the cluster's history from Transitions.
+
+    Attributes:
+        start: A float, the time of the first Transition replayed.
+        end: A float, the time at which the replay was closed.
+        gaps: A list of (start, end) pairs, the leader gaps (end None if
+              still open).
+        stale: A list of (follower, leader, seconds) triples, how long each
+               follower of a leader reported unavailable went on following
+               it (seconds None if it still does).
+        first: A dict with keys IP addresses and values the times of their
+               first Transitions.
+        uptime: A dict with keys IP addresses and values the seconds they
+                were available.
+        flaps: A dict with keys IP addresses and values the number of times
+               they went from available to unavailable.
+        available: A dict with keys IP addresses of schedulers available and
+                   values the times they became so.
+        following: A dict with keys IP addresses and values the IP addresses
+                   of the leaders they follow.
+        leading: A set of IP addresses of schedulers leading.
+        gap_start: A float, the start of the open leader gap, if any.
+        dead: A dict with keys IP addresses of followers of leaders reported
+              unavailable and values pairs of those leaders and the times
+              they were so reported.
+    """
+
+    def __init__(self,
+                 transitions: Sequence[Transition],
+                 end: float = None) -> None:
+        """Initializes Replay of given Transitions, closed at given time (by
+           default now)."""
+        self.start = transitions[0].received if transitions else None
+        self.end = time.time() if end is None else end
+        self.gaps: List[Tuple[float, Optional[float]]] = []
+        self.stale: List[Tuple[str, str, Optional[float]]] = []
+        self.first: Dict[str, float] = {}
+        self.uptime: Dict[str, float] = {}
+        self.flaps: Dict[str, int] = {}
+        self.available: Dict[str, float] = {}
+        self.following: Dict[str, str] = {}
+        self.leading: Set[str] = set()
+        self.gap_start: float = None
+        self.dead: Dict[str, Tuple[str, float]] = {}
+        for transition in transitions:
+            self.apply(transition)
+        self.close()
+
+    def apply(self, transition: Transition) -> None:
+        """Applies given Transition as the interface's SchedulerCluster
+           would."""
+        now = transition.received
+        recipients = [(transition.subject, transition.status)]
+        if transition.status == StatusUpdate.LEADER:
+            recipients.append((transition.sender, transition.subject))
+        for ip, news in recipients:
+            self.first.setdefault(ip, now)
+            self.uptime.setdefault(ip, 0.)
+            self.flaps.setdefault(ip, 0)
+            if news == StatusUpdate.AVAILABLE:
+                self.available.setdefault(ip, now)
+            elif news == StatusUpdate.UNAVAILABLE:
+                self.leave(ip, now)
+            elif news == StatusUpdate.LEADER:
+                self.leading.add(ip)
+            else:  # news is the IP address of the leader followed
+                self.follow(ip, news, now)
+        if self.leading and self.gap_start is not None:
+            self.gaps.append((self.gap_start, now))
+            self.gap_start = None
+
+    def leave(self, ip: str, now: float) -> None:
+        """Makes scheduler with given IP address unavailable at given time."""
+        if ip in self.available:
+            self.uptime[ip] += now - self.available.pop(ip)
+            self.flaps[ip] += 1
+        self.follow(ip, None, now)
+        if ip in self.leading:
+            self.leading.discard(ip)
+            if not self.leading:
+                self.gap_start = now
+        for follower, leader in self.following.items():
+            if leader == ip and follower != ip and follower not in self.dead:
+                self.dead[follower] = (ip, now)
+
+    def follow(self, ip: str, leader: Optional[str], now: float) -> None:
+        """Makes scheduler with given IP address follow given leader (or
+           none) from given time."""
+        if ip in self.dead and leader != self.dead[ip][0]:
+            dead, since = self.dead.pop(ip)
+            self.stale.append((ip, dead, now - since))
+        if leader:
+            self.following[ip] = leader
+        else:
+            self.following.pop(ip, None)
+
+    def close(self) -> None:
+        """Accounts for all that remains as of end."""
+        for ip, since in self.available.items():
+            self.uptime[ip] += self.end - since
+        if self.gap_start is not None:
+            self.gaps.append((self.gap_start, None))
+        for follower, (dead, _) in self.dead.items():
+            self.stale.append((follower, dead, None))
+
+    def gap_durations(self) -> List[float]:
+        """Returns durations in seconds of closed leader gaps."""
+        return [end - start for start, end in self.gaps if end is not None]
+
+    def availability(self) -> Dict[str, float]:
+        """Returns fraction of time each scheduler was available since its
+           first Transition."""
+        return {ip: (self.uptime[ip] / (self.end - self.first[ip])
+                     if self.end > self.first[ip] else 1.)
+                for ip in self.first}
+
+    def flap_rates(self) -> Dict[str, float]:
+        """Returns flaps per hour of each scheduler since its first
+           Transition."""
+        return {ip: (self.flaps[ip] * 3600. / (self.end - self.first[ip])
+                     if self.end > self.first[ip] else 0.)
+                for ip in self.first}
+
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    """Returns given percentile (0 to 100) of given values by the nearest-rank
+       method, or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100. * len(ordered)) - 1)]
+
+
+def summarize(values: Sequence[float],
+              qs: Sequence[float] = (50, 90, 99)) -> str:
+    """Returns count, minimum, given percentiles, and maximum of given
+       values, as a line of text."""
+    if not values:
+        return "none"
+    parts = ([f"min {min(values):.3g}"]
+             + [f"p{q:g} {percentile(values, q):.3g}" for q in qs]
+             + [f"max {max(values):.3g}"])
+    return f"{len(values)}: " + ', '.join(parts)
@@ -0,0 +1,63 @@
+# warm_scheduler.py
+
+"""Warm standby Airflow scheduler, launched by multischeduler.py.
+
+Cold-starting `airflow scheduler` on a newly elected leader means importing
+Airflow and then importing and parsing every DAG file (along with every
+module the DAG files import) before anything is scheduled. A standby
+multischeduler in warm mode instead keeps this script running: it imports
+Airflow and parses the DAG folder into a DagBag up front, then reparses any
+DAG files modified since, every given number of seconds, while it waits.
+
+On SIGUSR1 (sent by the multischeduler upon accepting leadership) it starts
+scheduling in process. The DAG file processors that the scheduler forks
+inherit every module already imported, Airflow and whatever the DAG files
+import, so promotion skips the import work of a cold start; the processors
+still parse the DAG files themselves, as the scheduler's own DagBags are not
+the one kept warm here. The handler of SIGUSR1 is installed before anything
+else is imported, so that a promotion signalled while the script is still
+starting up is not lost (nor, by default, fatal); only in the moments before
+the interpreter runs the script can it be, which the multischeduler detects.
+Until promoted SIGINT or SIGTERM simply ends the script; thereafter they stop
+the scheduler as they would `airflow scheduler`.
+
+Usage:
+    python3 warm_scheduler.py [REFRESH_SECONDS]
+"""
+
+import signal
+
+promoted = False
+
+
+def promote(signum, frame) -> None:
+    """Handles SIGUSR1 by marking the standby promoted."""
+    global promoted
+    promoted = True
+
+
+signal.signal(signal.SIGUSR1, promote)  # before the slow imports below
+
+import sys  # noqa: E402
+import time  # noqa: E402
+
+from airflow import settings  # noqa: E402
+from airflow.jobs import SchedulerJob  # noqa: E402
+from airflow.models import DagBag  # noqa: E402
+
+
+def main() -> None:
+    """Keeps DagBag warm until promoted, then runs the scheduler."""
+    refresh = float(sys.argv[1]) if len(sys.argv) > 1 else 60.
+    dagbag = DagBag(settings.DAGS_FOLDER)
+    refreshed = time.monotonic()
+    while not promoted:
+        time.sleep(.1)
+        if time.monotonic() - refreshed > refresh:
+            dagbag.collect_dags(only_if_updated=True)
+            refreshed = time.monotonic()
+    SchedulerJob(subdir=settings.DAGS_FOLDER, num_runs=-1).run()
+
+
+if __name__ == '__main__':
+    main()